@@ -0,0 +1,12 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of Tarpon's hot paths over synthetic docsets.
+
+Run them from the top of the source tree::
+
+    $ python -m benchmarks.run --sizes 10000,100000 --output results.json
+    $ python -m benchmarks.run --compare results.json
+
+See :mod:`benchmarks.docsetgen` for the docsets they run against.
+"""
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Generator of synthetic Dash docsets.
+
+A generated docset has an ``Info.plist``, a ``docSet.dsidx`` whose
+``searchIndex`` table holds the requested number of items, and a stub HTML
+page for every page the items point to. The same arguments always produce
+the same docset.
+
+    $ python -m benchmarks.docsetgen /tmp/docsets Synthetic 100000
+"""
+
+import argparse
+import os
+import plistlib
+import random
+import sqlite3
+
+# Item types and their relative frequency, roughly those of a Python docset
+TYPE_MIX = (("Function", 35), ("Method", 30), ("Class", 12), ("Attribute", 10),
+            ("Module", 5), ("Constant", 4), ("Exception", 2), ("Guide", 2))
+
+WORDS = ("get", "set", "dict", "list", "open", "read", "write", "path",
+         "join", "split", "item", "value", "key", "update", "copy", "sort",
+         "parse", "format", "socket", "thread", "queue", "stream", "buffer",
+         "encode", "decode", "request", "response", "handler", "window")
+
+PAGE = """<html>
+<head><title>{name} {page}</title></head>
+<body><h1>{name} {page}</h1>{anchors}</body>
+</html>
+"""
+
+
+def parse_type_mix(text):
+    """
+    Parses a type mix given as ``Type:weight,Type:weight``.
+
+    :type text: str
+    :rtype: tuple
+    :returns: ``(type, weight)`` pairs
+    """
+    mix = []
+    for part in text.split(","):
+        data_type, _, weight = part.partition(":")
+        mix.append((data_type.strip(), int(weight or 1)))
+    return tuple(mix)
+
+
+def item_names(count, seed=0):
+    """
+    Yields dotted item names such as ``socket.read2.join``.
+
+    :type count: int
+    :type seed: int
+    """
+    rng = random.Random(seed)
+    for _ in xrange(count):
+        parts = []
+        for _ in xrange(rng.randint(1, 3)):
+            word = rng.choice(WORDS)
+            if rng.random() < 0.5:
+                word += str(rng.randint(0, 99))
+            parts.append(word)
+        yield ".".join(parts)
+
+
+def generate_docset(root, name, items, type_mix=TYPE_MIX, pages=500, seed=0):
+    """
+    Writes a synthetic docset, unless it already exists.
+
+    :type root: str
+    :param root: directory the ``.docset`` directory is created in
+    :type name: str
+    :param name: name of the docset
+    :type items: int
+    :param items: number of rows in ``searchIndex``
+    :type type_mix: tuple
+    :param type_mix: ``(type, weight)`` pairs the item types are drawn from
+    :type pages: int
+    :param pages: number of HTML pages the items are spread over
+    :type seed: int
+    :rtype: str
+    :returns: path of the ``.docset`` directory
+    """
+    path = os.path.join(root, name + ".docset")
+    if os.path.exists(path):
+        return path
+    tmp_path = path + ".tmp"
+    resources = os.path.join(tmp_path, "Contents", "Resources")
+    documents = os.path.join(resources, "Documents")
+    os.makedirs(documents)
+    plistlib.writePlist({"CFBundleIdentifier": name.lower(),
+                         "CFBundleName": name,
+                         "DocSetPlatformFamily": name.lower(),
+                         "dashIndexFilePath": "index.html",
+                         "isDashDocset": True},
+                        os.path.join(tmp_path, "Contents", "Info.plist"))
+
+    rng = random.Random(seed)
+    types = [data_type for data_type, weight in type_mix
+             for _ in xrange(weight)]
+    db = sqlite3.connect(os.path.join(resources, "docSet.dsidx"))
+    try:
+        db.execute("CREATE TABLE searchIndex(id INTEGER PRIMARY KEY, "
+                   "name TEXT, type TEXT, path TEXT)")
+        db.execute("CREATE UNIQUE INDEX anchor ON searchIndex "
+                   "(name, type, path)")
+        rows = ((item_name, rng.choice(types),
+                 "page{0}.html#{1}.{2}".format(number % pages, item_name,
+                                               number))
+                for number, item_name in enumerate(item_names(items, seed)))
+        db.executemany("INSERT INTO searchIndex(name, type, path) "
+                       "VALUES (?, ?, ?)", rows)
+        db.commit()
+    finally:
+        db.close()
+
+    with open(os.path.join(documents, "index.html"), "w") as page_file:
+        page_file.write(PAGE.format(name=name, page="index", anchors=""))
+    for page in xrange(pages):
+        with open(os.path.join(documents, "page{0}.html".format(page)),
+                  "w") as page_file:
+            page_file.write(PAGE.format(name=name, page=page,
+                                        anchors="<p>Lorem ipsum</p>" * 20))
+    os.rename(tmp_path, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic Dash docset.")
+    parser.add_argument("root", help="directory to create the docset in")
+    parser.add_argument("name", help="name of the docset")
+    parser.add_argument("items", type=int, help="number of items")
+    parser.add_argument("--types", type=parse_type_mix,
+                        default=TYPE_MIX,
+                        help="type mix, e.g. Function:3,Class:1")
+    parser.add_argument("--pages", type=int, default=500,
+                        help="number of HTML pages")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(generate_docset(args.root, args.name, args.items, args.types,
+                          args.pages, args.seed))
+
+
+if __name__ == "__main__":
+    main()
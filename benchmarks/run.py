@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Runs the benchmarks and records their results as JSON.
+
+Every benchmark runs against a synthetic docset of each requested size,
+generated once into the work directory and reused by later runs. Each
+benchmark is repeated and the time of every run is recorded, so that two
+result files can be compared with ``--compare``.
+"""
+
+import argparse
+from collections import OrderedDict
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from timeit import default_timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "src"))
+
+from benchmarks.docsetgen import generate_docset
+from tarpon_app.docsets import Docset
+from tarpon_app.manifest import DocsetManifest
+from tarpon_app.search import SearchIndex
+from tarpon_app.snapshot import DocsetSnapshot
+
+FORMAT_VERSION = 1
+DEFAULT_SIZES = (10000, 100000, 1000000)
+QUERIES = (u"dict", u"socket.read", u"Handler", u"wrte", u"q", u"stream42",
+           u"update.copy.join", u"zzz")
+# Runs that are slower than the baseline by more than this are reported
+REGRESSION = 1.1
+
+
+class SkipBenchmark(Exception):
+    pass
+
+
+class Benchmark(object):
+    """
+    A timed operation on one docset. :meth:`setup` runs once, then
+    :meth:`prepare` and the timed :meth:`run` alternate for every repeat.
+    """
+
+    name = None
+
+    def __init__(self, path, workdir):
+        self.path = path
+        self.workdir = workdir
+
+    def setup(self):
+        pass
+
+    def prepare(self):
+        pass
+
+    def run(self):
+        raise NotImplementedError
+
+    def teardown(self):
+        pass
+
+
+class ItemsFromIndex(Benchmark):
+    """``Docset.items`` read from ``docSet.dsidx``."""
+
+    name = "items.dsidx"
+
+    def prepare(self):
+        self.docset = Docset.frompath(self.path)
+
+    def run(self):
+        self.docset.items
+
+
+class ItemsFromManifest(Benchmark):
+    """``Docset.items`` restored from the manifest cache."""
+
+    name = "items.manifest"
+
+    def setup(self):
+        self.cache_dir = tempfile.mkdtemp(dir=self.workdir)
+        self.manifest = DocsetManifest(self.cache_dir)
+        docset = Docset.frompath(self.path, manifest=self.manifest)
+        docset.items
+
+    def prepare(self):
+        self.docset = Docset.frompath(self.path, manifest=self.manifest)
+
+    def run(self):
+        self.docset.items
+
+    def teardown(self):
+        shutil.rmtree(self.cache_dir)
+
+
+class ItemsFromSnapshot(Benchmark):
+    """``Docset.items`` and their types mapped from the snapshot."""
+
+    name = "items.snapshot"
+
+    def setup(self):
+        self.cache_dir = tempfile.mkdtemp(dir=self.workdir)
+        docset = Docset.frompath(self.path)
+        docset.items
+        DocsetSnapshot(self.cache_dir).save([docset])
+
+    def prepare(self):
+        self.snapshot = DocsetSnapshot(self.cache_dir)
+
+    def run(self):
+        docset = self.snapshot.restore(self.path)
+        docset.items
+        docset.type_positions
+
+    def teardown(self):
+        shutil.rmtree(self.cache_dir)
+
+
+class LoadDocsetsCold(Benchmark):
+    """
+    What ``Application.load_docsets`` does for a docset on the first launch:
+    parse its ``Info.plist`` and record it in an empty manifest.
+    """
+
+    name = "load_docsets.cold"
+    cache_dir = None
+
+    def prepare(self):
+        self.teardown()
+        self.cache_dir = tempfile.mkdtemp(dir=self.workdir)
+        self.manifest = DocsetManifest(self.cache_dir)
+
+    def run(self):
+        Docset.frompath(self.path, manifest=self.manifest)
+        self.manifest.save()
+
+    def teardown(self):
+        if self.cache_dir:
+            shutil.rmtree(self.cache_dir)
+            self.cache_dir = None
+
+
+class LoadDocsetsWarm(LoadDocsetsCold):
+    """``Application.load_docsets`` for a docset that is in the manifest."""
+
+    name = "load_docsets.warm"
+
+    def setup(self):
+        LoadDocsetsCold.prepare(self)
+        Docset.frompath(self.path, manifest=self.manifest).type_counts
+        self.manifest.save()
+
+    def prepare(self):
+        pass
+
+
+class SearchMemory(Benchmark):
+    """Every query of :data:`QUERIES` with the in-memory search index."""
+
+    name = "search.memory"
+
+    def create_index(self):
+        return SearchIndex(self.cache_dir)
+
+    def setup(self):
+        self.cache_dir = tempfile.mkdtemp(dir=self.workdir)
+        self.docset = Docset.frompath(self.path)
+        self.prepare()
+
+    def prepare(self):
+        # A new index, built from the one cached on disk by the first, so that
+        # no run is answered from the result cache of the one before
+        self.index = self.create_index()
+        self.index.add(self.docset)
+
+    def run(self):
+        for query in QUERIES:
+            self.index.search(query, limit=20)
+
+    def teardown(self):
+        shutil.rmtree(self.cache_dir)
+
+
+class SearchFTS(SearchMemory):
+    """Every query of :data:`QUERIES` with the SQLite FTS5 backend."""
+
+    name = "search.fts"
+
+    def create_index(self):
+        from tarpon_app.fts import FTSIndex
+        return FTSIndex(self.cache_dir)
+
+    def setup(self):
+        try:
+            SearchMemory.setup(self)
+        except sqlite3.OperationalError as e:
+            self.teardown()
+            raise SkipBenchmark("FTS5 unavailable: {0}".format(e))
+
+
+class SidebarBuild(Benchmark):
+    """Filling the sidebar model with every type and item of a docset."""
+
+    name = "sidebar.build"
+
+    def setup(self):
+        try:
+            from tarpon_app.gtk.models import DocsetTreeModel
+        except ImportError as e:
+            raise SkipBenchmark("GTK unavailable: {0}".format(e))
+        self.model_class = DocsetTreeModel
+        self.docset = Docset.frompath(self.path)
+        self.docset.items
+
+    def run(self):
+        model = self.model_class()
+        model.add_docset(self.docset.name)
+        model.fill_docset(self.docset)
+        for data_type in self.docset.type_counts:
+            model.fill_type(self.docset, data_type)
+
+
+class ItemLookup(Benchmark):
+    """
+    The lookup ``TarponWindow.docitem_selected`` does to turn a sidebar row
+    into a page, for 10000 random items.
+    """
+
+    name = "docitem_selected.lookup"
+
+    def setup(self):
+        self.docset = Docset.frompath(self.path)
+        items = self.docset.items
+        rng = random.Random(0)
+        self.positions = [rng.randrange(len(items)) for _ in xrange(10000)]
+
+    def run(self):
+        docset = self.docset
+        for position in self.positions:
+            os.path.join(docset.doc_path, docset.items[position].path)
+
+
+BENCHMARKS = OrderedDict((benchmark.name, benchmark) for benchmark in (
+    ItemsFromIndex, ItemsFromManifest, ItemsFromSnapshot, LoadDocsetsCold,
+    LoadDocsetsWarm, SearchMemory, SearchFTS, SidebarBuild, ItemLookup))
+
+
+def measure(benchmark, repeat):
+    """
+    Times the runs of a benchmark.
+
+    :type benchmark: Benchmark
+    :type repeat: int
+    :rtype: list
+    :returns: seconds taken by every run
+    """
+    benchmark.setup()
+    try:
+        timings = []
+        for _ in xrange(repeat):
+            benchmark.prepare()
+            gc.collect()
+            start = default_timer()
+            benchmark.run()
+            timings.append(default_timer() - start)
+        return timings
+    finally:
+        benchmark.teardown()
+
+
+def run_benchmarks(names, sizes, repeat, workdir):
+    """
+    Runs benchmarks against docsets of every size.
+
+    :type names: list
+    :param names: names of the benchmarks to run
+    :type sizes: list
+    :param sizes: item counts of the docsets
+    :type repeat: int
+    :type workdir: str
+    :param workdir: directory the docsets are generated in
+    :rtype: list
+    :returns: one result dict per benchmark and size
+    """
+    results = []
+    for size in sizes:
+        path = generate_docset(workdir, "Bench{0}".format(size), size)
+        for name in names:
+            result = OrderedDict([("benchmark", name), ("items", size)])
+            try:
+                timings = measure(BENCHMARKS[name](path, workdir), repeat)
+            except SkipBenchmark as e:
+                result["skipped"] = str(e)
+                print("{0:<26}{1:>9}  skipped: {2}".format(name, size, e))
+            else:
+                result["best"] = min(timings)
+                result["mean"] = sum(timings) / len(timings)
+                result["runs"] = timings
+                print("{0:<26}{1:>9}  best {2:.4f}s  mean {3:.4f}s".format(
+                    name, size, result["best"], result["mean"]))
+            results.append(result)
+            sys.stdout.flush()
+    return results
+
+
+def compare(results, baseline_path):
+    """
+    Prints how results differ from an earlier result file.
+
+    :type results: list
+    :type baseline_path: str
+    :rtype: int
+    :returns: number of regressions
+    """
+    with open(baseline_path) as baseline_file:
+        baseline = dict(((result["benchmark"], result["items"]), result)
+                        for result in json.load(baseline_file)["results"])
+    regressions = 0
+    for result in results:
+        before = baseline.get((result["benchmark"], result["items"]))
+        if not before or "best" not in before or "best" not in result:
+            continue
+        ratio = result["best"] / before["best"] if before["best"] else 0.0
+        flag = ""
+        if ratio > REGRESSION:
+            flag = "  REGRESSION"
+            regressions += 1
+        print("{0:<26}{1:>9}  {2:.4f}s -> {3:.4f}s  x{4:.2f}{5}".format(
+            result["benchmark"], result["items"], before["best"],
+            result["best"], ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run Tarpon's benchmarks.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="comma separated docset item counts")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS),
+                        help="comma separated benchmark names")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs of every benchmark")
+    parser.add_argument("--workdir",
+                        default=os.path.join(tempfile.gettempdir(),
+                                             "tarpon-benchmarks"),
+                        help="directory the docsets are generated in")
+    parser.add_argument("--output", help="file to write the results to")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="result file to compare against")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.benchmarks.split(",")]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error("unknown benchmarks: " + ", ".join(unknown))
+    sizes = [int(size) for size in args.sizes.split(",")]
+    if not os.path.exists(args.workdir):
+        os.makedirs(args.workdir)
+
+    results = run_benchmarks(names, sizes, args.repeat, args.workdir)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(OrderedDict([
+                ("version", FORMAT_VERSION),
+                ("created", time.strftime("%Y-%m-%dT%H:%M:%S")),
+                ("python", platform.python_version()),
+                ("platform", platform.platform()),
+                ("sqlite", sqlite3.sqlite_version),
+                ("repeat", args.repeat),
+                ("results", results),
+            ]), output_file, indent=2)
+    if args.compare:
+        print("")
+        return 1 if compare(results, args.compare) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
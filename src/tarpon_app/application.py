@@ -1,16 +1,23 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import glob
-import json
+import multiprocessing
 import os
-from gi.repository import Gtk, Gio
+import threading
+from xml.parsers.expat import ExpatError
+from gi.repository import GLib, GObject, Gtk, Gio
 
-import appdirs
-
-from tarpon_app.docsets import Docset
+from tarpon_app.archive import ArchiveServer, pack_docset
+from tarpon_app.content import ContentIndexer
+from tarpon_app.docsets import DocsetLoader, InvalidDocsetException
+from tarpon_app.downloader import DocsetDownloader
 from tarpon_app.gtk.components import TarponWindow, views
-import tarpon_app.info as info
+from tarpon_app.gtk.models import DocsetTreeModel
+from tarpon_app.library import (DocsetLibrary, default_cache_dir,
+                                default_data_dir)
+from tarpon_app.search import SearchIndexer
+from tarpon_app.watcher import DocsetWatcher
+from tarpon_app import trace
 
 
 APP_MENU = """<?xml version="1.0" encoding="UTF-8"?>
@@ -45,44 +52,112 @@ APP_MENU = """<?xml version="1.0" encoding="UTF-8"?>
 """
 
 
-def ensure(path):
-    """
-    Ensures that a path exists by creating it if necessary.
-
-    Note: ``os.makedirs()`` in Python 3 has the option ``exist_ok`` which will
-    not throw an error if the directory already exist (making this function
-    unnecessary). However, Python 2 has no such option.
-
-    :type path: str
-    :param path: path to be created if necessary
-    :rtype: str
-    :returns: input path (allowing functions like os.path.join to be wrapped)
-    """
-    if not os.path.exists(path):
-        os.makedirs(path)
-    return path
-
-
 class Application(Gtk.Application):
-    data_dir = ensure(appdirs.user_data_dir(appname=info.SHORT_NAME))
-    cache_dir = ensure(appdirs.user_cache_dir(appname=info.SHORT_NAME))
+    data_dir = default_data_dir()
+    cache_dir = default_cache_dir()
     # log_dir = ensure(appdirs.user_log_dir(appname=info.SHORT_NAME))
-    docsets = {}
+    # Upper bound on the number of processes reading docsets in parallel
+    loader_processes = min(multiprocessing.cpu_count(), 8)
+    # Search backend: "memory" (SearchIndex) or "fts" (SQLite FTS5, FTSIndex)
+    search_backend = os.environ.get("TARPON_SEARCH_BACKEND", "memory")
+    # Seconds after startup before page content starts being indexed
+    content_delay = 30
+
+    __gsignals__ = {
+        "docset-loaded": (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        "docset-indexed": (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        "docset-added": (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        "docset-removed": (GObject.SignalFlags.RUN_FIRST, None, (str,)),
+        "pins-changed": (GObject.SignalFlags.RUN_FIRST, None, ()),
+        "loading-progress": (GObject.SignalFlags.RUN_FIRST, None,
+                             (int, int)),
+    }
 
     def __init__(self, package, version, pkgdatadir):
         Gtk.Application.__init__(self, application_id="com.sarkhelk.tarpon",
                                  flags=Gio.ApplicationFlags.FLAGS_NONE)
+        GObject.threads_init()
+        if os.environ.get(trace.ENV_VAR):
+            trace.enable(self.cache_dir)
         self.package = package
         self.version = version
         self.pkgdatadir = pkgdatadir
-        search_paths = glob.glob(self.data_dir + "/*.docset")
-        search_paths.extend(glob.glob(self.cache_dir + "/*.json"))
-        self.__choices = []
-        self.load_docsets(search_paths)
+        self.__library = DocsetLibrary(self.data_dir, self.cache_dir,
+                                       self.search_backend)
+        self.__search_index = self.__library.search_index
+        self.__indexing = False
+        self.__searched = False
+        self.__content_started = False
+        self.__archive_server = None
+        self.__sidebar_model = None
+        self.__loader = DocsetLoader(self.__on_docset_loaded,
+                                     progress=self.__on_loading_progress,
+                                     processes=self.loader_processes)
+        self.__loader.start()
+        # Builds the search index of loaded docsets, so that the loader
+        # moves on to the next docset, and urgent requests, right away
+        self.__indexer = SearchIndexer(self.__search_index,
+                                       self.__on_docset_indexed)
+        self.__indexer.start()
+        self.__downloader = DocsetDownloader(self.data_dir, self.cache_dir,
+                                             self.__on_downloaded)
+        self.__library.load_docsets()
+        # Docsets restored from the snapshot with their items, which the
+        # loader never sees
+        self.__restored = self.__library.loaded_docsets()
+        self.__content_indexer = ContentIndexer(
+            self.__library.content_index)
+        self.__content_indexer.start()
+        GLib.timeout_add_seconds(self.content_delay, self.__index_content)
+        self.__watcher = DocsetWatcher(self.data_dir, self.cache_dir,
+                                       self.__on_paths_changed,
+                                       ignore=[self.__library.manifest.path])
+
+    @property
+    def library(self):
+        return self.__library
+
+    @property
+    def docsets(self):
+        """Every known docset, by name."""
+        return self.__library.docsets
+
+    @property
+    def search_index(self):
+        return self.__search_index
+
+    @property
+    def loading(self):
+        """Names of the docsets whose items are still being loaded."""
+        return self.__loader.pending
 
     @property
-    def choices(self):
-        return self.__choices
+    def sidebar_model(self):
+        """
+        Sidebar tree of every docset on disk, shared by every window. Each
+        window only filters it. Docsets whose item counts are known, e.g.
+        from the manifest or the snapshot, come with their type rows.
+
+        :rtype: DocsetTreeModel
+        """
+        if self.__sidebar_model is None:
+            with trace.span("sidebar.model", "application"):
+                self.__sidebar_model = DocsetTreeModel()
+                for name, docset in sorted(self.docsets_on_disk):
+                    self.__sidebar_model.add_docset(name)
+                    if docset.has_type_counts:
+                        self.__sidebar_model.fill_docset(docset)
+            self.update_loading_status()
+        return self.__sidebar_model
+
+    def update_loading_status(self):
+        """Marks the docsets whose items are still being loaded."""
+        if self.__sidebar_model is None:
+            return
+        loading = self.loading
+        for name, treeiter in self.__sidebar_model.docset_rows.iteritems():
+            status = u"loading\u2026" if name in loading else ""
+            self.__sidebar_model.set_status(treeiter, status)
 
     def __new_window(self):
         window = TarponWindow(self)
@@ -122,28 +197,276 @@ class Application(Gtk.Application):
         about_action.connect("activate", self.on_about)
         self.add_action(about_action)
 
-    def load_docsets(self, paths):
+        compact_action = Gio.SimpleAction.new("compact_docset",
+                                              GLib.VariantType.new("s"))
+        compact_action.connect("activate", self.on_compact_docset)
+        self.add_action(compact_action)
+
+        download_action = Gio.SimpleAction.new("download_docset",
+                                               GLib.VariantType.new("s"))
+        download_action.connect("activate", self.on_download_docset)
+        self.add_action(download_action)
+
+    def add_docset(self, path):
+        """
+        Registers a docset that appeared in data_dir while running, replacing
+        any docset of the same name. Emits ``docset-removed`` for the docset
+        it replaces, then ``docset-added``.
+
+        :type path: str
+        :param path: path of the ``.docset`` directory
+        :rtype: Docset
+        """
+        docset, old = self.__library.add_docset(path)
+        if old is not None:
+            self.__docset_removed(old)
+        self.__docset_added(docset)
+        return docset
+
+    def remove_docset(self, name):
+        """
+        Unregisters an installed docset whose directory went away. Emits
+        ``docset-removed``.
+
+        :type name: str
+        :param name: name of the docset
+        """
+        self.__docset_removed(self.__library.remove_docset(name))
+
+    def sync_docset(self, path):
+        """
+        Adds, replaces or removes the docset of a ``.docset`` directory in
+        data_dir, depending on what changed on disk.
+
+        :type path: str
+        :param path: path of the ``.docset`` directory
+        :rtype: Docset or None
+        :returns: the docset read from path, or None if nothing was read
+        """
+        docset, removed = self.__library.sync_docset(path)
+        for old in removed:
+            self.__docset_removed(old)
+        if docset is not None:
+            self.__docset_added(docset)
+        return docset
+
+    def __index_content(self):
+        for name, docset in sorted(self.docsets_on_disk):
+            self.__content_indexer.request(docset)
+        self.__content_started = True
+        return False
+
+    def __docset_added(self, docset):
+        if self.__content_started:
+            self.__content_indexer.request(docset)
+        if self.__searched:
+            # Other docsets are already searchable, so make this one too.
+            self.__index_docset(docset)
+        model = self.__sidebar_model
+        if model is not None and docset.name not in model.docset_rows:
+            model.add_docset(docset.name)
+            self.update_loading_status()
+        self.emit("docset-added", docset.name)
+
+    def __docset_removed(self, docset):
+        if self.__sidebar_model is not None:
+            self.__sidebar_model.remove_docset(docset.name)
+        self.emit("docset-removed", docset.name)
+
+    def __on_paths_changed(self, paths):
+        # Called by the watcher on the main loop
         for path in paths:
-            if path.endswith(".docset"):  # load from disk
-                docset = Docset.frompath(path)
-                self.docsets[docset.name] = docset
-                self.__choices.extend(docset.items)
-            elif path.endswith(".json"):  # load from cache files
-                with open(path) as cache_file:
-                    for name, url in json.load(cache_file).iteritems():
-                        if name in self.docsets:
-                            self.docsets[name].url = url
-                        else:
-                            self.docsets[name] = Docset(name, url=url)
+            if path.endswith(".json"):
+                if os.path.exists(path):
+                    self.__library.load_docsets([path])
+                continue
+            try:
+                self.sync_docset(path)
+            except (InvalidDocsetException, ExpatError, KeyError,
+                    EnvironmentError) as e:
+                # Wait for the docset to change again
+                print("Could not read {0}: {1}".format(path, e))
+                continue
+            if os.path.isdir(path) and not self.__library.is_complete(path):
+                if not self.__watcher.retry(path):
+                    print("{0} is still incomplete".format(path))
+
+    def pin_docset(self, name, pinned=True):
+        """
+        Adds a docset to the docsets searched by default, or removes it.
+        Emits ``pins-changed``.
+
+        :type name: str
+        :param name: name of the docset
+        :type pinned: bool
+        """
+        self.__library.pin_docset(name, pinned)
+        self.emit("pins-changed")
+
+    def page_uri(self, docset, path):
+        """
+        Gets the URI to load for a page of a docset. Pages of archived
+        docsets are served from the archive by a loopback server.
+
+        :type docset: Docset
+        :type path: str
+        :param path: page path relative to the docset's Documents, may have
+                     a fragment
+        :rtype: str
+        """
+        archive = docset.archive
+        if archive is None:
+            return "file://" + os.path.join(docset.doc_path, path)
+        if self.__archive_server is None:
+            self.__archive_server = ArchiveServer()
+        self.__archive_server.register(docset.name, archive)
+        return self.__archive_server.uri(docset.name, path)
+
+    def compact_docset(self, name):
+        """
+        Replaces the unpacked documentation of a docset with an indexed
+        archive, in the background.
+
+        :type name: str
+        :param name: name of the docset
+        """
+        docset = self.docsets[name]
+        if docset.archive is None:
+            thread = threading.Thread(target=pack_docset, args=(docset.path,),
+                                      name="tarpon-packer")
+            thread.daemon = True
+            thread.start()
+
+    def download_docset(self, name):
+        """
+        Downloads a docset listed in a feed in the background. It is added
+        with :meth:`add_docset` once it has been unpacked.
+
+        :type name: str
+        :param name: name of the docset
+        :rtype: tarpon_app.downloader.Download
+        """
+        return self.__downloader.download(name, self.docsets[name].url)
+
+    @property
+    def downloads(self):
+        """Downloads that are queued or running, by docset name."""
+        return self.__downloader.downloads
+
+    def __on_downloaded(self, download):
+        # Called from a download thread
+        GLib.idle_add(self.__downloaded, download)
+
+    def __downloaded(self, download):
+        if download.path:
+            self.sync_docset(download.path)
+        else:
+            print("Could not download {0}: {1}".format(download.name,
+                                                       download.error))
+        return False
+
+    def request_docset(self, name, urgent=False):
+        """
+        Loads the items of a docset in the background if necessary. The
+        ``docset-loaded`` signal is emitted once they are available.
+
+        :type name: str
+        :param name: name of the docset
+        :type urgent: bool
+        :param urgent: load this docset before any other queued docset
+        """
+        self.__loader.request(self.docsets[name], urgent=urgent)
+        self.update_loading_status()
+
+    def request_docsets(self):
+        """
+        Makes every docset on disk searchable in the background. The
+        ``docset-indexed`` signal is emitted as each one becomes searchable.
+        """
+        self.__searched = True
+        if self.__search_index.needs_items:
+            for name, docset in self.docsets_on_disk:
+                self.__loader.request(docset)
+            self.update_loading_status()
+            for docset in self.__restored:
+                self.__indexer.request(docset)
+            self.__restored = []
+        elif not self.__indexing:
+            self.__indexing = True
+            for name, docset in self.docsets_on_disk:
+                self.__indexer.request(docset)
+
+    def __index_docset(self, docset):
+        if self.__search_index.needs_items and not docset.loaded:
+            self.__loader.request(docset)
+        else:
+            self.__indexer.request(docset)
+
+    def __on_docset_loaded(self, docset):
+        # Called from the loader thread. Leave the search index to the
+        # indexer thread and only touch application state from the main loop.
+        if self.__search_index.needs_items:
+            self.__indexer.request(docset)
+        GLib.idle_add(self.__docset_loaded, docset)
+
+    def __on_docset_indexed(self, docset):
+        # Called from the indexer thread
+        GLib.idle_add(self.__docset_indexed, docset)
+
+    def __docset_indexed(self, docset):
+        current = self.docsets.get(docset.name)
+        if current is not docset:
+            # Removed or replaced while it was being indexed, possibly after
+            # its replacement was indexed.
+            self.__search_index.remove(docset.name)
+            if current is not None and current.on_disk:
+                self.__index_docset(current)
+            return False
+        self.emit("docset-indexed", docset.name)
+        return False
+
+    def __on_loading_progress(self, done, total):
+        # Called from the loader thread
+        GLib.idle_add(self.emit, "loading-progress", done, total)
+        if done == total:
+            GLib.idle_add(self.__save_snapshot)
+
+    def __save_snapshot(self):
+        # Every requested docset is loaded, so write the snapshot for the
+        # next launch, off the main loop.
+        thread = threading.Thread(target=self.__library.save_snapshot,
+                                  args=(self.__library.loaded_docsets(),),
+                                  name="tarpon-snapshot")
+        thread.daemon = True
+        thread.start()
+        return False
+
+    def __docset_loaded(self, docset):
+        if self.docsets.get(docset.name) is not docset:
+            return False
+        self.update_loading_status()
+        self.emit("docset-loaded", docset.name)
+        return False
 
     @property
     def docsets_on_disk(self):
-        return filter(lambda x: x[1].on_disk, self.docsets.iteritems())
+        return self.__library.docsets_on_disk
 
     def on_new_window(self, action, parameter):
         self.__new_window()
 
+    def on_compact_docset(self, action, parameter):
+        self.compact_docset(parameter.get_string())
+
+    def on_download_docset(self, action, parameter):
+        self.download_docset(parameter.get_string())
+
     def on_quit(self, action, parameter):
+        self.__watcher.stop()
+        self.__content_indexer.stop()
+        self.__indexer.stop()
+        self.__loader.stop()
+        self.__downloader.stop()
         self.quit()
 
     def on_about(self, action, parameter, transient_for=None):
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Documentation served straight from compressed docset archives.
+
+Like Dash's tarix, a docset can keep its ``Documents`` directory as a
+single ``Documents.tgz`` next to ``docSet.dsidx``, plus a member index in
+``Documents.tarix``. The archive is written with every tar member in its own
+gzip member, which is still an ordinary ``.tgz``, so a page can be read by
+seeking to its gzip member and decompressing just that one file.
+
+Pages are served to the web view by :class:`ArchiveServer`, a small HTTP
+server bound to the loopback interface. The WebKit 1 API Tarpon uses has
+no way to register a custom URI scheme, so the loopback server plays that
+role.
+"""
+
+import BaseHTTPServer
+from collections import OrderedDict
+import json
+import mimetypes
+import os
+import shutil
+import SocketServer
+import tarfile
+import threading
+import urllib
+import zlib
+
+
+ARCHIVE_NAME = "Documents.tgz"
+INDEX_NAME = "Documents.tarix"
+
+
+def archive_paths(docset_path):
+    """
+    Gets the archive and member index of a docset.
+
+    :type docset_path: str
+    :param docset_path: path of the ``.docset`` directory
+    :rtype: tuple
+    :returns: paths of the archive and of its index
+    """
+    resources = os.path.join(docset_path, "Contents", "Resources")
+    return (os.path.join(resources, ARCHIVE_NAME),
+            os.path.join(resources, INDEX_NAME))
+
+
+def _encode(text):
+    if isinstance(text, unicode):
+        return text.encode("utf-8")
+    return text
+
+
+def _gzip_member(data):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def pack_directory(source, archive_path, index_path):
+    """
+    Writes a directory to an indexed ``.tgz``, one gzip member per file.
+
+    :type source: str
+    :param source: directory to pack; member names are relative to it
+    :type archive_path: str
+    :type index_path: str
+    """
+    members = {}
+    with open(archive_path + ".tmp", "wb") as archive:
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for filename in sorted(files):
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, source).replace(os.sep, "/")
+                info = tarfile.TarInfo(name)
+                info.size = os.path.getsize(path)
+                info.mtime = os.path.getmtime(path)
+                header = info.tobuf(tarfile.GNU_FORMAT)
+                with open(path, "rb") as member_file:
+                    data = member_file.read()
+                padding = -len(data) % tarfile.BLOCKSIZE
+                chunk = _gzip_member(header + data + tarfile.NUL * padding)
+                members[name] = [archive.tell(), len(chunk), len(header),
+                                 len(data)]
+                archive.write(chunk)
+        archive.write(_gzip_member(tarfile.NUL * tarfile.BLOCKSIZE * 2))
+    with open(index_path + ".tmp", "w") as index_file:
+        json.dump({"version": DocsetArchive.VERSION, "compressed": True,
+                   "members": members}, index_file)
+    os.rename(archive_path + ".tmp", archive_path)
+    os.rename(index_path + ".tmp", index_path)
+
+
+def pack_docset(docset_path):
+    """
+    Replaces the ``Documents`` directory of a docset with an indexed
+    ``Documents.tgz``.
+
+    :type docset_path: str
+    :param docset_path: path of the ``.docset`` directory
+    """
+    documents = os.path.join(docset_path, "Contents", "Resources",
+                             "Documents")
+    archive_path, index_path = archive_paths(docset_path)
+    pack_directory(documents, archive_path, index_path)
+    shutil.rmtree(documents)
+
+
+class DocsetArchive(object):
+    """
+    Random access to the members of an indexed archive, with a small LRU
+    cache of recently decompressed members.
+    """
+
+    VERSION = 1
+    CACHE_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, archive_path, index_path):
+        self.archive_path = archive_path
+        with open(index_path) as index_file:
+            index = json.load(index_file)
+        if index.get("version") != self.VERSION:
+            raise ValueError("Unsupported archive index in " + index_path)
+        self.compressed = index["compressed"]
+        self.members = index["members"]
+        self.__lock = threading.Lock()
+        self.__cache = OrderedDict()
+        self.__cached = 0
+
+    @classmethod
+    def fordocset(cls, docset_path):
+        """
+        Opens the archive of a docset, if it has one.
+
+        :type docset_path: str
+        :rtype: DocsetArchive or None
+        """
+        archive_path, index_path = archive_paths(docset_path)
+        if os.path.exists(archive_path) and os.path.exists(index_path):
+            return cls(archive_path, index_path)
+        return None
+
+    def __contains__(self, name):
+        return name in self.members
+
+    def read(self, name):
+        """
+        Reads one member, decompressing only that member.
+
+        :type name: str
+        :param name: member path relative to ``Documents``
+        :rtype: str
+        :raises KeyError: if there is no such member
+        """
+        with self.__lock:
+            if name in self.__cache:
+                data = self.__cache.pop(name)
+                self.__cache[name] = data
+                return data
+        offset, length, header, size = self.members[name]
+        with open(self.archive_path, "rb") as archive:
+            archive.seek(offset)
+            chunk = archive.read(length)
+        if self.compressed:
+            chunk = zlib.decompress(chunk, 16 + zlib.MAX_WBITS)
+        data = chunk[header:header + size]
+        with self.__lock:
+            if name not in self.__cache and size <= self.CACHE_SIZE:
+                self.__cache[name] = data
+                self.__cached += size
+                while self.__cached > self.CACHE_SIZE:
+                    _, evicted = self.__cache.popitem(last=False)
+                    self.__cached -= len(evicted)
+        return data
+
+
+class ArchiveRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = urllib.unquote(self.path.split("?", 1)[0].split("#", 1)[0])
+        name, _, member = path.lstrip("/").partition("/")
+        member = member.decode("utf-8")
+        archive = self.server.archives.get(name)
+        if archive is None or member not in archive:
+            self.send_error(404)
+            return
+        data = archive.read(member)
+        content_type = mimetypes.guess_type(member)[0]
+        self.send_response(200)
+        self.send_header("Content-Type",
+                         content_type or "application/octet-stream")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class ArchiveServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serves the pages of archived docsets on the loopback interface."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0),
+                                           ArchiveRequestHandler)
+        self.archives = {}
+        thread = threading.Thread(target=self.serve_forever,
+                                  name="tarpon-archives")
+        thread.daemon = True
+        thread.start()
+
+    def register(self, name, archive):
+        """
+        Makes the members of an archive available under a docset name.
+
+        :type name: str
+        :type archive: DocsetArchive
+        """
+        self.archives[_encode(name)] = archive
+
+    def uri(self, name, path):
+        """
+        Gets the URI of a page inside an archived docset.
+
+        :type name: str
+        :param name: name of the docset
+        :type path: str
+        :param path: page path relative to ``Documents``, may have a fragment
+        :rtype: str
+        """
+        path, hash_mark, fragment = path.partition("#")
+        return "http://127.0.0.1:{0}/{1}/{2}{3}{4}".format(
+            self.server_address[1], urllib.quote(_encode(name), safe=""),
+            urllib.quote(_encode(path)), hash_mark, fragment)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Command-line query mode.
+
+Searches the installed docsets without importing GTK::
+
+    $ python tarpon.py --query dict.get
+    $ python tarpon.py --query --open dict.get
+    $ python tarpon.py --query --content "context manager"
+
+Metadata, items and search indexes are read from the cache the application
+keeps, so a query is answered without parsing any docset once the cache is
+warm. The first query with a backend builds its index. ``--content``
+searches the text of the pages instead of the item names, using the content
+index the application builds in the background; ``--index-content`` builds
+it first.
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import webbrowser
+
+from tarpon_app.library import (DocsetLibrary, default_cache_dir,
+                                default_data_dir, SEARCH_BACKENDS)
+from tarpon_app.search import SearchIndex
+from tarpon_app import trace
+
+
+def page_location(docset, path):
+    """
+    Gets where a page of a docset can be read.
+
+    :type docset: tarpon_app.docsets.Docset
+    :type path: str
+    :param path: page path relative to the docset's Documents, may have a
+                 fragment
+    :rtype: str
+    :returns: path of the page, inside the archive for archived docsets
+    """
+    if docset.archive is not None:
+        return os.path.join(docset.archive.archive_path, path)
+    return os.path.join(docset.doc_path, path)
+
+
+def extract_page(docset, path, cache_dir):
+    """
+    Writes a page of an archived docset to the cache directory.
+
+    :type docset: tarpon_app.docsets.Docset
+    :type path: str
+    :type cache_dir: str
+    :rtype: str
+    :returns: path of the written page, with the fragment of path
+    :raises KeyError: if the archive has no such page
+    """
+    member, hash_mark, fragment = path.partition("#")
+    pages = os.path.join(cache_dir, "pages", docset.name)
+    target = os.path.normpath(os.path.join(pages, member))
+    if not target.startswith(pages + os.sep):
+        raise KeyError(member)
+    if not os.path.exists(os.path.dirname(target)):
+        os.makedirs(os.path.dirname(target))
+    with open(target, "wb") as page_file:
+        page_file.write(docset.archive.read(member))
+    return target + hash_mark + fragment
+
+
+def search_content(library, query, args):
+    """
+    Prints the pages whose text best matches a query.
+
+    :type library: tarpon_app.library.DocsetLibrary
+    :type query: unicode
+    :param args: parsed arguments of :func:`main`
+    :rtype: int
+    :returns: exit status, 1 if nothing matched
+    """
+    content_index = library.content_index
+    docsets = [docset for name, docset in sorted(library.docsets_on_disk)]
+    if args.index_content:
+        for docset in docsets:
+            content_index.update(docset)
+    missing = [docset.name for docset in docsets
+               if not content_index.is_current(docset)]
+    if missing:
+        sys.stderr.write("Pages not fully indexed yet: {0}\n".format(
+            ", ".join(missing)).encode("utf-8"))
+    results = content_index.search(query, docsets, args.limit)
+    if not results:
+        print("No matches for {0}".format(args.query))
+        return 1
+    for result in results:
+        docset = library.docsets[result.docset]
+        print(u"{0}\t{1}\t{2}\t{3}".format(
+            result.title, result.docset,
+            page_location(docset, result.path), result.snippet).encode(
+                "utf-8"))
+    return 0
+
+
+def main(argv=None):
+    """
+    Prints the best matches for a query, or opens the best one.
+
+    :type argv: list
+    :param argv: arguments, without the program name
+    :rtype: int
+    :returns: exit status, 1 if nothing matched
+    """
+    parser = argparse.ArgumentParser(
+        prog="tarpon --query",
+        description="Search the installed docsets.")
+    parser.add_argument("query", help="name to look for")
+    parser.add_argument("-n", "--limit", type=int, default=10,
+                        help="number of matches to print")
+    parser.add_argument("-o", "--open", action="store_true",
+                        help="open the best match in the web browser")
+    parser.add_argument("--backend", choices=sorted(SEARCH_BACKENDS),
+                        default="fts",
+                        help="search index to use (default: fts, which "
+                             "starts fastest, or memory if SQLite lacks "
+                             "FTS5)")
+    parser.add_argument("--content", action="store_true",
+                        help="search the text of the pages")
+    parser.add_argument("--index-content", action="store_true",
+                        help="index the text of the pages first")
+    args = parser.parse_args(argv)
+    query = args.query.decode(sys.stdin.encoding or "utf-8")
+
+    cache_dir = default_cache_dir()
+    if os.environ.get(trace.ENV_VAR):
+        trace.enable(cache_dir)
+    library = DocsetLibrary(default_data_dir(), cache_dir, args.backend)
+    library.load_docsets()
+    if args.content or args.index_content:
+        return search_content(library, query, args)
+    try:
+        library.index_docsets()
+    except sqlite3.OperationalError as e:
+        if args.backend != "fts":
+            raise
+        # SQLite built without FTS5 or its trigram tokenizer (< 3.34)
+        sys.stderr.write("FTS5 unavailable ({0}), searching in memory\n"
+                         .format(e))
+        library.search_index = SearchIndex(cache_dir)
+        library.index_docsets()
+    library.save_snapshot()
+    results = library.search_index.search(query, args.limit,
+                                          default_scope=library.default_scope)
+    if not results:
+        print("No matches for {0}".format(args.query))
+        return 1
+
+    if args.open:
+        result = results[0]
+        docset = library.docsets[result.docset]
+        if docset.archive is not None:
+            try:
+                location = extract_page(docset, result.item.path, cache_dir)
+            except KeyError:
+                print("{0} is missing from {1}".format(
+                    result.item.path, docset.archive.archive_path))
+                return 1
+        else:
+            location = page_location(docset, result.item.path)
+        webbrowser.open("file://" + location)
+        return 0
+
+    for result in results:
+        docset = library.docsets[result.docset]
+        print(u"{0}\t{1}\t{2}\t{3}".format(
+            result.item.name, result.item.data_type, result.docset,
+            page_location(docset, result.item.path)).encode("utf-8"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
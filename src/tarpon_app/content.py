@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Full-text index over the documentation pages of docsets.
+
+The text of every HTML page of a docset, read from its Documents directory
+or from its archive, is tokenized into an SQLite FTS5 database in the
+``content`` directory of the cache. Content queries are answered from those
+databases alone, so no page is read again to search it.
+
+Indexing runs on a low priority background thread. Pages are written in
+batches of bounded size, each committed on its own, and every page records
+the stamp it was indexed at. An interrupted run therefore resumes where it
+stopped, and a docset whose index database has not changed since its last
+complete run is skipped altogether.
+"""
+
+from collections import deque, namedtuple
+from htmlentitydefs import name2codepoint
+import HTMLParser
+import os
+import sqlite3
+import threading
+import time
+
+from tarpon_app import trace
+
+
+SCHEMA = """
+CREATE TABLE meta(key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE pages(id INTEGER PRIMARY KEY, path TEXT UNIQUE, stamp TEXT,
+                   run INTEGER);
+CREATE VIRTUAL TABLE content USING fts5(
+    title, body, tokenize='unicode61 remove_diacritics 1');
+"""
+
+SEARCH = u"""
+SELECT pages.path, content.title,
+       snippet(content, 1, '', '', '…', 12), bm25(content, 5.0, 1.0)
+FROM content JOIN pages ON pages.id = content.rowid
+WHERE content MATCH ?
+ORDER BY bm25(content, 5.0, 1.0)
+LIMIT ?
+"""
+
+PAGE_EXTENSIONS = (".html", ".htm")
+
+ContentResult = namedtuple("ContentResult",
+                           ["docset", "path", "title", "snippet", "rank"])
+
+
+class TextExtractor(HTMLParser.HTMLParser):
+    """Collects the title and the visible text of an HTML page."""
+
+    SKIPPED = frozenset(["script", "style", "noscript"])
+    # Elements that separate the text around them, unlike inline ones
+    BLOCKS = frozenset(["address", "article", "aside", "blockquote", "br",
+                        "caption", "dd", "div", "dl", "dt", "figcaption",
+                        "figure", "footer", "h1", "h2", "h3", "h4", "h5",
+                        "h6", "header", "hr", "li", "main", "nav", "ol", "p",
+                        "pre", "section", "table", "td", "th", "tr", "ul"])
+
+    def __init__(self):
+        HTMLParser.HTMLParser.__init__(self)
+        self.title = []
+        self.text = []
+        self.__skipped = 0
+        self.__in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.BLOCKS:
+            self.handle_data(u" ")
+        if tag in self.SKIPPED:
+            self.__skipped += 1
+        elif tag == "title":
+            self.__in_title = True
+
+    def handle_endtag(self, tag):
+        if tag in self.BLOCKS:
+            self.handle_data(u" ")
+        if tag in self.SKIPPED:
+            self.__skipped = max(0, self.__skipped - 1)
+        elif tag == "title":
+            self.__in_title = False
+
+    def handle_data(self, data):
+        if self.__in_title:
+            self.title.append(data)
+        elif not self.__skipped:
+            self.text.append(data)
+
+    def handle_entityref(self, name):
+        if name in name2codepoint:
+            self.handle_data(unichr(name2codepoint[name]))
+
+    def handle_charref(self, name):
+        try:
+            if name[:1] in ("x", "X"):
+                self.handle_data(unichr(int(name[1:], 16)))
+            else:
+                self.handle_data(unichr(int(name)))
+        except (ValueError, OverflowError):
+            pass
+
+
+def page_text(data, limit):
+    """
+    Extracts the title and the text of a page.
+
+    :type data: str
+    :param data: HTML of the page
+    :type limit: int
+    :param limit: maximum number of characters of text kept
+    :rtype: tuple
+    :returns: title and text, as unicode
+    """
+    extractor = TextExtractor()
+    try:
+        extractor.feed(data.decode("utf-8", "replace"))
+        extractor.close()
+    except HTMLParser.HTMLParseError:
+        # Keep whatever was read before the page broke the parser
+        pass
+    title = u" ".join(u"".join(extractor.title).split())
+    text = u" ".join(u"".join(extractor.text).split())
+    return title, text[:limit]
+
+
+def match_expression(query):
+    """
+    Turns a query into an FTS5 expression matching pages containing every
+    word of it.
+
+    :type query: unicode
+    :rtype: unicode
+    """
+    return u" ".join(u'"{0}"'.format(word.replace(u'"', u'""'))
+                     for word in query.split())
+
+
+class ContentIndex(object):
+    """
+    Full-text databases of the pages of docsets, one per docset.
+
+    :type cache_dir: str
+    """
+
+    VERSION = "2"
+    # Text kept per page, in characters
+    MAX_PAGE_TEXT = 256 * 1024
+    # Text buffered before it is written and committed, in characters
+    BATCH_TEXT = 4 * 1024 * 1024
+    # Pages buffered before they are written and committed
+    BATCH_PAGES = 100
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.join(cache_dir, "content")
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def db_path(self, docset):
+        """
+        Gets the full-text database of a docset.
+
+        :type docset: tarpon_app.docsets.Docset
+        :rtype: str
+        """
+        filename = "".join(c if c.isalnum() else "_" for c in docset.name)
+        return os.path.join(self.cache_dir, filename + ".db")
+
+    @staticmethod
+    def signature(docset):
+        """
+        Identifies the current contents of a docset.
+
+        :type docset: tarpon_app.docsets.Docset
+        :rtype: str
+        """
+        return repr((docset.signature, docset.archive is not None))
+
+    def __connect(self, docset):
+        path = self.db_path(docset)
+        exists = os.path.exists(path)
+        db = sqlite3.connect(path)
+        # Keep SQLite's page cache small; the indexer runs for a long time.
+        db.execute("PRAGMA cache_size = -2048")
+        if not exists:
+            db.executescript(SCHEMA)
+        return db
+
+    def __meta(self, db):
+        return dict(db.execute("SELECT key, value FROM meta"))
+
+    def is_current(self, docset):
+        """
+        Checks whether every page of a docset, as it is now, is indexed.
+
+        :type docset: tarpon_app.docsets.Docset
+        :rtype: bool
+        """
+        path = self.db_path(docset)
+        if not os.path.exists(path):
+            return False
+        try:
+            db = sqlite3.connect(path)
+            try:
+                meta = self.__meta(db)
+            finally:
+                db.close()
+        except sqlite3.Error:
+            return False
+        return (meta.get("version") == self.VERSION and
+                meta.get("complete") == "1" and
+                meta.get("signature") == self.signature(docset))
+
+    def pages(self, docset):
+        """
+        Lists the HTML pages of a docset, in a stable order.
+
+        :type docset: tarpon_app.docsets.Docset
+        :returns: iterator of ``(path, stamp, read)``, where path is relative
+                  to the docset's Documents and read() returns the page
+        """
+        archive = docset.archive
+        if archive is not None:
+            for name in sorted(archive.members):
+                if name.lower().endswith(PAGE_EXTENSIONS):
+                    yield (name, repr(archive.members[name][:2]),
+                           lambda name=name: archive.read(name))
+            return
+        root = docset.doc_path
+        for directory, subdirectories, filenames in os.walk(root):
+            subdirectories.sort()
+            for filename in sorted(filenames):
+                if not filename.lower().endswith(PAGE_EXTENSIONS):
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+
+                def read(path=path):
+                    with open(path, "rb") as page_file:
+                        return page_file.read()
+                yield (os.path.relpath(path, root),
+                       repr((stat.st_mtime, stat.st_size)), read)
+
+    def update(self, docset, cancelled=None, pause=0.0):
+        """
+        Indexes the pages of a docset that are new or changed since they
+        were last indexed, and drops the pages that went away.
+
+        :type docset: tarpon_app.docsets.Docset
+        :param cancelled: optional callable polled between pages; indexing
+                          stops, to be resumed later, once it returns True
+        :type pause: float
+        :param pause: seconds to sleep after every committed batch, to leave
+                      the CPU and disk to more urgent work
+        :rtype: bool
+        :returns: True if every page is indexed
+        """
+        if not docset.on_disk or self.is_current(docset):
+            return True
+        signature = self.signature(docset)
+        db = self.__connect(docset)
+        try:
+            meta = self.__meta(db)
+            run = int(meta.get("run", 0))
+            if meta.get("version", self.VERSION) != self.VERSION:
+                # Pages were read differently, so read every one again.
+                db.execute("DELETE FROM content")
+                db.execute("DELETE FROM pages")
+            if (meta.get("version") != self.VERSION or
+                    meta.get("signature") != signature):
+                # A new run; pages not seen again by its end are dropped.
+                run += 1
+                db.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                               (("version", self.VERSION),
+                                ("signature", signature),
+                                ("run", str(run)), ("complete", "0")))
+                db.commit()
+            with trace.span("content.update", "content", docset=docset.name):
+                if not self.__index_pages(db, docset, run, cancelled, pause):
+                    return False
+                db.execute("DELETE FROM content WHERE rowid IN "
+                           "(SELECT id FROM pages WHERE run < ?)", (run,))
+                db.execute("DELETE FROM pages WHERE run < ?", (run,))
+                db.execute("INSERT OR REPLACE INTO meta VALUES "
+                           "('complete', '1')")
+                db.commit()
+            return True
+        finally:
+            db.close()
+
+    def __index_pages(self, db, docset, run, cancelled, pause):
+        seen = []
+        changed = []
+        buffered = 0
+        for path, stamp, read in self.pages(docset):
+            if cancelled and cancelled():
+                return False
+            row = db.execute("SELECT id, stamp, run FROM pages WHERE path = ?",
+                             (path,)).fetchone()
+            if row is not None and row[1] == stamp:
+                if row[2] != run:
+                    seen.append(row[0])
+            else:
+                try:
+                    title, text = page_text(read(), self.MAX_PAGE_TEXT)
+                except (IOError, KeyError):
+                    continue
+                changed.append((row[0] if row else None, path, stamp, title,
+                                text))
+                buffered += len(text)
+            if (buffered >= self.BATCH_TEXT or
+                    len(changed) + len(seen) >= self.BATCH_PAGES):
+                self.__write(db, run, seen, changed)
+                seen, changed, buffered = [], [], 0
+                if pause:
+                    time.sleep(pause)
+        self.__write(db, run, seen, changed)
+        return True
+
+    def __write(self, db, run, seen, changed):
+        db.executemany("UPDATE pages SET run = ? WHERE id = ?",
+                       ((run, page_id) for page_id in seen))
+        for page_id, path, stamp, title, text in changed:
+            if page_id is not None:
+                db.execute("DELETE FROM content WHERE rowid = ?", (page_id,))
+                db.execute("UPDATE pages SET stamp = ?, run = ? WHERE id = ?",
+                           (stamp, run, page_id))
+            else:
+                page_id = db.execute(
+                    "INSERT INTO pages(path, stamp, run) VALUES (?, ?, ?)",
+                    (path, stamp, run)).lastrowid
+            db.execute("INSERT INTO content(rowid, title, body) "
+                       "VALUES (?, ?, ?)", (page_id, title, text))
+        db.commit()
+
+    def search(self, query, docsets, limit=10):
+        """
+        Finds the pages containing every word of query.
+
+        :type query: unicode
+        :type docsets: list
+        :param docsets: docsets to search; those never indexed are skipped
+        :type limit: int
+        :rtype: list
+        :returns: :class:`ContentResult` tuples, best first
+        """
+        expression = match_expression(query)
+        if not expression:
+            return []
+        results = []
+        for docset in docsets:
+            path = self.db_path(docset)
+            if not os.path.exists(path):
+                continue
+            db = sqlite3.connect(path)
+            try:
+                db.execute("PRAGMA query_only = ON")
+                for page, title, snippet, rank in db.execute(
+                        SEARCH, (expression, limit)):
+                    results.append(ContentResult(docset.name, page, title,
+                                                 snippet, rank))
+            except sqlite3.OperationalError:
+                # Not an index yet, or not a valid FTS5 expression
+                continue
+            finally:
+                db.close()
+        results.sort(key=lambda result: result.rank)
+        return results[:limit]
+
+
+class ContentIndexer(threading.Thread):
+    """
+    Keeps the content index of docsets up to date in the background.
+
+    Docsets are indexed one at a time in the order they are queued, and
+    ``pause`` seconds are slept after every batch of pages so that indexing
+    never competes with the interface or with searches for long.
+    ``callback``, if given, is invoked on the indexer thread with every
+    docset whose pages are all indexed.
+    """
+
+    def __init__(self, index, callback=None, pause=0.05):
+        threading.Thread.__init__(self, name="tarpon-content")
+        self.daemon = True
+        self.index = index
+        self.callback = callback
+        self.pause = pause
+        self.__condition = threading.Condition()
+        self.__queue = deque()
+        self.__stopped = False
+
+    def request(self, docset):
+        """
+        Queues a docset for indexing unless it is already queued.
+
+        :type docset: tarpon_app.docsets.Docset
+        """
+        with self.__condition:
+            if docset not in self.__queue:
+                self.__queue.append(docset)
+                self.__condition.notify()
+
+    def stop(self):
+        """Stops the indexer once its current batch is written."""
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify()
+
+    def run(self):
+        while True:
+            with self.__condition:
+                while not self.__queue and not self.__stopped:
+                    self.__condition.wait()
+                if self.__stopped:
+                    return
+                docset = self.__queue.popleft()
+            try:
+                complete = self.index.update(
+                    docset, cancelled=lambda: self.__stopped,
+                    pause=self.pause)
+            except (sqlite3.Error, OSError) as e:
+                print("Could not index the pages of {0}: {1}".format(
+                    docset.name, e))
+                continue
+            if complete and self.callback:
+                self.callback(docset)
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Query daemon serving many clients from one set of loaded docsets.
+
+The daemon loads and indexes every installed docset once, then answers
+requests over HTTP on the loopback interface or on a Unix socket::
+
+    $ python tarpon.py --serve --port 8765
+    $ curl 'http://127.0.0.1:8765/search?q=dict.get&limit=5'
+
+``GET /docsets``
+    Every docset on disk, with its item counts.
+``GET /search?q=QUERY[&limit=N]``
+    Best matches over every docset.
+``GET /lookup?docset=NAME&name=ITEM[&type=TYPE]``
+    Exact matches of an item name in one docset.
+``GET /content?q=QUERY[&limit=N]``
+    Pages whose text contains every word of the query, from the content
+    index the daemon keeps up to date in the background.
+``GET /docs/DOCSET/PATH``
+    A documentation page, read from the docset's Documents directory or
+    from its archive. The ``url`` of every search and lookup result points
+    here.
+
+``limit`` defaults to 20 and must be between 1 and 200; anything else is
+answered with status 400.
+
+Requests are handled by a fixed pool of threads, and search results are
+kept in an LRU cache shared by every client.
+"""
+
+import argparse
+import BaseHTTPServer
+import json
+import mimetypes
+from multiprocessing.pool import ThreadPool
+import os
+import signal
+import SocketServer
+import sys
+import urllib
+import urlparse
+
+from tarpon_app.content import ContentIndexer
+from tarpon_app.library import (DocsetLibrary, default_cache_dir,
+                                default_data_dir, SEARCH_BACKENDS)
+from tarpon_app.search import LRUCache
+from tarpon_app import trace
+
+
+def result_json(docset, item, position, score=None):
+    """
+    Describes an item for a client.
+
+    :type docset: tarpon_app.docsets.Docset
+    :type item: tarpon_app.docsets.DocItem
+    :type position: int
+    :type score: int
+    :rtype: dict
+    """
+    return {"name": item.name, "type": item.data_type,
+            "docset": docset.name, "position": position, "score": score,
+            "path": item.path,
+            "url": "/docs/{0}/{1}".format(
+                urllib.quote(docset.name.encode("utf-8"), safe=""),
+                urllib.quote(item.path, safe="/#"))}
+
+
+class QueryRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Dispatches requests to the ``do_<endpoint>`` methods."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        endpoint, _, rest = url.path.lstrip("/").partition("/")
+        parameters = dict((key, values[-1].decode("utf-8"))
+                          for key, values
+                          in urlparse.parse_qs(url.query).iteritems())
+        handler = getattr(self, "get_" + endpoint, None)
+        if handler is None:
+            self.send_json({"error": "unknown endpoint"}, 404)
+            return
+        try:
+            with trace.span(endpoint, "daemon"):
+                handler(rest, parameters)
+        except (KeyError, ValueError) as e:
+            self.send_json({"error": str(e)}, 400)
+
+    def send_body(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, status=200):
+        self.send_body(json.dumps(data), "application/json", status)
+
+    def limit(self, parameters):
+        """
+        Gets the number of results a client asked for.
+
+        :type parameters: dict
+        :rtype: int
+        :raises ValueError: unless it is between 1 and the server's
+                            ``max_limit``
+        """
+        limit = int(parameters.get("limit", 20))
+        if not 1 <= limit <= self.server.max_limit:
+            raise ValueError("limit must be between 1 and {0}".format(
+                self.server.max_limit))
+        return limit
+
+    def get_docsets(self, rest, parameters):
+        self.send_json({"docsets": [
+            {"name": name, "identifier": docset.identifier,
+             "type_counts": docset.type_counts,
+             "archived": docset.archive is not None}
+            for name, docset in sorted(self.server.library.docsets_on_disk)]})
+
+    def get_search(self, rest, parameters):
+        query = parameters["q"]
+        limit = self.limit(parameters)
+        library = self.server.library
+        # Results go stale once a docset is added, replaced or removed
+        key = (library.search_index.generation, query, limit,
+               library.default_scope)
+        results = self.server.cache.get(key)
+        if results is None:
+            docsets = library.docsets
+            results = [result_json(docsets[result.docset], result.item,
+                                   result.position, result.score)
+                       for result in library.search_index.search(
+                           query, limit,
+                           default_scope=library.default_scope)]
+            self.server.cache.put(key, results)
+        self.send_json({"query": query, "results": results})
+
+    def get_lookup(self, rest, parameters):
+        docset = self.server.library.docsets[parameters["docset"]]
+        name, data_type = parameters["name"], parameters.get("type")
+        if data_type is not None:
+            types = [str(data_type)]
+        else:
+            types = sorted(docset.type_counts)
+        items = docset.items
+        self.send_json({"results": [
+            result_json(docset, items[position], position)
+            for data_type in types
+            for position in docset.find(name, data_type)]})
+
+    def get_content(self, rest, parameters):
+        query = parameters["q"]
+        limit = self.limit(parameters)
+        library = self.server.library
+        docsets = [docset for name, docset in sorted(library.docsets_on_disk)]
+        self.send_json({"query": query, "results": [
+            {"docset": result.docset, "path": result.path,
+             "title": result.title, "snippet": result.snippet,
+             "url": "/docs/{0}/{1}".format(
+                 urllib.quote(result.docset.encode("utf-8"), safe=""),
+                 urllib.quote(result.path.encode("utf-8"), safe="/#"))}
+            for result in library.content_index.search(query, docsets,
+                                                       limit)]})
+
+    def get_docs(self, rest, parameters):
+        name, _, member = urllib.unquote(rest).partition("/")
+        docset = self.server.library.docsets.get(name.decode("utf-8"))
+        if docset is None or not docset.on_disk:
+            self.send_error(404)
+            return
+        archive = docset.archive
+        if archive is not None:
+            member = member.decode("utf-8")
+            if member not in archive:
+                self.send_error(404)
+                return
+            data = archive.read(member)
+        else:
+            root = os.path.abspath(docset.doc_path)
+            path = os.path.abspath(os.path.join(root, member))
+            if not path.startswith(root + os.sep) or not os.path.isfile(path):
+                self.send_error(404)
+                return
+            with open(path, "rb") as page_file:
+                data = page_file.read()
+        content_type = mimetypes.guess_type(member)[0]
+        self.send_body(data, content_type or "application/octet-stream")
+
+
+class PooledServerMixIn(object):
+    """Handles each request on a fixed pool of threads."""
+
+    threads = 8
+
+    def process_request(self, request, client_address):
+        if getattr(self, "pool", None) is None:
+            self.pool = ThreadPool(self.threads)
+        self.pool.apply_async(self.process_request_thread,
+                              (request, client_address))
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super(PooledServerMixIn, self).server_close()
+        if getattr(self, "pool", None) is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+class QueryServer(PooledServerMixIn, BaseHTTPServer.HTTPServer):
+    """Query daemon listening on a TCP port."""
+
+    max_limit = 200
+
+    def __init__(self, library, address, threads=8, cache_size=1024):
+        self.library = library
+        self.threads = threads
+        self.cache = LRUCache(cache_size)
+        BaseHTTPServer.HTTPServer.__init__(self, address, QueryRequestHandler)
+
+
+class UnixQueryServer(PooledServerMixIn, SocketServer.UnixStreamServer):
+    """Query daemon listening on a Unix socket."""
+
+    max_limit = QueryServer.max_limit
+
+    def __init__(self, library, path, threads=8, cache_size=1024):
+        self.library = library
+        self.threads = threads
+        self.cache = LRUCache(cache_size)
+        if os.path.exists(path):
+            os.remove(path)
+        SocketServer.UnixStreamServer.__init__(self, path,
+                                               QueryRequestHandler)
+
+
+def main(argv=None):
+    """
+    Loads every docset and serves queries until interrupted.
+
+    :type argv: list
+    :param argv: arguments, without the program name
+    :rtype: int
+    """
+    parser = argparse.ArgumentParser(
+        prog="tarpon --serve",
+        description="Serve docset queries to local clients.")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to listen on")
+    parser.add_argument("--port", type=int, default=8765,
+                        help="TCP port to listen on")
+    parser.add_argument("--socket", metavar="PATH",
+                        help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--threads", type=int, default=8,
+                        help="requests handled at once")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="search results kept in the shared cache")
+    parser.add_argument("--backend", choices=sorted(SEARCH_BACKENDS),
+                        default=os.environ.get("TARPON_SEARCH_BACKEND",
+                                               "memory"),
+                        help="search index to use")
+    args = parser.parse_args(argv)
+
+    cache_dir = default_cache_dir()
+    if os.environ.get(trace.ENV_VAR):
+        trace.enable(cache_dir)
+    library = DocsetLibrary(default_data_dir(), cache_dir, args.backend)
+    library.load_docsets()
+    library.index_docsets()
+    library.save_snapshot()
+    content_indexer = ContentIndexer(library.content_index)
+    content_indexer.start()
+    for name, docset in sorted(library.docsets_on_disk):
+        content_indexer.request(docset)
+    if args.socket:
+        server = UnixQueryServer(library, args.socket, args.threads,
+                                 args.cache_size)
+        print("Serving {0} docsets on {1}".format(
+            len(library.docsets_on_disk), args.socket))
+    else:
+        server = QueryServer(library, (args.host, args.port), args.threads,
+                             args.cache_size)
+        print("Serving {0} docsets on http://{1}:{2}/".format(
+            len(library.docsets_on_disk), args.host,
+            server.server_address[1]))
+    sys.stdout.flush()
+
+    def terminate(signum, frame):
+        raise SystemExit(0)
+
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        content_indexer.stop()
+        server.server_close()
+        if args.socket:
+            os.remove(args.socket)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,20 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from collections import namedtuple
+from array import array
+from collections import deque, namedtuple
+import json
+import multiprocessing
 import os
 import plistlib
+import sqlite3
+import struct
+import threading
+import traceback
 from unicodedata import normalize
+import urllib
 
-import peewee
+from tarpon_app import trace
 
 
 class InvalidDocsetException(Exception):
@@ -16,25 +24,422 @@ class InvalidDocsetException(Exception):
 DocItem = namedtuple("DocItem", ["name", "data_type", "path"])
 
 
-def index_model(db):
-    class SearchIndex(peewee.Model):
-        name = peewee.TextField()
-        data_type = peewee.TextField(db_column="type")
-        path = peewee.TextField()
+class DocItemView(object):
+    """
+    Lightweight view of one row of a :class:`DocItemTable`.
 
-        @property
-        def item(self):
-            return DocItem(normalize("NFKD", unicode(self.name)),
-                           str(self.data_type), str(self.path))
+    Views have the same attributes as :class:`DocItem`, but only hold a
+    reference to their table and their position in it. The strings are
+    decoded from the table's buffers when they are accessed.
+    """
 
-        def __str__(self):
-            return str(self.item)
+    __slots__ = ("table", "position")
 
-        class Meta:
-            db_table = "searchIndex"
-            database = db
+    def __init__(self, table, position):
+        self.table = table
+        self.position = position
 
-    return SearchIndex
+    @property
+    def name(self):
+        return self.table.name(self.position)
+
+    @property
+    def data_type(self):
+        return self.table.data_type(self.position)
+
+    @property
+    def path(self):
+        return self.table.path(self.position)
+
+    def __eq__(self, other):
+        return (isinstance(other, DocItemView) and
+                self.table is other.table and self.position == other.position)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((id(self.table), self.position))
+
+    def __repr__(self):
+        return repr(DocItem(self.name, self.data_type, self.path))
+
+
+class MappedArray(object):
+    """
+    Read-only array of numbers stored in a buffer, such as a memory mapped
+    file, and read in place instead of being copied into an ``array``.
+
+    :param data: object supporting the buffer interface
+    :type offset: int
+    :param offset: where the numbers start in data
+    :type typecode: str
+    :param typecode: ``array`` type code of the numbers
+    :type count: int
+    """
+
+    # Numbers unpacked at once while iterating
+    CHUNK = 4096
+
+    def __init__(self, data, offset, typecode, count):
+        self.data = data
+        self.offset = offset
+        self.typecode = typecode
+        self.count = count
+        self.itemsize = struct.calcsize("=" + typecode)
+        self.__item = struct.Struct("=" + typecode)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self.count
+        if not 0 <= position < self.count:
+            raise IndexError("MappedArray index out of range")
+        return self.__item.unpack_from(
+            self.data, self.offset + position * self.itemsize)[0]
+
+    def __iter__(self):
+        for start in xrange(0, self.count, self.CHUNK):
+            count = min(self.CHUNK, self.count - start)
+            for value in struct.unpack_from(
+                    "={0}{1}".format(count, self.typecode), self.data,
+                    self.offset + start * self.itemsize):
+                yield value
+
+    def tostring(self):
+        return self.data[self.offset:self.offset + self.count * self.itemsize]
+
+
+class MappedBytes(object):
+    """Read-only byte string stored in a buffer and read in place."""
+
+    def __init__(self, data, offset, length):
+        self.data = data
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        start, stop, _ = index.indices(self.length)
+        return self.data[self.offset + start:self.offset + stop]
+
+    def __str__(self):
+        return self.data[self.offset:self.offset + self.length]
+
+
+class DocItemTable(object):
+    """
+    Compact, columnar storage for the items of a docset.
+
+    Types are interned into small integer codes. Names and paths are
+    UTF-8 encoded into contiguous buffers, with an array of end offsets per
+    column, so every item costs a few bytes of bookkeeping on top of its
+    text instead of a tuple and three string objects. Indexing the table
+    returns a :class:`DocItemView`.
+    """
+
+    # magic, format version, item count, name bytes, path bytes, type bytes
+    HEADER = struct.Struct("=4sBIIII")
+    MAGIC = "TDIT"
+    VERSION = 1
+
+    def __init__(self):
+        self.types = []
+        self.codes = array("H")
+        self.names = bytearray()
+        self.name_ends = array("I")
+        self.paths = bytearray()
+        self.path_ends = array("I")
+        self.__type_codes = {}
+
+    def append(self, name, data_type, path):
+        """
+        Adds an item to the end of the table.
+
+        :type name: unicode
+        :type data_type: str
+        :type path: str
+        """
+        code = self.__type_codes.get(data_type)
+        if code is None:
+            code = self.__type_codes[data_type] = len(self.types)
+            self.types.append(data_type)
+        self.codes.append(code)
+        self.names.extend(name.encode("utf-8"))
+        self.name_ends.append(len(self.names))
+        self.paths.extend(path)
+        self.path_ends.append(len(self.paths))
+
+    def dumps(self):
+        """
+        Serializes the table into a compact binary string.
+
+        :rtype: str
+        """
+        types = json.dumps(self.types)
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, len(self),
+                                  len(self.names), len(self.paths),
+                                  len(types))
+        return b"".join((header, types, self.codes.tostring(),
+                         self.name_ends.tostring(), self.path_ends.tostring(),
+                         bytes(self.names), bytes(self.paths)))
+
+    @classmethod
+    def loads(cls, data):
+        """
+        Rebuilds a table serialized by :meth:`dumps`.
+
+        :type data: str
+        :rtype: DocItemTable
+        :raises ValueError: if data is not a serialized table
+        """
+        if len(data) < cls.HEADER.size:
+            raise ValueError("Truncated DocItemTable")
+        magic, version, count, names, paths, types = cls.HEADER.unpack_from(
+            data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("Not a DocItemTable")
+        table = cls()
+        offset = cls.HEADER.size
+        for data_type in json.loads(data[offset:offset + types]):
+            table.__type_codes[str(data_type)] = len(table.types)
+            table.types.append(str(data_type))
+        offset += types
+        for column in (table.codes, table.name_ends, table.path_ends):
+            size = count * column.itemsize
+            column.fromstring(data[offset:offset + size])
+            offset += size
+        table.names = bytearray(data[offset:offset + names])
+        table.paths = bytearray(data[offset + names:offset + names + paths])
+        if len(table.paths) != paths or len(table.path_ends) != count:
+            raise ValueError("Truncated DocItemTable")
+        return table
+
+    @classmethod
+    def mapped(cls, data, offset=0):
+        """
+        Wraps a table serialized by :meth:`dumps` without copying it. The
+        columns are read straight from data, e.g. a memory mapped file,
+        which must stay open for as long as the table is used.
+
+        :param data: object supporting the buffer interface
+        :type offset: int
+        :param offset: where the serialized table starts in data
+        :rtype: DocItemTable
+        :raises ValueError: if data holds no serialized table at offset
+        """
+        if len(data) < offset + cls.HEADER.size:
+            raise ValueError("Truncated DocItemTable")
+        magic, version, count, names, paths, types = cls.HEADER.unpack_from(
+            data, offset)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError("Not a DocItemTable")
+        table = cls()
+        offset += cls.HEADER.size
+        for data_type in json.loads(data[offset:offset + types]):
+            table.__type_codes[str(data_type)] = len(table.types)
+            table.types.append(str(data_type))
+        offset += types
+        columns = []
+        for column in (table.codes, table.name_ends, table.path_ends):
+            columns.append(MappedArray(data, offset, column.typecode, count))
+            offset += count * column.itemsize
+        table.codes, table.name_ends, table.path_ends = columns
+        table.names = MappedBytes(data, offset, names)
+        table.paths = MappedBytes(data, offset + names, paths)
+        if len(data) < offset + names + paths:
+            raise ValueError("Truncated DocItemTable")
+        return table
+
+    def type_code(self, data_type):
+        """
+        Gets the code a type is stored as.
+
+        :type data_type: str
+        :rtype: int or None
+        :returns: the code, or None if no item has that type
+        """
+        return self.__type_codes.get(data_type)
+
+    def name(self, position):
+        start = self.name_ends[position - 1] if position else 0
+        return self.names[start:self.name_ends[position]].decode("utf-8")
+
+    def data_type(self, position):
+        return self.types[self.codes[position]]
+
+    def path(self, position):
+        start = self.path_ends[position - 1] if position else 0
+        return str(self.paths[start:self.path_ends[position]])
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += len(self)
+        if not 0 <= position < len(self):
+            raise IndexError("DocItemTable index out of range")
+        return DocItemView(self, position)
+
+    def __iter__(self):
+        for position in xrange(len(self)):
+            yield DocItemView(self, position)
+
+
+class IndexConnections(object):
+    """
+    Read-only connections to the ``docSet.dsidx`` databases of docsets,
+    pooled per thread.
+
+    Docsets are never written to, so their databases are opened read-only
+    and, where SQLite accepts URI filenames, as immutable, which skips all
+    locking. Pages are read through a memory map of up to ``mmap_size``
+    bytes. A connection is reopened when its database file is replaced, and
+    connections are never shared with forked worker processes.
+    """
+
+    def __init__(self, mmap_size=256 * 1024 * 1024):
+        self.mmap_size = mmap_size
+        self.__local = threading.local()
+        self.__uri = None
+
+    def __supports_uri(self):
+        if self.__uri is None:
+            db = sqlite3.connect(":memory:")
+            try:
+                self.__uri = any(option == "USE_URI" for option, in
+                                 db.execute("PRAGMA compile_options"))
+            finally:
+                db.close()
+        return self.__uri
+
+    def __connections(self):
+        local = self.__local
+        if getattr(local, "pid", None) != os.getpid():
+            # Connections inherited from the parent process must not be
+            # used, nor closed.
+            local.pid = os.getpid()
+            local.connections = {}
+        return local.connections
+
+    def connect(self, db_path):
+        """
+        Gets this thread's connection to a docset's index database.
+
+        :type db_path: str
+        :param db_path: path of ``docSet.dsidx``
+        :rtype: sqlite3.Connection
+        """
+        stat = os.stat(db_path)
+        stamp = (stat.st_ino, stat.st_mtime, stat.st_size)
+        connections = self.__connections()
+        if db_path in connections:
+            db, opened = connections[db_path]
+            if opened == stamp:
+                return db
+            db.close()
+        if self.__supports_uri():
+            db = sqlite3.connect("file:{0}?mode=ro&immutable=1".format(
+                urllib.quote(os.path.abspath(db_path))))
+        else:
+            db = sqlite3.connect(db_path)
+        db.execute("PRAGMA query_only = ON")
+        db.execute("PRAGMA mmap_size = {0:d}".format(self.mmap_size))
+        connections[db_path] = (db, stamp)
+        return db
+
+    def iterate(self, db_path, sql, parameters=(), size=None):
+        """
+        Runs a query and streams its rows in batches, as plain tuples.
+
+        :type db_path: str
+        :type sql: str
+        :type parameters: tuple or dict
+        :type size: int
+        :param size: rows per batch, :data:`READ_BATCH` by default
+        :returns: iterator of lists of rows
+        """
+        cursor = self.connect(db_path).execute(sql, parameters)
+        try:
+            while True:
+                rows = cursor.fetchmany(size or READ_BATCH)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    def fetchall(self, db_path, sql, parameters=()):
+        """
+        Runs a query and returns every row as a plain tuple.
+
+        :rtype: list
+        """
+        cursor = self.connect(db_path).execute(sql, parameters)
+        try:
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def close(self):
+        """Closes this thread's connections."""
+        connections = self.__connections()
+        for db, _ in connections.itervalues():
+            db.close()
+        connections.clear()
+
+
+READ_BATCH = 10000
+# Shared by every docset
+index_connections = IndexConnections()
+
+
+@trace.traced("read_items", "docsets")
+def read_items(db_path):
+    """
+    Reads every row of a docset's search index.
+
+    :type db_path: str
+    :param db_path: path of ``docSet.dsidx``
+    :rtype: DocItemTable
+    """
+    items = DocItemTable()
+    batches = index_connections.iterate(
+        db_path, "SELECT name, type, path FROM searchIndex ORDER BY id")
+    # Rows are fetched and normalized in batches so that tracing can tell
+    # the time spent in SQLite from the time spent in normalize.
+    while True:
+        with trace.span("sqlite.fetch", "docsets"):
+            batch = next(batches, None)
+        if batch is None:
+            break
+        with trace.span("normalize", "docsets", items=len(batch)):
+            for name, data_type, path in batch:
+                items.append(normalize("NFKD", unicode(name)),
+                             str(data_type), str(path))
+    return items
+
+
+def ingest(db_path):
+    """
+    Reads the items of a docset in a worker process of a
+    :class:`DocsetLoader`. Only strings cross the process boundary: the items
+    are sent back serialized, and errors as formatted tracebacks.
+
+    :type db_path: str
+    :param db_path: path of ``docSet.dsidx``
+    :rtype: tuple
+    :returns: ``(serialized items, None)`` or ``(None, traceback)``
+    """
+    try:
+        return read_items(db_path).dumps(), None
+    except Exception:
+        return None, traceback.format_exc()
 
 
 class Docset:
@@ -46,7 +451,12 @@ class Docset:
         self.index_path = None
         self.icon_url = None
         self.icon_path = None
+        self.manifest = None
+        self._archive = None
         self._items = None
+        self._type_counts = None
+        self._type_positions = None
+        self._lookup = None
         self._doc_path = None
         if path and self.on_disk:
             self.read_docset()
@@ -67,27 +477,185 @@ class Docset:
                                           "Contents/Resources/Documents/")
         return self._doc_path
 
+    @property
+    def archive(self):
+        """
+        Gets the archive the documentation is kept in, if it is not unpacked
+        into :attr:`doc_path`.
+
+        :rtype: tarpon_app.archive.DocsetArchive or None
+        """
+        if (self._archive is None and self.on_disk and
+                not os.path.isdir(self.doc_path)):
+            # Imported here as the archive server pulls in the HTTP modules
+            from tarpon_app.archive import DocsetArchive
+            self._archive = DocsetArchive.fordocset(self.path)
+        return self._archive
+
+    @property
+    def index_page(self):
+        """Path of the docset's start page relative to :attr:`doc_path`."""
+        if self.index_path and self.doc_path:
+            return os.path.relpath(self.index_path, self.doc_path)
+
+    @property
+    def signature(self):
+        """
+        Identifies the current contents of the docset's index database.
+
+        :rtype: tuple
+        :returns: modification time and size of ``docSet.dsidx``
+        """
+        if self.on_disk:
+            stat = os.stat(self.db_path)
+            return (stat.st_mtime, stat.st_size)
+
+    @property
+    def loaded(self):
+        return self._items is not None
+
     @property
     def items(self):
-        if not self._items:
-            db = peewee.SqliteDatabase(self.db_path, threadlocals=True)
-            db.connect()
-            self._items = [a.item for a in index_model(db).select()]
-            db.close()
+        if not self.items_cached:
+            self.set_items(read_items(self.db_path))
         return self._items
 
-    def read_docset(self):
+    def set_items(self, items):
+        """
+        Sets the items of the docset once they have been read elsewhere.
+
+        :type items: DocItemTable
+        """
+        self._items = items
+        self._remember()
+
+    def restore(self, items, type_positions):
+        """
+        Sets the items of the docset and their grouping by type from a
+        snapshot, which the manifest already agrees with.
+
+        :type items: DocItemTable
+        :type type_positions: dict
+        :param type_positions: see :attr:`type_positions`
+        """
+        self._items = items
+        self._type_positions = type_positions
+
+    @property
+    def items_cached(self):
+        """
+        Loads the items from the manifest if they are cached there.
+
+        :rtype: bool
+        :returns: True if the items are loaded
+        """
+        if self._items is None and self.manifest is not None:
+            self._items = self.manifest.load_items(self.path)
+        return self._items is not None
+
+    @property
+    def has_type_counts(self):
+        return self._type_counts is not None
+
+    @property
+    def type_counts(self):
+        """
+        Gets the number of items of each type. The items are counted by
+        SQLite, so they do not need to be loaded.
+
+        :rtype: dict
+        :returns: item count for each data type
+        """
+        if self._type_counts is None:
+            if self._items is not None:
+                types = self._items.types
+                counts = dict((data_type, 0) for data_type in types)
+                for code in self._items.codes:
+                    counts[types[code]] += 1
+            else:
+                with trace.span("sqlite.type_counts", "docsets",
+                                docset=self.name):
+                    counts = dict((str(data_type), count)
+                                  for data_type, count in self.query(
+                                      "SELECT type, COUNT(id) "
+                                      "FROM searchIndex GROUP BY type"))
+            self._type_counts = counts
+            self._remember()
+        return self._type_counts
+
+    @property
+    def type_positions(self):
+        """
+        Groups the items by type.
+
+        :rtype: dict
+        :returns: positions in :attr:`items` of the items of each data type
+        """
+        if self._type_positions is None:
+            items = self.items
+            positions = [array("I") for _ in items.types]
+            for position, code in enumerate(items.codes):
+                positions[code].append(position)
+            self._type_positions = dict(zip(items.types, positions))
+        return self._type_positions
+
+    def query(self, sql, parameters=()):
+        """
+        Runs a query against the docset's index database without loading
+        its items, e.g. to look up a few rows of ``searchIndex``.
+
+        :type sql: str
+        :type parameters: tuple or dict
+        :returns: iterator of rows, as plain tuples
+        """
+        for rows in index_connections.iterate(self.db_path, sql, parameters):
+            for row in rows:
+                yield row
+
+    def find(self, name, data_type):
+        """
+        Finds the items with a given name and type in constant time.
+
+        :type name: unicode
+        :param name: item name
+        :type data_type: str
+        :param data_type: item type
+        :rtype: list
+        :returns: positions in :attr:`items` of every matching item, in
+                  index order (a name may be documented more than once)
+        """
+        if self._lookup is None:
+            lookup = {}
+            items = self.items
+            for position in xrange(len(items)):
+                key = (items.name(position), items.data_type(position))
+                if key in lookup:
+                    lookup[key].append(position)
+                else:
+                    lookup[key] = [position]
+            self._lookup = lookup
+        return self._lookup.get((name, data_type), [])
+
+    def _remember(self):
+        """Records what has been read about the docset in its manifest."""
+        if self.manifest is not None:
+            self.manifest.update(self)
+            self.manifest.save()
+
+    def read_docset(self, pl=None):
         if self.on_disk:
             plist_path = os.path.join(self.path, "Contents", "Info.plist")
-            if os.path.exists(plist_path):
-                pl = plistlib.readPlist(plist_path)
+            if pl is not None or os.path.exists(plist_path):
+                if pl is None:
+                    with trace.span("plist", "docsets", path=plist_path):
+                        pl = plistlib.readPlist(plist_path)
                 if pl["isDashDocset"]:
                     self.name = pl["CFBundleName"]
                     self.identifier = pl["CFBundleIdentifier"]
                     self.index_path = os.path.join(self.doc_path,
                                                    pl["dashIndexFilePath"])
                 else:
-                    InvalidDocsetException(
+                    raise InvalidDocsetException(
                         "isDashDocset is not True in {0}".format(plist_path))
             else:
                 raise InvalidDocsetException("{0} not found".format(plist_path))
@@ -98,15 +666,167 @@ class Docset:
         return "<Docset '{0}'>".format(self.name)
 
     @classmethod
-    def frompath(cls, path):
+    def frompath(cls, path, manifest=None):
+        """
+        Creates a docset from its directory.
+
+        :type path: str
+        :param path: path of the ``.docset`` directory
+        :type manifest: tarpon_app.manifest.DocsetManifest
+        :param manifest: optional cache to restore the docset from, and to
+                         record it in, instead of parsing its Info.plist
+        :rtype: Docset
+        """
+        if manifest is not None:
+            entry = manifest.lookup(path)
+            if entry is not None:
+                new_docset = cls(entry["name"])
+                new_docset.path = path
+                new_docset.identifier = entry["identifier"]
+                new_docset.index_path = entry["index_path"]
+                new_docset._type_counts = entry["type_counts"]
+                new_docset.manifest = manifest
+                return new_docset
         plist_path = os.path.join(path, "Contents", "Info.plist")
         if os.path.exists(plist_path):
-            pl = plistlib.readPlist(plist_path)
+            with trace.span("plist", "docsets", path=plist_path):
+                pl = plistlib.readPlist(plist_path)
             if pl["isDashDocset"]:
-                new_docset = cls(pl["CFBundleName"], path=path)
+                new_docset = cls(pl["CFBundleName"])
+                new_docset.path = path
+                new_docset.read_docset(pl)
+                if manifest is not None:
+                    new_docset.manifest = manifest
+                    manifest.update(new_docset)
                 return new_docset
             else:
-                InvalidDocsetException(
+                raise InvalidDocsetException(
                     "isDashDocset is not True in {0}".format(plist_path))
         else:
             raise InvalidDocsetException("{0} not found".format(plist_path))
+
+
+class DocsetLoader(threading.Thread):
+    """
+    Loads the items of docsets in the background.
+
+    Docsets are loaded in the order they are requested, except that urgent
+    requests (e.g. the user expanding a docset in the sidebar) jump the
+    queue. Docsets that are not cached in their manifest are read by a pool
+    of at most ``processes`` worker processes, one docset per worker, so
+    that loading many docsets uses every core. ``callback`` is invoked on
+    the loader thread with each docset once its items are loaded, and
+    ``progress`` with the number of docsets loaded and requested so far.
+    """
+
+    def __init__(self, callback, progress=None, processes=None):
+        threading.Thread.__init__(self, name="tarpon-loader")
+        self.daemon = True
+        self.callback = callback
+        self.progress = progress
+        self.processes = processes or multiprocessing.cpu_count()
+        # The workers are only forked once a docset has to be read from its
+        # index, which most launches restore from the snapshot or manifest.
+        self.__pool = None
+        self.__condition = threading.Condition()
+        self.__queue = deque()
+        self.__running = set()
+        self.__finished = deque()
+        self.__done = 0
+        self.__total = 0
+        self.__stopped = False
+
+    @property
+    def pending(self):
+        """Names of the docsets waiting to be loaded or being loaded."""
+        with self.__condition:
+            return set(docset.name for docset in
+                       list(self.__queue) + list(self.__running))
+
+    def request(self, docset, urgent=False):
+        """
+        Queues docset for loading unless it is already loaded or queued.
+
+        :type docset: Docset
+        :type urgent: bool
+        :param urgent: load docset before every other queued docset
+        """
+        with self.__condition:
+            if docset.loaded or docset in self.__running:
+                return
+            if docset in self.__queue:
+                if not urgent:
+                    return
+                self.__queue.remove(docset)
+            else:
+                self.__total += 1
+            if urgent:
+                self.__queue.appendleft(docset)
+            else:
+                self.__queue.append(docset)
+            self.__condition.notify()
+
+    def stop(self):
+        """Stops the loader thread and its worker processes."""
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify()
+            pool, self.__pool = self.__pool, None
+        if pool is not None:
+            pool.terminate()
+
+    def __workers(self):
+        """Gets the pool of worker processes, starting it if necessary."""
+        with self.__condition:
+            if self.__pool is None and not self.__stopped:
+                self.__pool = multiprocessing.Pool(self.processes)
+            return self.__pool
+
+    def __ingested(self, docset, result):
+        # Called on the pool's result thread; leave the work to run().
+        with self.__condition:
+            self.__finished.append((docset, result))
+            self.__condition.notify()
+
+    def __finish(self, docset, data=None, error=None):
+        if data is not None:
+            docset.set_items(DocItemTable.loads(data))
+        elif error is not None:
+            print("Could not load {0}:\n{1}".format(docset.path, error))
+        with self.__condition:
+            self.__running.discard(docset)
+            self.__done += 1
+            done, total = self.__done, self.__total
+            if done == total:
+                self.__done = self.__total = 0
+        if error is None:
+            self.callback(docset)
+        if self.progress:
+            self.progress(done, total)
+
+    def run(self):
+        while True:
+            with self.__condition:
+                while not (self.__stopped or self.__finished or
+                           (self.__queue and
+                            len(self.__running) < self.processes)):
+                    self.__condition.wait()
+                if self.__stopped:
+                    return
+                if self.__finished:
+                    docset, result = self.__finished.popleft()
+                else:
+                    docset, result = self.__queue.popleft(), None
+                    self.__running.add(docset)
+            if result is not None:
+                self.__finish(docset, *result)
+            elif docset.items_cached:
+                self.__finish(docset)
+            else:
+                pool = self.__workers()
+                if pool is None:
+                    return
+                pool.apply_async(
+                    ingest, (docset.db_path,),
+                    callback=lambda result, docset=docset:
+                    self.__ingested(docset, result))
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Concurrent, resumable docset downloads.
+
+Docset archives (``.tgz``) are streamed straight into ``tarfile`` and
+unpacked while they download. The bytes received so far are also appended
+to a ``.part`` file in the cache directory, so an interrupted download
+resumes with an HTTP Range request. The part file is deleted as soon as the
+docset has been unpacked.
+"""
+
+import httplib
+from multiprocessing.pool import ThreadPool
+import os
+import re
+import shutil
+import tarfile
+import threading
+import urllib2
+
+
+class DownloadError(Exception):
+    pass
+
+
+class DownloadCancelled(DownloadError):
+    pass
+
+
+def safe_members(tar, destination):
+    """
+    Yields the members of a streamed archive that unpack inside destination.
+
+    :type tar: tarfile.TarFile
+    :type destination: str
+    :param destination: directory the archive is unpacked into
+    """
+    destination = os.path.abspath(destination)
+    for member in tar:
+        target = os.path.abspath(os.path.join(destination, member.name))
+        if not target.startswith(destination + os.sep):
+            continue
+        if not (member.isfile() or member.isdir()):
+            continue
+        yield member
+
+
+class DownloadStream(object):
+    """
+    File-like object that first reads back a partial download and then
+    continues with the network response, appending whatever it receives to
+    the partial download.
+    """
+
+    def __init__(self, part_path, response, resumed, progress=None,
+                 cancelled=None):
+        self.__part = open(part_path, "r+b" if resumed else "w+b")
+        self.__response = response
+        self.__local = resumed
+        self.__progress = progress
+        self.__cancelled = cancelled
+        self.received = os.path.getsize(part_path)
+
+    def read(self, size=-1):
+        if self.__cancelled and self.__cancelled():
+            raise DownloadCancelled("Download cancelled")
+        if self.__local:
+            data = self.__part.read(size)
+            if data:
+                return data
+            self.__local = False
+            self.__part.seek(0, os.SEEK_END)
+        data = self.__response.read(size)
+        self.__part.write(data)
+        self.received += len(data)
+        if self.__progress:
+            self.__progress(self.received)
+        return data
+
+    def close(self):
+        self.__part.close()
+        self.__response.close()
+
+
+class Download(object):
+    """State of a single docset download."""
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.received = 0
+        self.total = None
+        self.path = None
+        self.error = None
+        self.__cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.__cancelled.is_set()
+
+    def cancel(self):
+        """Stops the download. Its partial data is kept for resuming."""
+        self.__cancelled.set()
+
+
+class DocsetDownloader(object):
+    """
+    Downloads docset archives with a bounded pool of threads.
+
+    ``callback`` is invoked on a pool thread with each finished
+    :class:`Download`; ``download.path`` is the unpacked ``.docset``
+    directory, or None and ``download.error`` is set if the download failed.
+    ``progress`` is invoked with the download whenever more data arrives.
+    ``opener`` may be any ``urllib2`` opener, e.g. to talk to a local
+    stand-in server.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, data_dir, cache_dir, callback, progress=None,
+                 max_downloads=3, opener=None):
+        self.data_dir = data_dir
+        self.part_dir = os.path.join(cache_dir, "downloads")
+        if not os.path.exists(self.part_dir):
+            os.makedirs(self.part_dir)
+        self.callback = callback
+        self.progress = progress
+        self.opener = opener or urllib2.build_opener()
+        self.__pool = ThreadPool(max_downloads)
+        self.__lock = threading.Lock()
+        self.__downloads = {}
+
+    @property
+    def downloads(self):
+        """Downloads that are queued or running, by docset name."""
+        with self.__lock:
+            return dict(self.__downloads)
+
+    def part_path(self, name):
+        filename = "".join(c if c.isalnum() else "_" for c in name)
+        return os.path.join(self.part_dir, filename + ".part")
+
+    def download(self, name, url):
+        """
+        Queues a docset for downloading unless it is already queued.
+
+        :type name: str
+        :param name: name of the docset
+        :type url: str
+        :param url: URL of the docset archive
+        :rtype: Download
+        """
+        with self.__lock:
+            if name in self.__downloads:
+                return self.__downloads[name]
+            download = self.__downloads[name] = Download(name, url)
+        self.__pool.apply_async(self.__run, (download,))
+        return download
+
+    def stop(self):
+        """Cancels every download and stops the pool."""
+        with self.__lock:
+            for download in self.__downloads.itervalues():
+                download.cancel()
+        self.__pool.terminate()
+
+    def __open(self, download, offset):
+        request = urllib2.Request(download.url)
+        if offset:
+            request.add_header("Range", "bytes={0}-".format(offset))
+        try:
+            response = self.opener.open(request)
+        except urllib2.HTTPError as e:
+            if e.code != 416 or not offset:
+                raise
+            # The partial download is complete or no longer matches the
+            # archive on the server, so start over.
+            return self.__open(download, 0)
+        resumed = offset > 0 and response.getcode() == 206
+        length = response.info().getheader("Content-Length")
+        content_range = response.info().getheader("Content-Range")
+        if resumed and content_range:
+            match = re.search(r"/(\d+)$", content_range)
+            download.total = int(match.group(1)) if match else None
+        elif length:
+            download.total = int(length) + (offset if resumed else 0)
+        return response, resumed
+
+    def __unpack(self, download, stream, staging):
+        tar = tarfile.open(fileobj=stream, mode="r|*",
+                           bufsize=self.CHUNK_SIZE)
+        try:
+            for member in safe_members(tar, staging):
+                tar.extract(member, staging)
+        finally:
+            tar.close()
+        for root, dirs, files in os.walk(staging):
+            for directory in dirs:
+                if directory.endswith(".docset"):
+                    return os.path.join(root, directory)
+        raise DownloadError("No docset in {0}".format(download.url))
+
+    def __install(self, source):
+        destination = os.path.join(self.data_dir, os.path.basename(source))
+        if os.path.exists(destination):
+            old = destination + ".old"
+            os.rename(destination, old)
+            shutil.rmtree(old, ignore_errors=True)
+        os.rename(source, destination)
+        return destination
+
+    def __run(self, download):
+        part_path = self.part_path(download.name)
+        staging = os.path.join(self.data_dir,
+                               "." + os.path.basename(part_path) + ".unpack")
+        try:
+            if os.path.exists(staging):
+                shutil.rmtree(staging)
+            offset = (os.path.getsize(part_path)
+                      if os.path.exists(part_path) else 0)
+            response, resumed = self.__open(download, offset)
+
+            def progress(received):
+                download.received = received
+                if self.progress:
+                    self.progress(download)
+
+            stream = DownloadStream(part_path, response, resumed, progress,
+                                    lambda: download.cancelled)
+            try:
+                docset = self.__unpack(download, stream, staging)
+            finally:
+                stream.close()
+            download.path = self.__install(docset)
+            os.remove(part_path)
+        except (DownloadError, EnvironmentError, httplib.HTTPException,
+                tarfile.TarError) as e:
+            download.error = e
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+            with self.__lock:
+                self.__downloads.pop(download.name, None)
+        self.callback(download)
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""SQLite FTS5 search backend.
+
+Instead of holding every item in Python, this backend copies the
+``searchIndex`` table of each docset into a shadow database in the cache
+directory, with an FTS5 trigram index over the item names. Queries run as
+a single SQL statement over all of the shadow databases attached to one
+read-only connection, and only the top results are ever turned into Python
+objects.
+
+The backend has the same interface as :class:`tarpon_app.search.SearchIndex`
+but ranks differently: exact matches first, then prefix matches, then any
+other item containing the query, with shorter names ranked higher within
+each tier. Queries shorter than three characters can only match prefixes.
+Queries scoped to docsets only query the shadow databases of those
+docsets, and queries scoped to item types use the ``(type, lname)`` index.
+Names are NFKD normalized and lowercased by Python when they are copied,
+exactly like queries and like the names of the in-memory backend.
+"""
+
+import os
+import sqlite3
+import threading
+from unicodedata import normalize
+
+from tarpon_app.docsets import DocItem
+from tarpon_app.search import LRUCache, parse_scope, SearchResult
+from tarpon_app import trace
+
+
+SCHEMA = """
+CREATE TABLE meta(key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE items(id INTEGER PRIMARY KEY, name TEXT, type TEXT, path TEXT,
+                   lname TEXT);
+CREATE INDEX items_lname ON items(lname);
+CREATE INDEX items_type ON items(type, lname);
+CREATE VIRTUAL TABLE names USING fts5(name, content='items',
+                                      content_rowid='id', tokenize='trigram');
+"""
+
+# Item ids start at 1 and follow the rowid order of searchIndex, which is
+# the order Docset.items is read in, so position = id - 1.
+COPY_ITEMS = """
+INSERT INTO items(name, type, path, lname)
+SELECT nfkd(name), type, path, nfkd_lower(name) FROM source.searchIndex
+ORDER BY rowid
+"""
+
+RANKED = """
+SELECT {order} AS docset, items.id - 1 AS position,
+       items.name, items.type, items.path,
+       CASE WHEN items.lname = :query THEN 0
+            WHEN substr(items.lname, 1, :length) = :query THEN 1
+            ELSE 2 END AS tier
+FROM {schema}.{source}
+"""
+
+FROM_PREFIX = """items
+WHERE items.lname >= :query AND items.lname < :query || x'ff'
+"""
+
+FROM_MATCH = """names JOIN {schema}.items ON items.id = names.rowid
+WHERE names MATCH :match
+"""
+
+
+def nfkd(name):
+    """
+    Normalizes an item name the way :func:`tarpon_app.docsets.read_items`
+    does.
+
+    :type name: unicode
+    :rtype: unicode
+    """
+    return normalize("NFKD", name) if name is not None else None
+
+
+def nfkd_lower(name):
+    """
+    Normalizes and lowercases an item name the way queries are.
+
+    :type name: unicode
+    :rtype: unicode
+    """
+    return normalize("NFKD", name).lower() if name is not None else None
+
+
+class FTSIndex(object):
+    """
+    Search over FTS5 shadow databases of every docset added to it.
+
+    Each thread that searches gets its own connections. SQLite limits how
+    many databases can be attached to one connection, so the shadow
+    databases are spread over as many connections as needed.
+    """
+
+    # Docset items do not need to be loaded into Python to be searched.
+    needs_items = False
+    ATTACH_LIMIT = 10
+    VERSION = "3"
+    # Number of queries whose results are cached
+    CACHE_SIZE = 256
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.join(cache_dir, "fts")
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        self.__lock = threading.Lock()
+        self.__docsets = []
+        self.__generation = 0
+        self.__local = threading.local()
+        self.__results = LRUCache(self.CACHE_SIZE)
+
+    @property
+    def generation(self):
+        """
+        Number of times docsets were added or removed, e.g. to tell whether
+        results cached elsewhere are still valid.
+
+        :rtype: int
+        """
+        with self.__lock:
+            return self.__generation
+
+    def shadow_path(self, docset):
+        """
+        Gets the shadow database of a docset.
+
+        :type docset: tarpon_app.docsets.Docset
+        :rtype: str
+        """
+        filename = "".join(c if c.isalnum() else "_" for c in docset.name)
+        return os.path.join(self.cache_dir, filename + ".db")
+
+    def __is_current(self, path, signature):
+        if not os.path.exists(path):
+            return False
+        try:
+            db = sqlite3.connect(path)
+            try:
+                values = dict(db.execute("SELECT key, value FROM meta"))
+            finally:
+                db.close()
+        except sqlite3.Error:
+            return False
+        return (values.get("version") == self.VERSION and
+                values.get("signature") == repr(signature))
+
+    @trace.traced("fts.build", "fts")
+    def build(self, docset):
+        """
+        Creates or refreshes the shadow database of a docset.
+
+        :type docset: tarpon_app.docsets.Docset
+        """
+        path = self.shadow_path(docset)
+        signature = docset.signature
+        if self.__is_current(path, signature):
+            return
+        tmp_path = path + ".tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        db = sqlite3.connect(tmp_path)
+        try:
+            db.create_function("nfkd", 1, nfkd)
+            db.create_function("nfkd_lower", 1, nfkd_lower)
+            db.executescript(SCHEMA)
+            db.execute("ATTACH DATABASE ? AS source", (docset.db_path,))
+            db.execute(COPY_ITEMS)
+            db.execute("INSERT INTO names(names) VALUES ('rebuild')")
+            db.executemany("INSERT INTO meta VALUES (?, ?)",
+                           (("version", self.VERSION),
+                            ("signature", repr(signature))))
+            db.commit()
+            db.execute("DETACH DATABASE source")
+        finally:
+            db.close()
+        os.rename(tmp_path, path)
+
+    def add(self, docset):
+        """
+        Adds a docset, building its shadow database if necessary.
+
+        :type docset: tarpon_app.docsets.Docset
+        """
+        self.build(docset)
+        with self.__lock:
+            self.__docsets = [d for d in self.__docsets
+                              if d.name != docset.name] + [docset]
+            self.__generation += 1
+            self.__results.clear()
+
+    def remove(self, name):
+        """
+        Removes a docset from the search.
+
+        :type name: str
+        :param name: name of the docset
+        """
+        with self.__lock:
+            self.__docsets = [d for d in self.__docsets if d.name != name]
+            self.__generation += 1
+            self.__results.clear()
+
+    def __connections(self, generation, docsets):
+        """
+        Gets this thread's connections, reopening them if outdated.
+
+        :type generation: int
+        :type docsets: list
+        :param docsets: the docsets of that generation
+        """
+        local = self.__local
+        if getattr(local, "generation", None) != generation:
+            for db, _ in getattr(local, "connections", ()):
+                db.close()
+            local.connections = []
+            for start in xrange(0, len(docsets), self.ATTACH_LIMIT):
+                group = docsets[start:start + self.ATTACH_LIMIT]
+                db = sqlite3.connect(":memory:")
+                db.execute("PRAGMA query_only = ON")
+                for number, docset in enumerate(group):
+                    db.execute("ATTACH DATABASE ? AS d{0}".format(number),
+                               (self.shadow_path(docset),))
+                local.connections.append((db, group))
+            local.generation = generation
+        return local.connections
+
+    def __statement(self, schemas, match, types):
+        parts = []
+        for number in schemas:
+            schema = "d{0}".format(number)
+            source = (FROM_MATCH if match else FROM_PREFIX).format(
+                schema=schema)
+            if types:
+                source += "AND items.type IN ({0})\n".format(", ".join(
+                    ":type{0}".format(i) for i in xrange(len(types))))
+            parts.append(RANKED.format(order=number, schema=schema,
+                                       source=source))
+        return ("SELECT * FROM ({0}) "
+                "ORDER BY tier, length(name), docset, position "
+                "LIMIT :limit".format(" UNION ALL ".join(parts)))
+
+    def search(self, query, limit=5, cancelled=None, default_scope=None):
+        """
+        Finds the items best matching query.
+
+        :type query: unicode
+        :param query: text typed by the user
+        :type limit: int
+        :param limit: maximum number of results
+        :param cancelled: optional callable polled while searching; the search
+                          is abandoned as soon as it returns True
+        :type default_scope: frozenset
+        :param default_scope: names of the docsets searched when the query
+                              does not name any, or None for every docset
+        :rtype: list or None
+        :returns: :class:`~tarpon_app.search.SearchResult` tuples, best
+                  first, or None if cancelled
+        """
+        if isinstance(query, str):
+            query = query.decode("utf-8")
+        query = normalize("NFKD", query)
+        with self.__lock:
+            generation, docsets = self.__generation, list(self.__docsets)
+        scope, query = parse_scope(query, docsets, default_scope)
+        lowered = query.strip().lower()
+        if not lowered:
+            return []
+        key = (generation, lowered, limit, scope)
+        cached = self.__results.get(key)
+        if cached is not None:
+            return list(cached)
+        match = None
+        if len(lowered) >= 3:
+            match = u'"{0}"'.format(lowered.replace(u'"', u'""'))
+        parameters = {"query": lowered, "length": len(lowered),
+                      "match": match, "limit": limit}
+        types = sorted(scope.types or ())
+        for number, data_type in enumerate(types):
+            parameters["type{0}".format(number)] = data_type
+        results = []
+        for db, group in self.__connections(generation, docsets):
+            schemas = [number for number, docset in enumerate(group)
+                       if scope.docsets is None or
+                       docset.name in scope.docsets]
+            if not schemas:
+                continue
+            if cancelled:
+                db.set_progress_handler(cancelled, 1000)
+            try:
+                rows = db.execute(self.__statement(schemas, match, types),
+                                  parameters)
+                for order, position, name, data_type, path, tier in rows:
+                    item = DocItem(name, str(data_type), str(path))
+                    score = (100, 95, 90)[tier]
+                    results.append(((tier, len(name)), SearchResult(
+                        item, score, group[order].name, position)))
+            except sqlite3.OperationalError:
+                if cancelled and cancelled():
+                    return None
+                raise
+            finally:
+                db.set_progress_handler(None, 1000)
+        results.sort(key=lambda x: x[0])
+        results = [result for _, result in results[:limit]]
+        self.__results.put(key, results)
+        return list(results)
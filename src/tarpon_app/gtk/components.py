@@ -3,8 +3,11 @@
 
 import os
 
-from gi.repository import Gdk, Gio, Gtk, WebKit
-from fuzzywuzzy.process import extractBests as search
+from gi.repository import Gdk, Gio, GLib, Gtk, Pango, WebKit
+
+from tarpon_app.gtk.models import DocsetTreeModel
+from tarpon_app.search import SearchWorker
+from tarpon_app import trace
 
 
 def views(pkgdatadir, path):
@@ -97,10 +100,92 @@ class Titlebar(Gtk.HeaderBar):
             self.pack_end(buttons)
 
 
+class WebTab(Gtk.ScrolledWindow):
+    """
+    Notebook page holding a web view that can be discarded to save memory.
+
+    A discarded tab keeps only the URI, title, zoom level and scroll position
+    of its page, and gets a new web view the next time :attr:`view` is used.
+    The history of a discarded tab is lost.
+    """
+
+    def __init__(self, uri=None):
+        Gtk.ScrolledWindow.__init__(self)
+        self.uri = uri
+        self.title = None
+        self.zoom_level = 1.0
+        self.scroll_position = 0.0
+        self.last_visible = GLib.get_monotonic_time()
+        self.__view = None
+        self.__scroll_handler = None
+
+    @property
+    def discarded(self):
+        return self.__view is None
+
+    @property
+    def view(self):
+        """
+        Gets the ``WebKit.WebView`` of the tab, restoring it if it had been
+        discarded.
+
+        :rtype: WebKit.WebView
+        """
+        self.restore()
+        return self.__view
+
+    def restore(self):
+        """Creates the web view again if the tab has been discarded."""
+        if self.__view is not None:
+            return
+        self.__view = WebKit.WebView()
+        self.__view.set_zoom_level(self.zoom_level)
+        self.__view.connect("title-changed", self.on_title_changed)
+        self.add(self.__view)
+        self.__view.show()
+        if self.uri:
+            if self.scroll_position:
+                self.__scroll_handler = self.__view.connect(
+                    "load-finished", self.on_restored)
+            self.__view.load_uri(self.uri)
+
+    def discard(self):
+        """Destroys the web view, remembering where it was."""
+        if self.__view is None:
+            return
+        self.uri = self.__view.get_uri() or self.uri
+        self.zoom_level = self.__view.get_zoom_level()
+        self.scroll_position = self.get_vadjustment().get_value()
+        self.remove(self.__view)
+        self.__view.destroy()
+        self.__view = None
+
+    def on_title_changed(self, view, frame, title):
+        self.title = title
+
+    def on_restored(self, view, frame):
+        view.disconnect(self.__scroll_handler)
+        self.get_vadjustment().set_value(self.scroll_position)
+
+
 class WebNotebook(Gtk.Notebook):
-    def __init__(self, new_tab_page=None):
+    """
+    Notebook of web views that discards background tabs which have not been
+    shown for ``discard_after`` seconds, and the least recently shown
+    background tabs beyond ``max_live_tabs``.
+    """
+
+    CHECK_INTERVAL = 30
+
+    def __init__(self, new_tab_page=None, discard_after=600, max_live_tabs=4):
         super(Gtk.Notebook, self).__init__()
         self.new_tab_page = new_tab_page
+        self.discard_after = discard_after
+        self.max_live_tabs = max_live_tabs
+        self.connect("switch-page", self.on_switch_page)
+        self.__check_source = GLib.timeout_add_seconds(
+            self.CHECK_INTERVAL, self.discard_tabs)
+        self.connect("destroy", self.on_destroy)
 
     def new_tab(self, widget, data=None, uri=None):
         """Create a new tab."""
@@ -110,19 +195,53 @@ class WebNotebook(Gtk.Notebook):
         else:
             self.set_show_tabs(True)
 
-        sw = Gtk.ScrolledWindow()
-        wv = WebKit.WebView()
-        sw.add(wv)
-
-        if uri:
-            wv.load_uri(uri)
-        elif self.new_tab_page:
-            wv.load_uri(self.new_tab_page)
+        tab = WebTab(uri or self.new_tab_page)
+        tab.restore()
 
         tab_label = Gtk.Label("Tab {0}".format(self.get_n_pages() + 1))
-        self.append_page(sw, tab_label)
+        self.append_page(tab, tab_label)
         self.show_all()
 
+    @property
+    def tabs(self):
+        return [self.get_nth_page(i) for i in xrange(self.get_n_pages())]
+
+    def discard_tabs(self, current=None):
+        """
+        Discards background tabs that have been hidden for too long or that
+        exceed the live tab budget.
+
+        :type current: WebTab
+        :param current: tab to keep, by default the current tab
+        :rtype: bool
+        :returns: True, so that it can be used as a periodic GLib source
+        """
+        if current is None and self.get_current_page() >= 0:
+            current = self.get_nth_page(self.get_current_page())
+        now = GLib.get_monotonic_time()
+        live = sorted((tab for tab in self.tabs
+                       if tab is not current and not tab.discarded),
+                      key=lambda tab: tab.last_visible, reverse=True)
+        for number, tab in enumerate(live, 1):
+            idle = (now - tab.last_visible) / 1e6
+            if number >= self.max_live_tabs or idle > self.discard_after:
+                tab.discard()
+        return True
+
+    def on_switch_page(self, notebook, page, page_num):
+        # The current page is still the one being switched away from.
+        now = GLib.get_monotonic_time()
+        if self.get_current_page() >= 0:
+            self.get_nth_page(self.get_current_page()).last_visible = now
+        page.last_visible = now
+        page.restore()
+        self.discard_tabs(page)
+
+    def on_destroy(self, widget):
+        if self.__check_source:
+            GLib.source_remove(self.__check_source)
+            self.__check_source = None
+
     @property
     def browser(self):
         """
@@ -131,7 +250,7 @@ class WebNotebook(Gtk.Notebook):
         :type self: WebKit.WebView
         :return: ``WebKit.WebView`` form current tab
         """
-        return self.get_nth_page(self.get_current_page()).get_child()
+        return self.get_nth_page(self.get_current_page()).view
 
     def go_back(self, widget, data=None):
         """Return to the previous page in the current tab."""
@@ -169,6 +288,10 @@ class TarponWindow(Gtk.ApplicationWindow):
             print("We should show a toolbar since app menus are not preferred")
 
         self.build_sidebar()
+        self.__search_worker = SearchWorker(
+            self.__application.search_index, self.on_search_results,
+            default_scope=lambda: self.__application.library.default_scope)
+        self.__search_worker.start()
         self.__web_notebook = WebNotebook()
         self.__web_notebook.new_tab(None)
 
@@ -214,26 +337,31 @@ class TarponWindow(Gtk.ApplicationWindow):
                                           linked=True, spacing=0)
         self.__header.add_buttons_to_right((self.__new_tab, self.__menu))
 
+    @trace.traced("build_sidebar", "gtk")
     def build_sidebar(self):
         # TODO: Refactor build_sidebar() into its own "Sidebar" component
         self.__sidebar = Gtk.Box.new(Gtk.Orientation.VERTICAL, 6)
         self.__sidebar.set_homogeneous(False)
         self.__results = None
+        self.__visible = set()
+        # Paths of the pages of the results, by docset and position
+        self.__result_paths = {}
         self.__sidescroll = Gtk.ScrolledWindow()
-        self.__sidebar_store = Gtk.TreeStore(str)
+        # The model is shared by every window; only the filter is our own.
+        self.__sidebar_store = self.__application.sidebar_model
         self.__sidebar_filter = self.__sidebar_store.filter_new()
         self.__sidebar_filter.set_visible_func(self.filter_func)
-        for name, docset in self.__application.docsets_on_disk:
-            treeiter = self.__sidebar_store.append(None, [name])
-            type_rows = {}
-            for item in docset.items:
-                if item.data_type not in type_rows:
-                    type_rows[item.data_type] = self.__sidebar_store.append(treeiter, [item.data_type])
-                self.__sidebar_store.append(type_rows[item.data_type],
-                                            [item.name])
+        self.__waiting_types = set()
+        self.__sidebar_menu = None
         self.__treeview = Gtk.TreeView.new_with_model(self.__sidebar_filter)
         renderer = Gtk.CellRendererText()
-        column = Gtk.TreeViewColumn(None, renderer, text=0)
+        column = Gtk.TreeViewColumn(None, renderer,
+                                    text=DocsetTreeModel.LABEL)
+        status_renderer = Gtk.CellRendererText()
+        status_renderer.set_property("style", Pango.Style.ITALIC)
+        status_renderer.set_property("foreground", "gray")
+        column.pack_start(status_renderer, False)
+        column.set_cell_data_func(status_renderer, self.render_status)
         self.__treeview.append_column(column)
         self.__treeview.set_headers_visible(False)
         self.__treeview.set_activate_on_single_click(True)
@@ -245,12 +373,140 @@ class TarponWindow(Gtk.ApplicationWindow):
         self.__sidebar.pack_start(self.__search, False, False, 0)
         self.__sidebar.pack_end(self.__sidescroll, True, True, 0)
 
+    def render_status(self, column, renderer, model, treeiter, data):
+        """Show the loading status of a row, its item count or its pin."""
+        status = model.get_value(treeiter, DocsetTreeModel.STATUS)
+        count = model.get_value(treeiter, DocsetTreeModel.COUNT)
+        if not status and count:
+            status = "{0}".format(count)
+        elif not status:
+            key = DocsetTreeModel.row_key(model, treeiter)
+            if len(key) == 1 and key[0] in self.__application.library.pinned:
+                status = "pinned"
+        renderer.set_property("text", status)
+
+    def on_docset_loaded(self, application, name):
+        docset = self.__application.docsets[name]
+        for waiting in [w for w in self.__waiting_types if w[0] == name]:
+            self.__waiting_types.discard(waiting)
+            self.__sidebar_store.fill_type(docset, waiting[1])
+            self.__sidebar_store.set_status(
+                self.__sidebar_store.type_row(*waiting), "")
+
+    def on_docset_removed(self, application, name):
+        # The application has already removed the docset's rows.
+        for waiting in [w for w in self.__waiting_types if w[0] == name]:
+            self.__waiting_types.discard(waiting)
+        if any(result.docset == name for result in self.__results or ()):
+            self.set_results([result for result in self.__results
+                              if result.docset != name])
+
+    def on_docset_indexed(self, application, name):
+        query = self.__search.get_text().strip()
+        if query:
+            self.__search_worker.submit(query)
+
+    def on_pins_changed(self, application):
+        self.__treeview.queue_draw()
+        query = self.__search.get_text().strip()
+        if query:
+            self.__search_worker.submit(query)
+
+    def on_sidebar_button_press(self, treeview, event):
+        """
+        Offer to pin or compact a docset when its row is right-clicked, and
+        to download the docsets listed in the feeds.
+        """
+        if event.type != Gdk.EventType.BUTTON_PRESS or event.button != 3:
+            return False
+        # Keep a reference, or the menu is destroyed while it is shown.
+        self.__sidebar_menu = Gtk.Menu()
+        hit = treeview.get_path_at_pos(int(event.x), int(event.y))
+        if hit is not None and len(hit[0]) == 1:
+            name = self.__sidebar_filter.get_value(
+                self.__sidebar_filter.get_iter(hit[0]),
+                DocsetTreeModel.DOCSET)
+            item = Gtk.CheckMenuItem.new_with_label("Search by Default")
+            item.set_active(name in self.__application.library.pinned)
+            item.connect("toggled",
+                         lambda item: self.__application.pin_docset(
+                             name, item.get_active()))
+            self.__sidebar_menu.append(item)
+            item = Gtk.MenuItem.new_with_label("Compact Documentation")
+            item.set_action_name("app.compact_docset")
+            item.set_action_target_value(GLib.Variant("s", name))
+            item.set_sensitive(
+                self.__application.docsets[name].archive is None)
+            self.__sidebar_menu.append(item)
+        downloads = Gtk.Menu()
+        for name, docset in sorted(self.__application.docsets.iteritems()):
+            if docset.url and not docset.on_disk:
+                item = Gtk.MenuItem.new_with_label(name)
+                item.set_action_name("app.download_docset")
+                item.set_action_target_value(GLib.Variant("s", name))
+                item.set_sensitive(
+                    name not in self.__application.downloads)
+                downloads.append(item)
+        item = Gtk.MenuItem.new_with_label("Download Docset")
+        item.set_submenu(downloads)
+        item.set_sensitive(bool(downloads.get_children()))
+        self.__sidebar_menu.append(item)
+        self.__sidebar_menu.attach_to_widget(treeview, None)
+        self.__sidebar_menu.show_all()
+        self.__sidebar_menu.popup(None, None, None, None, event.button,
+                                  event.time)
+        return True
+
+    def on_loading_progress(self, application, done, total):
+        if done < total:
+            self.__header.set_subtitle(
+                "Loading docsets ({0} of {1})".format(done, total))
+        else:
+            self.__header.set_subtitle(None)
+
+    def on_test_expand_row(self, treeview, treeiter, path):
+        treeiter = self.__sidebar_filter.convert_iter_to_child_iter(treeiter)
+        name = self.__sidebar_store.get_value(treeiter,
+                                              DocsetTreeModel.DOCSET)
+        docset = self.__application.docsets[name]
+        if len(path) == 1:
+            self.__sidebar_store.fill_docset(docset)
+        elif len(path) == 2:
+            data_type = self.__sidebar_store.get_value(treeiter,
+                                                       DocsetTreeModel.TYPE)
+            if self.__results and (name, data_type) in self.__visible:
+                # Only the rows of the results are shown while searching,
+                # and those are there already.
+                return False
+            if docset.loaded:
+                self.__sidebar_store.fill_type(docset, data_type)
+            elif not self.__sidebar_store.is_filled(name, data_type):
+                self.__waiting_types.add((name, data_type))
+                self.__sidebar_store.set_status(treeiter, u"loading\u2026")
+                self.__application.request_docset(name, urgent=True)
+        return False
+
     def connect_signals(self):
         self.connect("destroy", self.on_quit)
         self.__back.connect("clicked", self.__web_notebook.go_back)
         self.__forward.connect("clicked", self.__web_notebook.go_forward)
         self.__new_tab.connect("clicked", self.__web_notebook.new_tab)
         self.__treeview.connect("row-activated", self.docitem_selected)
+        self.__treeview.connect("test-expand-row", self.on_test_expand_row)
+        self.__treeview.connect("button-press-event",
+                                self.on_sidebar_button_press)
+        self.__application_handlers = [
+            self.__application.connect("docset-loaded",
+                                       self.on_docset_loaded),
+            self.__application.connect("docset-removed",
+                                       self.on_docset_removed),
+            self.__application.connect("pins-changed",
+                                       self.on_pins_changed),
+            self.__application.connect("docset-indexed",
+                                       self.on_docset_indexed),
+            self.__application.connect("loading-progress",
+                                       self.on_loading_progress),
+        ]
         self.__search.connect("search-changed", self.search_docsets)
 
         new_tab_action = Gio.SimpleAction.new("new_tab")
@@ -290,15 +546,80 @@ class TarponWindow(Gtk.ApplicationWindow):
         self.add_action(normal_text_action)
 
     def search_docsets(self, widget):
-        # TODO: We should move this off of the main thread for performance
         query = widget.get_text().strip()
         if query:
-            self.__results = search(query, self.__application.choices,
-                                    processor=lambda x: x.name)
+            self.__application.request_docsets()
+            self.__search_worker.submit(query)
         else:
-            self.__results = None
-        self.__sidebar_filter.refilter()
+            self.__search_worker.cancel()
+            self.set_results(None)
+
+    def on_search_results(self, query, results):
+        # Called from the search worker thread, so hand the results over to
+        # the main loop instead of touching any widgets here.
+        GLib.idle_add(self.show_results, query, results)
 
+    def show_results(self, query, results):
+        """Show search results unless the query has changed since."""
+        if query == self.__search.get_text().strip():
+            self.set_results(results)
+        return False
+
+    def set_results(self, results):
+        """
+        Filter the sidebar down to the given search results.
+
+        The rows to show are collected into a set once, so that the filter
+        only needs a set lookup per row. Docsets and types without results
+        are hidden, which stops the filter from descending into them. Only
+        the rows of the results themselves are added, from the results, so
+        neither the other items of their types nor the items of their
+        docsets are read.
+        """
+        self.__results = results
+        self.__visible = set()
+        self.__result_paths = {}
+        for result in results or ():
+            docset = self.__application.docsets.get(result.docset)
+            data_type = result.item.data_type
+            if docset is None or self.__sidebar_store.add_item(
+                    docset, data_type, result.position,
+                    result.item.name) is None:
+                continue
+            self.__result_paths[(result.docset, result.position)] = (
+                result.item.path)
+            self.__visible.add((result.docset,))
+            self.__visible.add((result.docset, data_type))
+            self.__visible.add((result.docset, data_type, result.position))
+        with trace.span("refilter", "gtk", results=len(results or ())):
+            self.__sidebar_filter.refilter()
+        if results is None:
+            self.collapse_partial_types()
+        self.expand_results()
+
+    def collapse_partial_types(self):
+        """
+        Collapse the types that only hold the rows of search results, so
+        that expanding them again fills them.
+        """
+        for name, data_type in self.__sidebar_store.partial_types:
+            treeiter = self.__sidebar_store.type_row(name, data_type)
+            path = self.__sidebar_filter.convert_child_path_to_path(
+                self.__sidebar_store.get_path(treeiter))
+            if path is not None:
+                self.__treeview.collapse_row(path)
+
+    def expand_results(self):
+        """Expand the rows leading to every search result in one pass."""
+        for result in self.__results or ():
+            treeiter = self.__sidebar_store.item_row(result.docset,
+                                                     result.position)
+            if treeiter is None:
+                continue
+            path = self.__sidebar_filter.convert_child_path_to_path(
+                self.__sidebar_store.get_path(treeiter))
+            if path is not None:
+                self.__treeview.expand_to_path(path)
 
     def docitem_selected(self, widget, path, column):
         """Change the browser page when an item is selected from the sidebar."""
@@ -307,45 +628,32 @@ class TarponWindow(Gtk.ApplicationWindow):
         # would like to browse to the index for that docset. If we select a data
         # type such as function or class (path length 2), we should do nothing.
         # If we select a document item (path length 3), we should browse to the
-        # path on disk associated with that item.
-        # TODO: Refactor docitem_selected to be more understandable.
-        if len(path) == 2:
-            return None
+        # path on disk associated with that item. Item rows carry the position
+        # of their item in Docset.items, so duplicate names resolve correctly.
         treeiter = self.__sidebar_filter.get_iter(path)
-        value = self.__sidebar_filter.get_value(treeiter, 0)
+        if DocsetTreeModel.is_placeholder(self.__sidebar_filter, treeiter):
+            return None
+        name = self.__sidebar_filter.get_value(treeiter,
+                                               DocsetTreeModel.DOCSET)
+        docset = self.__application.docsets[name]
         if len(path) == 1:
-            docset = self.__application.docsets[value]
-            self.__web_notebook.browser.load_uri("file://" + docset.index_path)
+            page = docset.index_page
         elif len(path) == 3:
-            type_iter = self.__sidebar_filter.iter_parent(treeiter)
-            data_type = self.__sidebar_filter.get_value(type_iter, 0)
-            parent_iter = self.__sidebar_filter.iter_parent(type_iter)
-            parent = self.__sidebar_filter.get_value(parent_iter, 0)
-            docset = self.__application.docsets[parent]
-            print(parent, data_type, value)
-            for item in docset.items:
-                if item.name == value and item.data_type == data_type:
-                    page = os.path.join(docset.doc_path, item.path)
-                    self.__web_notebook.browser.load_uri("file://" + page)
-                    return None
+            position = self.__sidebar_filter.get_value(
+                treeiter, DocsetTreeModel.POSITION)
+            page = self.__result_paths.get((name, position))
+            if page is None:
+                page = docset.items[position].path
+        else:
+            return None
+        self.__web_notebook.browser.load_uri(
+            self.__application.page_uri(docset, page))
 
     def filter_func(self, model, treeiter, data):
         if self.__results:
-            if model.iter_has_child(treeiter):
-                return True
-            row = model[treeiter][0]
-            for result, score in self.__results:
-                # TODO: This comparison can result in a UnicodeWarning that
-                # automatically resolves to False no matter what because we are
-                # not making sure both result.name and row can both be decoded
-                # to Unicode. We need to make utf-8 a strong guarantee.
-                if result.name == row:
-                    self.__treeview.expand_to_path(model.get_path(treeiter))
-                    return True
-            return False
+            return DocsetTreeModel.row_key(model, treeiter) in self.__visible
         return True
 
-
     def on_new_window(self, action, parameter):
         self.__application.on_new_window(action, parameter)
 
@@ -356,6 +664,10 @@ class TarponWindow(Gtk.ApplicationWindow):
         self.__application.on_about(action, parameter, transient_for=self)
 
     def on_quit(self, widget, data=None):
+        for handler in self.__application_handlers:
+            self.__application.disconnect(handler)
+        self.__application_handlers = []
+        self.__search_worker.stop()
         self.destroy()
 
     def toggle_panel(self, widget, data=None):
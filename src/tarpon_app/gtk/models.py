@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from gi.repository import Gtk
+
+
+class DocsetTreeModel(Gtk.TreeStore):
+    """
+    Sidebar tree of docsets, item types and items, filled in on demand.
+
+    Only docset rows are created up front. The type rows of a docset, with
+    their item counts, are added when the docset is filled, and the item rows
+    of a type when the type is filled, which normally happens when the user
+    expands the row. Until then every row holds a single placeholder child so
+    that it can be expanded at all. Search results are added as single item
+    rows, without filling their type, and are replaced when it is filled.
+    """
+
+    LABEL, STATUS, COUNT, DOCSET, TYPE, POSITION = range(6)
+
+    def __init__(self):
+        Gtk.TreeStore.__init__(self, str, str, int, str, str, int)
+        self.__docset_rows = {}
+        self.__type_rows = {}
+        self.__item_rows = {}
+        self.__filled = set()
+        self.__partial = set()
+
+    @classmethod
+    def row_key(cls, model, treeiter):
+        """
+        Gets a hashable key identifying a row.
+
+        :type model: Gtk.TreeModel
+        :param model: this model or a model filtering it
+        :type treeiter: Gtk.TreeIter
+        :rtype: tuple
+        :returns: ``(docset,)`` for docset rows, ``(docset, type)`` for type
+                  rows and ``(docset, type, position)`` for item rows
+        """
+        name = model.get_value(treeiter, cls.DOCSET)
+        data_type = model.get_value(treeiter, cls.TYPE)
+        position = model.get_value(treeiter, cls.POSITION)
+        if position >= 0:
+            return (name, data_type, position)
+        elif data_type:
+            return (name, data_type)
+        return (name,)
+
+    @classmethod
+    def is_placeholder(cls, model, treeiter):
+        """
+        Checks whether a row is the placeholder child of an unfilled row.
+
+        :type model: Gtk.TreeModel
+        :param model: this model or a model filtering it
+        :type treeiter: Gtk.TreeIter
+        :rtype: bool
+        """
+        return not model.get_value(treeiter, cls.DOCSET)
+
+    @property
+    def docset_rows(self):
+        """Maps the name of every docset to its row."""
+        return self.__docset_rows
+
+    def type_row(self, name, data_type):
+        """
+        Gets the row of an item type.
+
+        :type name: str
+        :param name: name of the docset
+        :type data_type: str
+        :param data_type: item type
+        :rtype: Gtk.TreeIter or None
+        :returns: the row, or None if the docset has not been filled
+        """
+        return self.__type_rows.get((name, data_type))
+
+    def item_row(self, name, position):
+        """
+        Gets the row of an item.
+
+        :type name: str
+        :param name: name of the docset
+        :type position: int
+        :param position: position of the item in the docset's items
+        :rtype: Gtk.TreeIter or None
+        :returns: the row, or None if the item's type has not been filled
+        """
+        return self.__item_rows.get((name, position))
+
+    def is_filled(self, name, data_type=None):
+        """
+        Checks whether the children of a docset or type row have been added.
+
+        :type name: str
+        :param name: name of the docset
+        :type data_type: str
+        :param data_type: item type, or None for the docset row itself
+        :rtype: bool
+        """
+        return (name, data_type) in self.__filled
+
+    def add_docset(self, name):
+        """
+        Adds an unfilled docset row.
+
+        :type name: str
+        :param name: name of the docset
+        :rtype: Gtk.TreeIter
+        """
+        treeiter = self.append(None, [name, "", 0, name, "", -1])
+        self.append(treeiter, ["", "", 0, "", "", -1])
+        self.__docset_rows[name] = treeiter
+        return treeiter
+
+    def remove_docset(self, name):
+        """
+        Removes a docset row with every row below it.
+
+        :type name: str
+        :param name: name of the docset
+        """
+        treeiter = self.__docset_rows.pop(name, None)
+        if treeiter is None:
+            return
+        self.remove(treeiter)
+        for rows in (self.__type_rows, self.__item_rows):
+            for key in [key for key in rows if key[0] == name]:
+                del rows[key]
+        self.__filled = set(key for key in self.__filled if key[0] != name)
+        self.__partial = set(key for key in self.__partial
+                             if key[0] != name)
+
+    @property
+    def partial_types(self):
+        """``(docset, type)`` keys of the types holding only some items."""
+        return frozenset(self.__partial)
+
+    def add_item(self, docset, data_type, position, label):
+        """
+        Adds the row of one item, e.g. a search result, without reading the
+        other items of its type. The docset's items need not be loaded.
+
+        :type docset: tarpon_app.docsets.Docset
+        :type data_type: str
+        :param data_type: item type
+        :type position: int
+        :param position: position of the item in the docset's items
+        :type label: unicode
+        :param label: name of the item
+        :rtype: Gtk.TreeIter or None
+        :returns: the row, or None if the docset has no such type
+        """
+        treeiter = self.__item_rows.get((docset.name, position))
+        if treeiter is not None:
+            return treeiter
+        self.fill_docset(docset)
+        parent = self.__type_rows.get((docset.name, data_type))
+        if parent is None:
+            return None
+        treeiter = self.append(parent, [label, "", 0, docset.name, data_type,
+                                        position])
+        self.__item_rows[(docset.name, position)] = treeiter
+        self.__partial.add((docset.name, data_type))
+        return treeiter
+
+    def fill_docset(self, docset):
+        """
+        Adds a row, with its item count, for every item type of a docset.
+
+        :type docset: tarpon_app.docsets.Docset
+        """
+        if self.is_filled(docset.name):
+            return
+        parent = self.__docset_rows[docset.name]
+        placeholder = self.iter_children(parent)
+        for data_type, count in sorted(docset.type_counts.iteritems()):
+            treeiter = self.append(parent, [data_type, "", count, docset.name,
+                                            data_type, -1])
+            self.append(treeiter, ["", "", 0, "", "", -1])
+            self.__type_rows[(docset.name, data_type)] = treeiter
+        # Remove the placeholder last so that an expanded row stays expanded.
+        self.remove(placeholder)
+        self.__filled.add((docset.name, None))
+
+    def fill_type(self, docset, data_type):
+        """
+        Adds a row for every item of one type. The items of the docset must
+        already be loaded.
+
+        :type docset: tarpon_app.docsets.Docset
+        :type data_type: str
+        :param data_type: item type
+        """
+        if self.is_filled(docset.name, data_type):
+            return
+        self.fill_docset(docset)
+        parent = self.__type_rows[(docset.name, data_type)]
+        # The placeholder and any rows added by add_item
+        old = []
+        child = self.iter_children(parent)
+        while child is not None:
+            old.append(child)
+            child = self.iter_next(child)
+        items = docset.items
+        for position in docset.type_positions.get(data_type, ()):
+            self.__item_rows[(docset.name, position)] = self.append(
+                parent, [items[position].name, "", 0, docset.name, data_type,
+                         position])
+        for child in old:
+            self.remove(child)
+        self.__filled.add((docset.name, data_type))
+        self.__partial.discard((docset.name, data_type))
+
+    def set_status(self, treeiter, status):
+        """
+        Sets the status text shown next to a docset or type row.
+
+        :type treeiter: Gtk.TreeIter
+        :type status: unicode
+        """
+        self.set_value(treeiter, self.STATUS, status)
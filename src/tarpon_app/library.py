@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""The docsets Tarpon knows about, without any GTK.
+
+:class:`DocsetLibrary` holds the installed and downloadable docsets, the
+manifest they are cached in and the search index over them. The GTK
+application and the command-line query mode are both built on it, and
+neither this module nor anything it imports loads ``gi``.
+"""
+
+import glob
+import json
+import os
+
+import appdirs
+
+from tarpon_app.content import ContentIndex
+from tarpon_app.docsets import Docset
+from tarpon_app.fts import FTSIndex
+from tarpon_app.manifest import DocsetManifest
+from tarpon_app.search import SearchIndex
+from tarpon_app.snapshot import DocsetSnapshot
+from tarpon_app import trace
+import tarpon_app.info as info
+
+SEARCH_BACKENDS = {"memory": SearchIndex, "fts": FTSIndex}
+# File in the data directory listing the docsets searched by default
+PINNED_NAME = "pinned.json"
+
+
+def ensure(path):
+    """
+    Ensures that a path exists by creating it if necessary.
+
+    Note: ``os.makedirs()`` in Python 3 has the option ``exist_ok`` which will
+    not throw an error if the directory already exist (making this function
+    unnecessary). However, Python 2 has no such option.
+
+    :type path: str
+    :param path: path to be created if necessary
+    :rtype: str
+    :returns: input path (allowing functions like os.path.join to be wrapped)
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return path
+
+
+def default_data_dir():
+    """Gets the directory docsets are installed in, creating it if needed."""
+    return ensure(appdirs.user_data_dir(appname=info.SHORT_NAME))
+
+
+def default_cache_dir():
+    """Gets Tarpon's cache directory, creating it if needed."""
+    return ensure(appdirs.user_cache_dir(appname=info.SHORT_NAME))
+
+
+class DocsetLibrary(object):
+    """
+    Docsets installed in ``data_dir`` or listed in the feed caches of
+    ``cache_dir``, by name, with their manifest, snapshot, search index and
+    index of page content.
+
+    :type data_dir: str
+    :type cache_dir: str
+    :type search_backend: str
+    :param search_backend: key of :data:`SEARCH_BACKENDS`
+    """
+
+    def __init__(self, data_dir, cache_dir, search_backend="memory"):
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir
+        self.docsets = {}
+        self.manifest = DocsetManifest(cache_dir)
+        self.snapshot = DocsetSnapshot(cache_dir)
+        # Stamps of the installed docsets, by path, as they were when read
+        self.__stamps = {}
+        backend = SEARCH_BACKENDS.get(search_backend, SearchIndex)
+        self.search_index = backend(cache_dir)
+        self.content_index = ContentIndex(cache_dir)
+        self.pinned_path = os.path.join(data_dir, PINNED_NAME)
+        self.pinned = set()
+        if os.path.exists(self.pinned_path):
+            with open(self.pinned_path) as pinned_file:
+                self.pinned.update(json.load(pinned_file))
+
+    @property
+    def default_scope(self):
+        """
+        Names of the docsets searched when a query does not name any, or
+        None to search every docset.
+
+        :rtype: frozenset or None
+        """
+        return frozenset(self.pinned) or None
+
+    def pin_docset(self, name, pinned=True):
+        """
+        Adds a docset to the docsets searched by default, or removes it.
+        While no docset is pinned every docset is searched.
+
+        :type name: str
+        :param name: name of the docset
+        :type pinned: bool
+        """
+        if pinned:
+            self.pinned.add(name)
+        else:
+            self.pinned.discard(name)
+        tmp_path = self.pinned_path + ".tmp"
+        with open(tmp_path, "w") as pinned_file:
+            json.dump(sorted(self.pinned), pinned_file)
+        os.rename(tmp_path, self.pinned_path)
+
+    @property
+    def docsets_on_disk(self):
+        return filter(lambda x: x[1].on_disk, self.docsets.iteritems())
+
+    def search_paths(self):
+        """
+        Gets the installed docsets and the feed caches.
+
+        :rtype: list
+        """
+        paths = glob.glob(self.data_dir + "/*.docset")
+        paths.extend(path for path in glob.glob(self.cache_dir + "/*.json")
+                     if path != self.manifest.path)
+        return paths
+
+    @staticmethod
+    def is_complete(path):
+        """
+        Checks whether a ``.docset`` directory has the files needed to read
+        it, i.e. it is not still being copied or unpacked.
+
+        :type path: str
+        :rtype: bool
+        """
+        return None not in DocsetManifest.stamp(path)
+
+    def docset_at(self, path):
+        """
+        Gets the installed docset read from a directory.
+
+        :type path: str
+        :rtype: tarpon_app.docsets.Docset or None
+        """
+        for docset in self.docsets.itervalues():
+            if docset.path == path:
+                return docset
+        return None
+
+    @trace.traced("load_docsets", "library")
+    def load_docsets(self, paths=None):
+        """
+        Reads the metadata of docsets, from the manifest where possible.
+        Docsets in the snapshot are restored with their items.
+
+        :type paths: list
+        :param paths: ``.docset`` directories and feed caches, by default
+                      those found by :meth:`search_paths`
+        """
+        if paths is None:
+            paths = self.search_paths()
+        for path in paths:
+            if path.endswith(".docset"):  # load from disk
+                docset = self.snapshot.restore(path, self.manifest)
+                if docset is None:
+                    docset = Docset.frompath(path, manifest=self.manifest)
+                self.docsets[docset.name] = docset
+                self.__stamps[path] = DocsetManifest.stamp(path)
+            elif path.endswith(".json"):  # load from cache files
+                with open(path) as cache_file:
+                    for name, url in json.load(cache_file).iteritems():
+                        if name in self.docsets:
+                            self.docsets[name].url = url
+                        else:
+                            self.docsets[name] = Docset(name, url=url)
+        self.manifest.save()
+
+    def add_docset(self, path):
+        """
+        Registers a docset, replacing any docset of the same name and
+        removing that one from the search index.
+
+        :type path: str
+        :param path: path of the ``.docset`` directory
+        :rtype: tuple
+        :returns: the new docset and the docset it replaced, or None
+        """
+        docset = Docset.frompath(path, manifest=self.manifest)
+        old = self.docsets.get(docset.name)
+        if old is not None:
+            docset.url = old.url
+            self.search_index.remove(old.name)
+            self.__stamps.pop(old.path, None)
+        self.docsets[docset.name] = docset
+        self.__stamps[path] = DocsetManifest.stamp(path)
+        self.manifest.save()
+        return docset, old
+
+    def remove_docset(self, name):
+        """
+        Unregisters an installed docset and removes it from the search
+        index. A docset listed in a feed stays known as downloadable.
+
+        :type name: str
+        :param name: name of the docset
+        :rtype: tarpon_app.docsets.Docset
+        :returns: the removed docset
+        """
+        docset = self.docsets.pop(name)
+        self.search_index.remove(name)
+        if self.docset_at(docset.path) is None:
+            # Unless the directory is now read as another docset
+            self.__stamps.pop(docset.path, None)
+        if docset.url:
+            self.docsets[name] = Docset(name, url=docset.url)
+        return docset
+
+    def sync_docset(self, path):
+        """
+        Brings the library in line with a ``.docset`` directory that
+        appeared, changed or went away. Nothing is read again for a docset
+        whose files have not changed.
+
+        :type path: str
+        :param path: path of the ``.docset`` directory
+        :rtype: tuple
+        :returns: the docset now read from path, or None, and the list of
+                  docsets it replaced or that were removed
+        """
+        current = self.docset_at(path)
+        if not os.path.isdir(path):
+            if current is None:
+                return None, []
+            return None, [self.remove_docset(current.name)]
+        if not self.is_complete(path) or (
+                current is not None and
+                self.__stamps.get(path) == DocsetManifest.stamp(path)):
+            return None, []
+        docset, old = self.add_docset(path)
+        removed = [old] if old is not None else []
+        if current is not None and current.name != docset.name:
+            # The docset was renamed in its Info.plist
+            removed.append(self.remove_docset(current.name))
+        return docset, removed
+
+    def index_docsets(self):
+        """Adds every docset on disk to the search index, on this thread."""
+        for name, docset in sorted(self.docsets_on_disk):
+            self.search_index.add(docset)
+
+    def loaded_docsets(self):
+        """
+        Gets the docsets on disk whose items are loaded, e.g. to save them
+        to the snapshot.
+
+        :rtype: list
+        """
+        return [docset for name, docset in sorted(self.docsets_on_disk)
+                if docset.loaded]
+
+    def save_snapshot(self, docsets=None):
+        """
+        Writes the loaded docsets to the snapshot, if they changed since it
+        was written.
+
+        :type docsets: list
+        :param docsets: docsets to save, by default :meth:`loaded_docsets`
+        :rtype: bool
+        :returns: True if the snapshot was written
+        """
+        if docsets is None:
+            docsets = self.loaded_docsets()
+        return self.snapshot.save(docsets)
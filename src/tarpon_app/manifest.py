@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""On-disk cache of docset metadata and items.
+
+The manifest lets a docset whose files have not changed since the last
+launch be restored without parsing its ``Info.plist`` or querying its
+``docSet.dsidx``.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+from tarpon_app.docsets import DocItemTable
+from tarpon_app import trace
+
+
+def file_stamp(path):
+    """
+    Gets the modification time and size of a file.
+
+    :type path: str
+    :rtype: list or None
+    :returns: ``[mtime, size]``, or None if the file does not exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_mtime, stat.st_size]
+
+
+class DocsetManifest(object):
+    """
+    Cache of docset metadata and items kept in the cache directory.
+
+    Entries are keyed by docset path. Each entry holds the fields read from
+    ``Info.plist``, the modification time and size of ``Info.plist`` and
+    ``docSet.dsidx``, the item count of each type and, once the docset has
+    been loaded, the name of a file holding its serialized
+    :class:`~tarpon_app.docsets.DocItemTable`. An entry is dropped as soon
+    as either file differs from what was recorded.
+    """
+
+    VERSION = 1
+
+    def __init__(self, cache_dir):
+        self.path = os.path.join(cache_dir, "manifest.json")
+        self.items_dir = os.path.join(cache_dir, "items")
+        if not os.path.exists(self.items_dir):
+            os.makedirs(self.items_dir)
+        self.__lock = threading.RLock()
+        self.__entries = self.__read()
+
+    def __read(self):
+        try:
+            with open(self.path) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (IOError, ValueError):
+            return {}
+        if manifest.get("version") != self.VERSION:
+            return {}
+        return manifest.get("docsets", {})
+
+    def save(self):
+        """Writes the manifest to the cache directory."""
+        with self.__lock:
+            tmp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+            with open(tmp_path, "w") as manifest_file:
+                json.dump({"version": self.VERSION,
+                           "docsets": self.__entries}, manifest_file)
+            os.rename(tmp_path, self.path)
+
+    @staticmethod
+    def stamp(path):
+        """
+        Gets the stamps of the files an entry depends on.
+
+        :type path: str
+        :param path: path of the docset
+        :rtype: list
+        """
+        return [file_stamp(os.path.join(path, "Contents", "Info.plist")),
+                file_stamp(os.path.join(path, "Contents", "Resources",
+                                        "docSet.dsidx"))]
+
+    def items_path(self, path):
+        """
+        Gets the file the items of a docset are cached in.
+
+        :type path: str
+        :param path: path of the docset
+        :rtype: str
+        """
+        digest = hashlib.sha1(os.path.abspath(path)).hexdigest()
+        return os.path.join(self.items_dir, digest + ".items")
+
+    def lookup(self, path):
+        """
+        Gets the entry of a docset, if its files have not changed.
+
+        :type path: str
+        :param path: path of the docset
+        :rtype: dict or None
+        """
+        with self.__lock:
+            entry = self.__entries.get(path)
+            if entry is None:
+                return None
+            if entry["stamp"] != self.stamp(path):
+                self.forget(path)
+                return None
+            return entry
+
+    def forget(self, path):
+        """
+        Drops the entry of a docset and its cached items.
+
+        :type path: str
+        :param path: path of the docset
+        """
+        with self.__lock:
+            self.__entries.pop(path, None)
+            try:
+                os.remove(self.items_path(path))
+            except OSError:
+                pass
+
+    def update(self, docset):
+        """
+        Records what is currently known about a docset: its metadata, and
+        its type counts and items if they have been loaded.
+
+        :type docset: tarpon_app.docsets.Docset
+        """
+        with self.__lock:
+            entry = self.lookup(docset.path)
+            if entry is None:
+                entry = self.__entries[docset.path] = {
+                    "stamp": self.stamp(docset.path),
+                    "name": docset.name,
+                    "identifier": docset.identifier,
+                    "index_path": docset.index_path,
+                    "type_counts": None,
+                    "items": False,
+                }
+            if docset.loaded and not entry["items"]:
+                items_path = self.items_path(docset.path)
+                with open(items_path + ".tmp", "wb") as items_file:
+                    items_file.write(docset.items.dumps())
+                os.rename(items_path + ".tmp", items_path)
+                entry["items"] = True
+            if entry["type_counts"] is None and docset.has_type_counts:
+                entry["type_counts"] = docset.type_counts
+
+    def load_items(self, path):
+        """
+        Loads the cached items of a docset.
+
+        :type path: str
+        :param path: path of the docset
+        :rtype: tarpon_app.docsets.DocItemTable or None
+        :returns: the items, or None if they are not cached or out of date
+        """
+        entry = self.lookup(path)
+        if entry is None or not entry["items"]:
+            return None
+        try:
+            with trace.span("manifest.load_items", "manifest", path=path):
+                with open(self.items_path(path), "rb") as items_file:
+                    return DocItemTable.loads(items_file.read())
+        except (IOError, ValueError):
+            with self.__lock:
+                entry["items"] = False
+            return None
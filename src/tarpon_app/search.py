@@ -0,0 +1,901 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Prebuilt search index over docset item names.
+
+Every docset gets a trigram index, a sorted prefix table and a packed
+string of its lowercased item names. The tables are built once, pickled
+into the cache directory and reused until the docset's index database
+changes.
+
+Results are ranked in tiers: exact matches, case-insensitive exact
+matches, prefix matches, matches at a word boundary and other substring
+matches. The tiers are found by scanning the packed names with
+``unicode.find``, so no Python code runs per item that does not match.
+Only when the tiers hold fewer results than asked for are the trigram
+candidates scored with fuzzywuzzy.
+"""
+
+from array import array
+from bisect import bisect_right
+from collections import deque, namedtuple, OrderedDict
+import cPickle as pickle
+import heapq
+import os
+import sqlite3
+import threading
+from unicodedata import normalize
+
+from fuzzywuzzy import fuzz, utils
+
+from tarpon_app import trace
+
+
+SearchResult = namedtuple("SearchResult",
+                          ["item", "score", "docset", "position"])
+# Names of the docsets and the item types a query is limited to, each None
+# for no limit
+SearchScope = namedtuple("SearchScope", ["docsets", "types"])
+
+# Ranking tiers and the score reported for each
+EXACT, EXACT_NOCASE, PREFIX, WORD, SUBSTRING, FUZZY = range(6)
+TIER_SCORES = (100, 98, 95, 90, 85)
+# Fuzzy matches always score below every tier
+MAX_FUZZY_SCORE = 80
+
+
+def normalize_name(name):
+    """
+    Normalizes a name the same way fuzzywuzzy does before scoring it.
+
+    :type name: unicode
+    :param name: item name or query
+    :rtype: unicode
+    :returns: lowercased name with punctuation replaced by whitespace
+    """
+    return utils.full_process(name)
+
+
+def fuzzy_ratio(query, name):
+    """
+    Scores how closely a name matches a query, from 0 to 100.
+
+    This is fuzzywuzzy's ``WRatio``, except for names shorter than the
+    query: those lack some of what was typed, so they are not credited for
+    fitting inside the query as a partial match would.
+
+    :type query: unicode
+    :type name: unicode
+    :rtype: int
+    """
+    if len(name) < len(query):
+        return fuzz.ratio(query, name)
+    return fuzz.WRatio(query, name)
+
+
+def trigrams(text):
+    """
+    Gets the set of trigrams in a normalized string.
+
+    :type text: unicode
+    :param text: normalized name or query
+    :rtype: set
+    :returns: every three character substring of text
+    """
+    return set(text[i:i + 3] for i in xrange(len(text) - 2))
+
+
+def docset_matches(docset, keyword):
+    """
+    Checks whether a scope keyword names a docset, i.e. is the start of its
+    name or identifier, ignoring case and spaces.
+
+    :type docset: tarpon_app.docsets.Docset
+    :type keyword: unicode
+    :rtype: bool
+    """
+    keyword = keyword.lower().replace(u" ", u"")
+    return any(name.lower().replace(u" ", u"").startswith(keyword)
+               for name in (docset.name, docset.identifier or u"") if name)
+
+
+def parse_scope(query, docsets, default=None):
+    """
+    Splits the scopes off the start of a query.
+
+    A query can start with a docset keyword (see :func:`docset_matches`),
+    an item type or both, each followed by a colon, e.g. ``py:dict``,
+    ``class:dict`` or ``py:class:dict``. A keyword naming several docsets
+    scopes the query to all of them. Anything else before a colon is part
+    of the query, so ``std::vector`` is searched as it is.
+
+    :type query: unicode
+    :type docsets: list
+    :param docsets: the docsets searched
+    :type default: frozenset
+    :param default: names of the docsets searched when the query does not
+                    name any, or None for every docset
+    :rtype: tuple
+    :returns: the :class:`SearchScope` of the query and the rest of it
+    """
+    names = types = None
+    text = query
+    while True:
+        keyword, colon, rest = text.partition(u":")
+        keyword = keyword.strip().lower()
+        if not colon or not keyword:
+            break
+        if names is None:
+            matched = frozenset(docset.name for docset in docsets
+                                if docset_matches(docset, keyword))
+            if matched:
+                names, text = matched, rest
+                continue
+        if types is None:
+            matched = frozenset(data_type for docset in docsets
+                                if names is None or docset.name in names
+                                for data_type in docset.type_counts
+                                if data_type.lower() == keyword)
+            if matched:
+                types, text = matched, rest
+                continue
+        break
+    if names is None and default:
+        names = frozenset(docset.name for docset in docsets
+                          if docset.name in default) or None
+    return SearchScope(names, types), text
+
+
+class DocsetIndex(object):
+    """
+    Trigram, prefix and substring tables for the items of a single docset.
+
+    ``lowered`` holds every lowercased item name, each one preceded and the
+    last one followed by a newline. The names are grouped by item type, so
+    that the names of one type form a contiguous partition of it. The name
+    in slot ``i`` of ``lowered`` starts at offset ``starts[i]`` and belongs
+    to the item at position ``order[i]``, and ``slots`` maps positions back
+    to slots. ``types`` maps every item type to its range of slots.
+
+    ``positions`` lists the items sorted by normalized name, for prefix
+    lookups. The normalized names themselves are not kept: the few that a
+    lookup compares are normalized again from ``lowered``.
+    """
+
+    VERSION = 4
+    # Least number of distinct names sharing trigrams with a misspelt query
+    # whose items are handed to the fuzzy scorer
+    WINDOW = 128
+
+    def __init__(self, signature, positions, grams, lowered, starts, order,
+                 types):
+        self.signature = signature
+        self.grams = grams
+        self.positions = positions
+        self.lowered = lowered
+        self.starts = starts
+        self.order = order
+        self.types = types
+        self.slots = array("I", order)
+        for slot, position in enumerate(order):
+            self.slots[position] = slot
+
+    @classmethod
+    def build(cls, docset):
+        """
+        Builds the tables for a docset from its items.
+
+        :type docset: tarpon_app.docsets.Docset
+        :rtype: DocsetIndex
+        """
+        items = docset.items
+        lower_names = [item.name.lower().replace(u"\n", u" ")
+                       for item in items]
+        names = []
+        grams = {}
+        for position, lower_name in enumerate(lower_names):
+            name = normalize_name(lower_name)
+            names.append((name, position))
+            for gram in trigrams(name):
+                if gram not in grams:
+                    grams[gram] = array("I")
+                grams[gram].append(position)
+        names.sort()
+        positions = array("I", (position for _, position in names))
+        del names
+
+        lowered = []
+        starts = array("I")
+        order = array("I")
+        types = {}
+        offset = 1
+        for data_type, type_positions in sorted(
+                docset.type_positions.iteritems()):
+            types[data_type] = (len(order), len(order) + len(type_positions))
+            for position in type_positions:
+                lowered.append(lower_names[position])
+                starts.append(offset)
+                order.append(position)
+                offset += len(lowered[-1]) + 1
+        starts.append(offset)
+        return cls(docset.signature, positions, grams,
+                   u"\n" + u"\n".join(lowered) + u"\n", starts, order, types)
+
+    @classmethod
+    def load(cls, path, signature):
+        """
+        Loads tables pickled by :meth:`save`.
+
+        :type path: str
+        :param path: file the index was saved to
+        :param signature: current signature of the docset
+        :rtype: DocsetIndex or None
+        :returns: the index, or None if it is missing or out of date
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as index_file:
+                saved = pickle.load(index_file)
+        except (EOFError, ValueError, TypeError, pickle.UnpicklingError):
+            return None
+        if saved[0] != cls.VERSION or saved[1] != signature:
+            return None
+        _, _, positions, grams, lowered, starts, order, types = saved
+        return cls(signature, positions, grams, lowered, starts, order, types)
+
+    def save(self, path):
+        """
+        Pickles the tables to path.
+
+        :type path: str
+        :param path: destination file
+        """
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as index_file:
+            pickle.dump((self.VERSION, self.signature, self.positions,
+                         self.grams, self.lowered,
+                         self.starts, self.order, self.types), index_file,
+                        pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, path)
+
+    def normalized(self, position):
+        """
+        Gets the normalized name of an item.
+
+        :type position: int
+        :rtype: unicode
+        """
+        slot = self.slots[position]
+        return normalize_name(
+            self.lowered[self.starts[slot]:self.starts[slot + 1] - 1])
+
+    def __bisect(self, query):
+        """Finds the first item whose normalized name is not below query."""
+        low, high = 0, len(self.positions)
+        while low < high:
+            middle = (low + high) // 2
+            if self.normalized(self.positions[middle]) < query:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def prefixed(self, query):
+        """
+        Gets the positions of items whose normalized name starts with query.
+
+        :type query: unicode
+        :param query: normalized query
+        :rtype: list
+        """
+        start = self.__bisect(query)
+        end = self.__bisect(query + u"\uffff")
+        return list(self.positions[start:end])
+
+    def rank_key(self, position):
+        """Orders the items of one tier: shorter names, then item order."""
+        slot = self.slots[position]
+        return (self.starts[slot + 1] - self.starts[slot], position)
+
+    def partitions(self, types=None):
+        """
+        Gets the parts of ``lowered`` holding the names of some item types.
+
+        :type types: frozenset
+        :param types: item types, or None for every item
+        :rtype: list
+        :returns: ``(start, end)`` offsets of every part, for
+                  ``unicode.find``
+        """
+        if types is None:
+            return [(0, len(self.lowered))]
+        starts = self.starts
+        return [(starts[first] - 1, starts[end])
+                for first, end in sorted(self.types[data_type]
+                                         for data_type in types
+                                         if data_type in self.types)]
+
+    def has_type(self, position, types):
+        """
+        Checks whether an item is of one of some types.
+
+        :type position: int
+        :type types: frozenset
+        :param types: item types, or None for every item
+        :rtype: bool
+        """
+        if types is None:
+            return True
+        slot = self.slots[position]
+        return any(first <= slot < end
+                   for first, end in (self.types.get(data_type, (0, 0))
+                                      for data_type in types))
+
+    def prefix_hits(self, query, types=None):
+        """
+        Finds the items whose lowercased name starts with query.
+
+        :type query: unicode
+        :param query: lowercased query
+        :type types: frozenset
+        :param types: item types to look at, or None for every item
+        :rtype: tuple
+        :returns: positions of the items whose name is query, and of the
+                  items whose name merely starts with it
+        """
+        lowered, starts, order = self.lowered, self.starts, self.order
+        needle = u"\n" + query
+        exact, prefixed = [], []
+        for start, end in self.partitions(types):
+            offset = lowered.find(needle, start, end)
+            while offset >= 0:
+                position = order[bisect_right(starts, offset + 1) - 1]
+                if lowered[offset + 1 + len(query)] == u"\n":
+                    exact.append(position)
+                else:
+                    prefixed.append(position)
+                offset = lowered.find(needle, offset + 1, end)
+        return exact, prefixed
+
+    def inner_hits(self, query, types=None):
+        """
+        Finds the items whose lowercased name contains query other than at
+        its start.
+
+        :type query: unicode
+        :param query: lowercased query
+        :type types: frozenset
+        :param types: item types to look at, or None for every item
+        :rtype: tuple
+        :returns: positions of the items where query starts a word, i.e.
+                  follows a character that is not alphanumeric, and of the
+                  items that only contain it
+        """
+        lowered, starts, order = self.lowered, self.starts, self.order
+        words, substrings = [], []
+        for start, end in self.partitions(types):
+            offset = lowered.find(query, start, end)
+            while offset >= 0:
+                slot = bisect_right(starts, offset) - 1
+                before = lowered[offset - 1]
+                if before == u"\n":
+                    # A prefix hit, found by prefix_hits
+                    offset = lowered.find(query, starts[slot + 1], end)
+                elif not before.isalnum():
+                    words.append(order[slot])
+                    offset = lowered.find(query, starts[slot + 1], end)
+                else:
+                    # A later occurrence may still start a word
+                    following = lowered.find(query, offset + 1, end)
+                    if following < 0 or following >= starts[slot + 1]:
+                        substrings.append(order[slot])
+                    offset = following
+        return words, substrings
+
+    def containing(self, query, within=None, known=()):
+        """
+        Gets the positions of items whose normalized name has every trigram
+        of query. Every item whose name starts with query is among them.
+
+        :type query: unicode
+        :param query: normalized query of at least three characters
+        :type within: set
+        :param within: result of this method for a prefix of query, to narrow
+                       down instead of starting over
+        :type known: set
+        :param known: trigrams of that prefix, which within already has
+        :rtype: set
+        """
+        grams = [self.grams.get(gram, ())
+                 for gram in trigrams(query).difference(known)]
+        grams.sort(key=len)
+        if within is None:
+            if not grams:
+                return set()
+            found = set(grams.pop(0))
+        else:
+            found = set(within)
+        for positions in grams:
+            if not found:
+                break
+            found.intersection_update(positions)
+        return found
+
+    def candidates(self, query, limit, found=None):
+        """
+        Gets the positions of items worth scoring against query.
+
+        Items containing every trigram of the query come first. If there are
+        fewer than ``limit`` of those, the items sharing the most trigrams
+        with the query and the items sharing its first two characters are
+        added so that misspelt queries still find something. Of the items
+        sharing as many trigrams, the ones with the shortest names are
+        taken, counting items with the same name once.
+
+        :type query: unicode
+        :param query: normalized query
+        :type limit: int
+        :param limit: number of results the caller wants
+        :type found: set
+        :param found: result of :meth:`containing` for query, if known
+        :rtype: set
+        """
+        if len(query) < 3:
+            return set(self.prefixed(query))
+        found = set(self.containing(query) if found is None else found)
+        if len(found) < limit:
+            grams = [self.grams.get(gram, ()) for gram in trigrams(query)]
+            grams.sort(key=len)
+            overlap = {}
+            for positions in grams:
+                for position in positions:
+                    overlap[position] = overlap.get(position, 0) + 1
+            window = max(limit * 4, self.WINDOW)
+            if len(overlap) > window:
+                found.update(self.__best(overlap, window))
+            else:
+                found.update(overlap)
+            found.update(self.prefixed(query[:2])[:window])
+        return found
+
+    def __best(self, overlap, window):
+        """
+        Gets the items sharing the most trigrams with a query, shortest names
+        first, until ``window`` distinct names are taken.
+
+        :type overlap: dict
+        :param overlap: number of shared trigrams, by position
+        :type window: int
+        :rtype: list
+        """
+        lowered, starts, slots = self.lowered, self.starts, self.slots
+        least = heapq.nlargest(window, overlap.itervalues())[-1]
+        ranked = sorted(
+            (-count, starts[slots[position] + 1] - starts[slots[position]],
+             position)
+            for position, count in overlap.iteritems() if count >= least)
+        best = []
+        names = set()
+        for _, _, position in ranked:
+            slot = slots[position]
+            name = lowered[starts[slot]:starts[slot + 1]]
+            if name not in names:
+                if len(names) == window:
+                    break
+                names.add(name)
+            best.append(position)
+        return best
+
+
+class SearchIndex(object):
+    """
+    Application wide search over the indexes of every loaded docset.
+
+    Results are cached by query, so going back to an earlier query, e.g.
+    with backspace, costs nothing. The items containing the trigrams of the
+    last fuzzy query are kept as well: while the user keeps typing, the next
+    query only has to narrow them down with its new trigrams instead of
+    intersecting every trigram again.
+    """
+
+    # Docset items must be loaded before they can be searched.
+    needs_items = True
+    # Upper bound on the number of items handed to the fuzzy scorer.
+    MAX_CANDIDATES = 5000
+    # Number of queries whose results are cached
+    CACHE_SIZE = 256
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.join(cache_dir, "index")
+        if not os.path.exists(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Guards the docsets, their indexes and the generation, which are
+        # changed by the loader and main threads while others search
+        self.__lock = threading.Lock()
+        self.__docsets = []
+        self.__indexes = {}
+        self.__generation = 0
+        self.__results = LRUCache(self.CACHE_SIZE)
+        self.__narrowing = None
+
+    @property
+    def generation(self):
+        """
+        Number of times docsets were added or removed, e.g. to tell whether
+        results cached elsewhere are still valid.
+
+        :rtype: int
+        """
+        with self.__lock:
+            return self.__generation
+
+    def __changed(self):
+        # Called with the lock held
+        self.__generation += 1
+        self.__results.clear()
+        self.__narrowing = None
+
+    def index_path(self, docset):
+        """
+        Gets the cache file used for a docset's tables.
+
+        :type docset: tarpon_app.docsets.Docset
+        :rtype: str
+        """
+        filename = "".join(c if c.isalnum() else "_" for c in docset.name)
+        return os.path.join(self.cache_dir, filename + ".idx")
+
+    def add(self, docset):
+        """
+        Adds a docset, loading its tables from the cache or building them.
+
+        :type docset: tarpon_app.docsets.Docset
+        """
+        path = self.index_path(docset)
+        with trace.span("search.add", "search", docset=docset.name):
+            index = DocsetIndex.load(path, docset.signature)
+            if index is None:
+                index = DocsetIndex.build(docset)
+                index.save(path)
+        with self.__lock:
+            self.__remove(docset.name)
+            self.__docsets.append(docset)
+            self.__indexes[docset.name] = index
+            self.__changed()
+
+    def remove(self, name):
+        """
+        Removes a docset from the search.
+
+        :type name: str
+        :param name: name of the docset
+        """
+        with self.__lock:
+            self.__remove(name)
+
+    def __remove(self, name):
+        # Called with the lock held
+        if self.__indexes.pop(name, None) is not None:
+            self.__docsets = [d for d in self.__docsets if d.name != name]
+            self.__changed()
+
+    def search(self, query, limit=5, cancelled=None, default_scope=None):
+        """
+        Finds the items best matching query.
+
+        Items are ranked by tier: exact matches first, then case-insensitive
+        exact matches, prefix matches, matches at a word boundary and other
+        substring matches. Within a tier, results are grouped by docset in
+        the order the docsets were added, and shorter names come first. Only
+        if the tiers hold fewer than ``limit`` items are the trigram
+        candidates scored with fuzzywuzzy, up to :attr:`MAX_CANDIDATES` of
+        them, and those always rank below every tier.
+
+        A query scoped to docsets or item types (see :func:`parse_scope`)
+        only looks at the tables of those docsets, and at the partitions of
+        those types within them.
+
+        :type query: unicode
+        :param query: text typed by the user
+        :type limit: int
+        :param limit: maximum number of results
+        :param cancelled: optional callable polled while searching; the search
+                          is abandoned as soon as it returns True
+        :type default_scope: frozenset
+        :param default_scope: names of the docsets searched when the query
+                              does not name any, or None for every docset
+        :rtype: list or None
+        :returns: :class:`SearchResult` tuples, best first, or None if
+                  cancelled
+        """
+        if isinstance(query, str):
+            query = query.decode("utf-8")
+        # Item names are NFKD normalized when they are read, see read_items
+        query = normalize("NFKD", query)
+        with self.__lock:
+            generation = self.__generation
+            indexes = [(docset, self.__indexes[docset.name])
+                       for docset in self.__docsets]
+        scope, query = parse_scope(query, [d for d, _ in indexes],
+                                   default_scope)
+        stripped = query.strip()
+        lowered = stripped.lower().replace(u"\n", u" ")
+        if not lowered:
+            return []
+        key = (generation, stripped, limit, scope)
+        results = self.__results.get(key)
+        if results is not None:
+            return list(results)
+
+        docsets = [(docset, index) for docset, index in indexes
+                   if scope.docsets is None or docset.name in scope.docsets]
+        tiers = [[] for _ in TIER_SCORES]
+        matched = [set() for _ in docsets]
+        for passes in ((EXACT, EXACT_NOCASE, PREFIX), (WORD, SUBSTRING)):
+            for order, (docset, index) in enumerate(docsets):
+                if cancelled and cancelled():
+                    return None
+                if passes[0] == EXACT:
+                    exact, nocase = [], []
+                    found, prefixed = index.prefix_hits(lowered,
+                                                        scope.types)
+                    for position in found:
+                        if docset.items[position].name == stripped:
+                            exact.append(position)
+                        else:
+                            nocase.append(position)
+                    hits = (exact, nocase, prefixed)
+                else:
+                    hits = index.inner_hits(lowered, scope.types)
+                for tier, positions in zip(passes, hits):
+                    matched[order].update(positions)
+                    positions.sort(key=index.rank_key)
+                    tiers[tier].extend((order, p) for p in positions)
+            if sum(len(tier) for tier in tiers) >= limit:
+                break
+
+        results = []
+        for tier, hits in enumerate(tiers):
+            for order, position in hits[:limit - len(results)]:
+                docset = docsets[order][0]
+                results.append(SearchResult(docset.items[position],
+                                            TIER_SCORES[tier], docset.name,
+                                            position))
+        if len(results) < limit:
+            fuzzy = self.__fuzzy(query, limit - len(results), docsets,
+                                 matched, scope, generation, cancelled)
+            if fuzzy is None:
+                return None
+            results.extend(fuzzy)
+        self.__results.put(key, results)
+        return list(results)
+
+    def __fuzzy(self, query, limit, docsets, matched, scope, generation,
+                cancelled):
+        """
+        Scores the trigram candidates for query that no tier matched.
+
+        :rtype: list or None
+        :returns: at most ``limit`` :class:`SearchResult` tuples, best first,
+                  or None if cancelled
+        """
+        normalized = normalize_name(query)
+        if not normalized:
+            return []
+        # Items containing every trigram of a query contain every trigram
+        # of its prefixes, so the last query's items can be narrowed down.
+        previous = known = None
+        narrowing = self.__narrowing
+        if (narrowing is not None and narrowing[0] == generation and
+                normalized.startswith(narrowing[1])):
+            previous, known = narrowing[2], trigrams(narrowing[1])
+        containing = {}
+
+        candidates = []
+        for order, (docset, index) in enumerate(docsets):
+            if cancelled and cancelled():
+                return None
+            found = None
+            if len(normalized) >= 3:
+                if previous is not None and docset.name in previous:
+                    found = index.containing(normalized,
+                                             previous[docset.name], known)
+                else:
+                    found = index.containing(normalized)
+                containing[docset.name] = found
+            rest = index.candidates(normalized, limit, found)
+            rest.difference_update(matched[order])
+            if scope.types is not None:
+                rest = set(p for p in rest
+                           if index.has_type(p, scope.types))
+            candidates.extend((order, p) for p in sorted(rest))
+        if containing:
+            self.__narrowing = (generation, normalized, containing)
+
+        scored = []
+        # Docsets repeat names, e.g. of methods, which score the same
+        ratios = {}
+        for count, (order, position) in enumerate(
+                candidates[:self.MAX_CANDIDATES]):
+            if count % 256 == 0 and cancelled and cancelled():
+                return None
+            docset, index = docsets[order]
+            item = docset.items[position]
+            ratio = ratios.get(item.name)
+            if ratio is None:
+                ratio = ratios[item.name] = fuzzy_ratio(query, item.name)
+            if ratio > 0:
+                # Rank by the full ratio, but report a score below every tier
+                scored.append((-ratio, order, index.rank_key(position),
+                               SearchResult(item,
+                                            min(ratio, MAX_FUZZY_SCORE),
+                                            docset.name, position)))
+        return [result for _, _, _, result in heapq.nsmallest(limit, scored)]
+
+
+class LRUCache(object):
+    """Thread-safe mapping that keeps only its most recently used entries."""
+
+    def __init__(self, size=256):
+        self.size = size
+        self.__lock = threading.Lock()
+        self.__entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key, default=None):
+        """Gets an entry, marking it as the most recently used."""
+        with self.__lock:
+            if key not in self.__entries:
+                return default
+            value = self.__entries.pop(key)
+            self.__entries[key] = value
+            return value
+
+    def put(self, key, value):
+        """Adds an entry, evicting the least recently used one if full."""
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = value
+            while len(self.__entries) > self.size:
+                self.__entries.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+
+class SearchWorker(threading.Thread):
+    """
+    Runs searches on a background thread.
+
+    Queries are debounced: a search only starts once no newer query has been
+    submitted for ``delay`` seconds. A running search is abandoned as soon as
+    a newer query arrives, so only the results for the latest query are ever
+    handed to ``callback``. The callback is invoked on the worker thread with
+    the query and its results; GUI code should hand them to the main loop.
+
+    ``default_scope`` is an optional callable returning the names of the
+    docsets searched when a query does not name any, or None for every
+    docset. It is called for every search.
+    """
+
+    def __init__(self, index, callback, delay=0.15, limit=5,
+                 default_scope=None):
+        threading.Thread.__init__(self, name="tarpon-search")
+        self.daemon = True
+        self.index = index
+        self.callback = callback
+        self.delay = delay
+        self.limit = limit
+        self.default_scope = default_scope
+        self.__condition = threading.Condition()
+        self.__query = None
+        self.__generation = 0
+        self.__stopped = False
+
+    def submit(self, query):
+        """
+        Queues query, replacing any query that has not finished yet.
+
+        :type query: unicode
+        :param query: text typed by the user
+        """
+        with self.__condition:
+            self.__query = query
+            self.__generation += 1
+            self.__condition.notify()
+
+    def cancel(self):
+        """Drops the pending query and abandons the running search."""
+        with self.__condition:
+            self.__query = None
+            self.__generation += 1
+
+    def stop(self):
+        """Stops the worker thread once the current search returns."""
+        with self.__condition:
+            self.__stopped = True
+            self.__generation += 1
+            self.__condition.notify()
+
+    def __next_query(self):
+        with self.__condition:
+            while self.__query is None and not self.__stopped:
+                self.__condition.wait()
+            generation = None
+            while not self.__stopped and generation != self.__generation:
+                generation = self.__generation
+                self.__condition.wait(self.delay)
+            if self.__stopped or self.__query is None:
+                return None, None
+            query, self.__query = self.__query, None
+            return query, generation
+
+    def run(self):
+        while not self.__stopped:
+            query, generation = self.__next_query()
+            if query is None:
+                continue
+            superseded = lambda: self.__generation != generation
+            scope = self.default_scope() if self.default_scope else None
+            with trace.span("search", "search", query=query):
+                results = self.index.search(query, self.limit, superseded,
+                                            scope)
+            if results is not None and not superseded():
+                self.callback(query, results)
+
+
+class SearchIndexer(threading.Thread):
+    """
+    Adds docsets to a search index in the background.
+
+    Docsets are added one at a time in the order they are queued, so that
+    building their indexes never holds up the thread that loads them.
+    ``callback`` is invoked on the indexer thread with every docset once it
+    is searchable.
+    """
+
+    def __init__(self, index, callback=None):
+        threading.Thread.__init__(self, name="tarpon-indexer")
+        self.daemon = True
+        self.index = index
+        self.callback = callback
+        self.__condition = threading.Condition()
+        self.__queue = deque()
+        self.__stopped = False
+
+    def request(self, docset):
+        """
+        Queues a docset for indexing unless it is already queued.
+
+        :type docset: tarpon_app.docsets.Docset
+        """
+        with self.__condition:
+            if docset not in self.__queue:
+                self.__queue.append(docset)
+                self.__condition.notify()
+
+    def stop(self):
+        """Stops the indexer once the docset it is adding is searchable."""
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify()
+
+    def run(self):
+        while True:
+            with self.__condition:
+                while not self.__queue and not self.__stopped:
+                    self.__condition.wait()
+                if self.__stopped:
+                    return
+                docset = self.__queue.popleft()
+            try:
+                self.index.add(docset)
+            except (sqlite3.Error, EnvironmentError) as e:
+                print("Could not index {0}: {1}".format(docset.name, e))
+                continue
+            if self.callback:
+                self.callback(docset)
@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Memory mapped snapshot of the loaded docsets, for a fast warm start.
+
+Once every requested docset has been loaded, their metadata, item tables
+and the positions of their items of each type are written into one file in
+the cache directory. The next launch maps that file and hands the tables to
+the docsets in place: nothing is parsed, decoded or copied until an item is
+actually read, so the sidebar can be filled as soon as the first window
+opens.
+
+The file starts with a header, then holds the serialized tables, each
+followed by its type positions, and ends with a JSON index describing where
+everything is::
+
+    header    magic, format version, offset and length of the index
+    tables    DocItemTable.dumps() and "I" arrays, 8-byte aligned
+    index     {"docsets": [{"path": ..., "stamp": ..., "table": offset,
+                            "types": {type: [offset, count]}, ...}]}
+
+A docset is only restored if the modification times and sizes of its
+``Info.plist`` and ``docSet.dsidx`` still match the stamp recorded for it.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+
+from tarpon_app.docsets import Docset, DocItemTable, MappedArray
+from tarpon_app.manifest import DocsetManifest
+from tarpon_app import trace
+
+
+class DocsetSnapshot(object):
+    """
+    Snapshot of the loaded docsets kept in ``cache_dir``.
+
+    :type cache_dir: str
+    """
+
+    FILENAME = "snapshot.bin"
+    # magic, format version, index offset, index length
+    HEADER = struct.Struct("=4sBQI")
+    MAGIC = "TSNP"
+    VERSION = 1
+    # Alignment of every table and array in the file
+    ALIGN = 8
+
+    def __init__(self, cache_dir):
+        self.path = os.path.join(cache_dir, self.FILENAME)
+        self.__lock = threading.Lock()
+        self.__save_lock = threading.Lock()
+        self.__map = None
+        self.__entries = None
+
+    def __open(self):
+        """Maps the snapshot and reads its index, once."""
+        if self.__entries is not None:
+            return
+        self.__entries = {}
+        try:
+            with open(self.path, "rb") as snapshot_file:
+                data = mmap.mmap(snapshot_file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return
+        try:
+            if len(data) < self.HEADER.size:
+                raise ValueError("Truncated snapshot")
+            magic, version, offset, length = self.HEADER.unpack_from(data)
+            if magic != self.MAGIC or version != self.VERSION:
+                raise ValueError("Not a snapshot")
+            index = json.loads(data[offset:offset + length])
+        except ValueError:
+            data.close()
+            return
+        self.__map = data
+        self.__entries = dict((entry["path"], entry)
+                              for entry in index["docsets"])
+
+    def restore(self, path, manifest=None):
+        """
+        Creates a docset with its items from the snapshot, if its files
+        have not changed since the snapshot was written.
+
+        :type path: str
+        :param path: path of the ``.docset`` directory
+        :type manifest: tarpon_app.manifest.DocsetManifest
+        :param manifest: manifest the docset records itself in
+        :rtype: tarpon_app.docsets.Docset or None
+        :returns: the docset, or None if it is not in the snapshot or out of
+                  date
+        """
+        with self.__lock:
+            self.__open()
+            entry = self.__entries.get(path)
+            if entry is None or entry["stamp"] != DocsetManifest.stamp(path):
+                return None
+            with trace.span("snapshot.restore", "snapshot", path=path):
+                try:
+                    items = DocItemTable.mapped(self.__map, entry["table"])
+                except ValueError:
+                    return None
+                type_positions = dict(
+                    (str(data_type), MappedArray(self.__map, offset, "I",
+                                                 count))
+                    for data_type, (offset, count)
+                    in entry["types"].iteritems())
+        docset = Docset(entry["name"])
+        docset.path = path
+        docset.identifier = entry["identifier"]
+        docset.index_path = entry["index_path"]
+        docset._type_counts = entry["type_counts"]
+        docset.manifest = manifest
+        docset.restore(items, type_positions)
+        return docset
+
+    def is_current(self, docsets):
+        """
+        Checks whether the snapshot holds exactly these docsets, as they are
+        now on disk.
+
+        :type docsets: list
+        :param docsets: loaded docsets
+        :rtype: bool
+        """
+        with self.__lock:
+            self.__open()
+            entries = self.__entries
+        return (set(entries) == set(docset.path for docset in docsets) and
+                all(entries[docset.path]["stamp"] ==
+                    DocsetManifest.stamp(docset.path)
+                    for docset in docsets))
+
+    def save(self, docsets):
+        """
+        Writes the snapshot, unless it already holds these docsets. Docsets
+        of the previous snapshot that are still up to date are kept, and
+        tables restored from it stay readable, since that file is only
+        replaced, never modified.
+
+        :type docsets: list
+        :param docsets: docsets on disk whose items are loaded
+        :rtype: bool
+        :returns: True if the snapshot was written
+        """
+        with self.__save_lock:
+            return self.__save(docsets)
+
+    def __save(self, docsets):
+        paths = set(docset.path for docset in docsets)
+        with self.__lock:
+            self.__open()
+            kept = sorted(path for path in self.__entries
+                          if path not in paths)
+        docsets = list(docsets) + filter(None, map(self.restore, kept))
+        if self.is_current(docsets):
+            return False
+        entries = []
+        tmp_path = "{0}.{1}.tmp".format(self.path, os.getpid())
+        with trace.span("snapshot.save", "snapshot", docsets=len(docsets)):
+            with open(tmp_path, "wb") as snapshot_file:
+                snapshot_file.write(b"\0" * self.HEADER.size)
+                for docset in docsets:
+                    entry = {"path": docset.path,
+                             "stamp": DocsetManifest.stamp(docset.path),
+                             "name": docset.name,
+                             "identifier": docset.identifier,
+                             "index_path": docset.index_path,
+                             "type_counts": docset.type_counts,
+                             "table": self.__write(snapshot_file,
+                                                   docset.items.dumps()),
+                             "types": {}}
+                    for data_type, positions in sorted(
+                            docset.type_positions.iteritems()):
+                        entry["types"][data_type] = [
+                            self.__write(snapshot_file, positions.tostring()),
+                            len(positions)]
+                    entries.append(entry)
+                index = json.dumps({"docsets": entries})
+                offset = snapshot_file.tell()
+                snapshot_file.write(index)
+                snapshot_file.seek(0)
+                snapshot_file.write(self.HEADER.pack(
+                    self.MAGIC, self.VERSION, offset, len(index)))
+            os.rename(tmp_path, self.path)
+        with self.__lock:
+            # Map the new file when it is next needed. The old map stays
+            # open for as long as restored docsets read from it.
+            self.__map = self.__entries = None
+        return True
+
+    def __write(self, snapshot_file, data):
+        """
+        Appends data to the snapshot, aligned.
+
+        :rtype: int
+        :returns: offset of data in the file
+        """
+        offset = snapshot_file.tell()
+        padding = -offset % self.ALIGN
+        snapshot_file.write(b"\0" * padding)
+        snapshot_file.write(data)
+        return offset + padding
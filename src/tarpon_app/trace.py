@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Timing spans written as Chrome trace events.
+
+Tracing is off unless :func:`enable` is called, which the application does
+when ``TARPON_TRACE`` is set in the environment or ``tarpon.py`` is started
+with ``--trace``. Spans are then appended, one JSON event per line, to
+``traces/trace-<time>-<pid>.jsonl`` in the cache directory. Worker processes
+forked by the docset loader append to the same file.
+
+While tracing is off :func:`span` returns a shared object whose
+``__enter__`` and ``__exit__`` do nothing, so spans are cheap enough to be
+left around coarse operations. They should not wrap work done per item.
+
+To open a trace in ``chrome://tracing`` or Perfetto, convert it with::
+
+    $ python -m tarpon_app.trace trace.jsonl > trace.json
+"""
+
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+ENV_VAR = "TARPON_TRACE"
+
+_writer = None
+
+
+class TraceWriter(object):
+    """Appends trace events to a JSON lines file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.__open()
+
+    def __open(self):
+        self.pid = os.getpid()
+        self.__file = open(self.path, "a")
+        self.__lock = threading.Lock()
+        self.__threads = set()
+
+    def write(self, event):
+        """
+        Appends one event, naming its thread the first time it is seen.
+
+        :type event: dict
+        """
+        if os.getpid() != self.pid:
+            # Forked worker processes get their own file handle and lock
+            self.__open()
+        thread = threading.current_thread()
+        event["pid"] = self.pid
+        event["tid"] = thread.ident
+        lines = []
+        with self.__lock:
+            if thread.ident not in self.__threads:
+                self.__threads.add(thread.ident)
+                lines.append(json.dumps({
+                    "name": "thread_name", "ph": "M", "pid": self.pid,
+                    "tid": thread.ident, "args": {"name": thread.name}}))
+            lines.append(json.dumps(event))
+            self.__file.write("\n".join(lines) + "\n")
+            self.__file.flush()
+
+    def close(self):
+        self.__file.close()
+
+
+class Span(object):
+    """A timed operation, written as a complete ("X") event when it ends."""
+
+    __slots__ = ("name", "category", "args", "start")
+
+    def __init__(self, name, category, args):
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        writer = _writer
+        if writer is not None:
+            end = time.time()
+            event = {"name": self.name, "cat": self.category, "ph": "X",
+                     "ts": int(self.start * 1e6),
+                     "dur": int((end - self.start) * 1e6)}
+            if self.args:
+                event["args"] = self.args
+            if exc_type is not None:
+                event.setdefault("args", {})["error"] = exc_type.__name__
+            writer.write(event)
+        return False
+
+
+class NullSpan(object):
+    """Stands in for :class:`Span` while tracing is off."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def enabled():
+    return _writer is not None
+
+
+def enable(cache_dir):
+    """
+    Starts writing spans to a new trace file in the cache directory.
+
+    :type cache_dir: str
+    :rtype: str
+    :returns: path of the trace file
+    """
+    global _writer
+    trace_dir = os.path.join(cache_dir, "traces")
+    if not os.path.exists(trace_dir):
+        os.makedirs(trace_dir)
+    path = os.path.join(trace_dir, "trace-{0}-{1}.jsonl".format(
+        time.strftime("%Y%m%d-%H%M%S"), os.getpid()))
+    _writer = TraceWriter(path)
+    return path
+
+
+def disable():
+    """Stops tracing and closes the trace file."""
+    global _writer
+    writer, _writer = _writer, None
+    if writer is not None:
+        writer.close()
+
+
+def span(name, category="tarpon", **args):
+    """
+    Times the block of a ``with`` statement.
+
+    :type name: str
+    :type category: str
+    :param category: Chrome trace category, e.g. the module doing the work
+    :param args: values recorded with the span, shown by the trace viewer
+    :rtype: Span or NullSpan
+    """
+    if _writer is None:
+        return NULL_SPAN
+    return Span(name, category, args)
+
+
+def traced(name, category="tarpon"):
+    """
+    Decorates a function so that every call is timed as a span.
+
+    :type name: str
+    :type category: str
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _writer is None:
+                return function(*args, **kwargs)
+            with Span(name, category, None):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def to_chrome_trace(lines):
+    """
+    Converts a JSON lines trace to the Chrome trace format.
+
+    :param lines: iterable of JSON lines
+    :rtype: dict
+    """
+    return {"traceEvents": [json.loads(line) for line in lines
+                            if line.strip()],
+            "displayTimeUnit": "ms"}
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m tarpon_app.trace TRACE.jsonl > TRACE.json")
+    with open(sys.argv[1]) as trace_file:
+        json.dump(to_chrome_trace(trace_file), sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Watches the data and cache directories for docsets coming and going.
+
+Docsets are copied, unpacked and replaced in many steps, so changes are
+collected per path and only reported once a path has been quiet for a
+while. Hidden entries, like the downloader's ``.<name>.unpack`` staging
+directories, and the ``.old`` directories a replaced docset is moved to
+before it is deleted are ignored.
+
+A docset that is still incomplete when it is reported can be reported again
+with :meth:`DocsetWatcher.retry`, a limited number of times; after that it
+is only reported once it changes again.
+"""
+
+import os
+
+from gi.repository import Gio, GLib
+
+
+class DocsetWatcher(object):
+    """
+    Reports ``.docset`` directories in ``data_dir`` and feed caches in
+    ``cache_dir`` that were created, changed, moved or deleted.
+
+    ``callback`` is invoked on the main loop with the sorted paths that
+    changed, once no path has changed for ``delay`` milliseconds.
+
+    :type data_dir: str
+    :type cache_dir: str
+    :param ignore: paths in the cache directory that are not feed caches
+    """
+
+    # Times a path is reported again without changing in between
+    max_retries = 60
+
+    def __init__(self, data_dir, cache_dir, callback, delay=1000,
+                 ignore=()):
+        self.data_dir = os.path.abspath(data_dir)
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.callback = callback
+        self.delay = delay
+        self.ignore = set(ignore)
+        self.__pending = set()
+        self.__retries = {}
+        self.__timeout = None
+        self.__monitors = []
+        for directory in (data_dir, cache_dir):
+            monitor = Gio.File.new_for_path(directory).monitor_directory(
+                Gio.FileMonitorFlags.WATCH_MOVES, None)
+            monitor.connect("changed", self.on_changed)
+            self.__monitors.append(monitor)
+
+    def is_watched(self, path):
+        """
+        Checks whether a path is a docset or feed cache worth reporting.
+
+        :type path: str
+        :rtype: bool
+        """
+        directory, filename = os.path.split(path)
+        if filename.startswith(".") or path in self.ignore:
+            return False
+        if directory == self.data_dir:
+            return filename.endswith(".docset")
+        return directory == self.cache_dir and filename.endswith(".json")
+
+    def retry(self, path):
+        """
+        Reports a path again later, e.g. a docset that was still being
+        copied when it was reported, unless it was already reported again
+        ``max_retries`` times since it last changed.
+
+        :type path: str
+        :rtype: bool
+        :returns: True if the path will be reported again
+        """
+        retries = self.__retries.get(path, 0)
+        if retries >= self.max_retries:
+            return False
+        self.__retries[path] = retries + 1
+        self.__pending.add(path)
+        self.__schedule()
+        return True
+
+    def stop(self):
+        for monitor in self.__monitors:
+            monitor.cancel()
+        self.__monitors = []
+        if self.__timeout is not None:
+            GLib.source_remove(self.__timeout)
+            self.__timeout = None
+
+    def __schedule(self):
+        if self.__timeout is not None:
+            GLib.source_remove(self.__timeout)
+        self.__timeout = GLib.timeout_add(self.delay, self.__flush)
+
+    def __flush(self):
+        self.__timeout = None
+        paths, self.__pending = sorted(self.__pending), set()
+        self.callback(paths)
+        return False
+
+    def on_changed(self, monitor, changed_file, other_file, event_type):
+        paths = [f.get_path() for f in (changed_file, other_file)
+                 if f is not None]
+        paths = [path for path in paths if path and self.is_watched(path)]
+        if paths:
+            for path in paths:
+                self.__retries.pop(path, None)
+            self.__pending.update(paths)
+            self.__schedule()
@@ -6,11 +6,23 @@ import os
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from tarpon_app.application import Application
+from tarpon_app import trace
 
 
 def main():
     """Starts the Tarpon application"""
+    if len(sys.argv) > 1 and sys.argv[1] in ("-q", "--query"):
+        # Answer a query without importing GTK
+        from tarpon_app.cli import main as query
+        sys.exit(query(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        from tarpon_app.daemon import main as serve
+        sys.exit(serve(sys.argv[2:]))
+    if "--trace" in sys.argv:
+        # Handled here as Gtk.Application rejects options it does not know
+        sys.argv.remove("--trace")
+        os.environ[trace.ENV_VAR] = "1"
+    from tarpon_app.application import Application
     app = Application(package="tarpon", version="0 (debug)",
                       pkgdatadir=os.path.join(os.path.dirname(__file__),
                                               'data'))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Small docsets written to temporary directories for the tests."""
+
+import os
+import plistlib
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "src"))
+
+
+def make_docset(root, name, items, pages=None):
+    """
+    Writes a docset.
+
+    :type root: str
+    :param root: directory the ``.docset`` directory is created in
+    :type name: str
+    :type items: list
+    :param items: ``(name, type, path)`` rows of ``searchIndex``
+    :type pages: dict
+    :param pages: HTML of the pages, by path relative to ``Documents``
+    :rtype: str
+    :returns: path of the ``.docset`` directory
+    """
+    path = os.path.join(root, name + ".docset")
+    documents = os.path.join(path, "Contents", "Resources", "Documents")
+    os.makedirs(documents)
+    plistlib.writePlist({"isDashDocset": True, "CFBundleName": name,
+                         "CFBundleIdentifier": name.lower(),
+                         "dashIndexFilePath": "index.html"},
+                        os.path.join(path, "Contents", "Info.plist"))
+    db = sqlite3.connect(os.path.join(path, "Contents", "Resources",
+                                      "docSet.dsidx"))
+    db.execute("CREATE TABLE searchIndex(id INTEGER PRIMARY KEY, "
+               "name TEXT, type TEXT, path TEXT)")
+    db.executemany("INSERT INTO searchIndex(name, type, path) "
+                   "VALUES (?, ?, ?)", items)
+    db.commit()
+    db.close()
+    for page, html in (pages or {}).iteritems():
+        with open(os.path.join(documents, page), "w") as page_file:
+            page_file.write(html)
+    return path
+
+
+class TemporaryDirs(object):
+    """Mixin giving a test case data and cache directories."""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.data_dir)
+        shutil.rmtree(self.cache_dir)
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests of the main window that do not need a display.
+
+Run from the repository root with ``python -m unittest discover tests``.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "src"))
+
+try:
+    from tarpon_app.gtk.components import TarponWindow
+except (ImportError, ValueError):
+    TarponWindow = None
+
+from tarpon_app.docsets import DocItem
+from tarpon_app.search import SearchResult
+
+
+class FakeFilter(object):
+    def __init__(self):
+        self.refiltered = 0
+
+    def refilter(self):
+        self.refiltered += 1
+
+
+class FakeStore(object):
+    """Records the rows added for search results."""
+
+    partial_types = frozenset()
+
+    def __init__(self):
+        self.items = []
+
+    def add_item(self, docset, data_type, position, label):
+        self.items.append((docset.name, data_type, position, label))
+        return object()
+
+
+class UnloadedDocset(object):
+    """Docset whose items must not be read."""
+
+    name = "Py"
+    loaded = False
+
+    @property
+    def items(self):
+        raise AssertionError("the items of the docset were loaded")
+
+
+class FakeApplication(object):
+    def __init__(self):
+        self.docsets = {"Py": UnloadedDocset()}
+        self.requested = []
+
+    def request_docset(self, name, urgent=False):
+        self.requested.append(name)
+
+
+class FakeWindow(object):
+    """Holds the state ``TarponWindow.set_results`` touches."""
+
+    def __init__(self):
+        self._TarponWindow__application = FakeApplication()
+        self._TarponWindow__sidebar_store = FakeStore()
+        self._TarponWindow__sidebar_filter = FakeFilter()
+        self._TarponWindow__results = ["old result"]
+        self._TarponWindow__visible = set([("Old",)])
+        self._TarponWindow__result_paths = {}
+        self.expanded = 0
+        self.collapsed = 0
+
+    def expand_results(self):
+        self.expanded += 1
+
+    def collapse_partial_types(self):
+        self.collapsed += 1
+
+
+@unittest.skipIf(TarponWindow is None, "GTK unavailable")
+class SetResultsTest(unittest.TestCase):
+
+    def test_clearing_the_search_shows_every_row(self):
+        window = FakeWindow()
+        TarponWindow.set_results.__func__(window, None)
+        self.assertIsNone(window._TarponWindow__results)
+        self.assertEqual(window._TarponWindow__visible, set())
+        self.assertEqual(window._TarponWindow__sidebar_filter.refiltered, 1)
+        self.assertEqual(window.collapsed, 1)
+        self.assertEqual(window.expanded, 1)
+
+    def test_results_add_only_their_rows(self):
+        window = FakeWindow()
+        results = [SearchResult(DocItem(u"dict.get", "Method", "a.html"),
+                                100, "Py", 7)]
+        TarponWindow.set_results.__func__(window, results)
+        self.assertEqual(window._TarponWindow__sidebar_store.items,
+                         [("Py", "Method", 7, u"dict.get")])
+        self.assertEqual(window._TarponWindow__application.requested, [])
+        self.assertIn(("Py", "Method", 7), window._TarponWindow__visible)
+        self.assertEqual(window._TarponWindow__result_paths,
+                         {("Py", 7): "a.html"})
+
+
+if __name__ == "__main__":
+    unittest.main()
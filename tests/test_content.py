@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from fixtures import make_docset, TemporaryDirs
+from tarpon_app.content import ContentIndex, page_text
+from tarpon_app.docsets import Docset
+
+
+class PageTextTest(unittest.TestCase):
+
+    def test_block_elements_separate_words(self):
+        title, text = page_text("<title>Page</title><p>Lorem ipsum</p>"
+                                "<p>Lorem <b>ip</b>sum</p><ul><li>a</li>"
+                                "<li>b</li></ul>end<br>next", 1000)
+        self.assertEqual(title, u"Page")
+        self.assertEqual(text, u"Lorem ipsum Lorem ipsum a b end next")
+
+    def test_scripts_are_skipped(self):
+        title, text = page_text("<p>shown</p><script>hidden()</script>", 100)
+        self.assertEqual(text, u"shown")
+
+
+class ContentIndexTest(TemporaryDirs, unittest.TestCase):
+
+    def test_search_finds_words_of_adjacent_elements(self):
+        path = make_docset(self.data_dir, "Lorem", [], {
+            "one.html": "<title>One</title><h1>Usage</h1>"
+                        "<p>Lorem ipsum</p><p>Lorem ipsum</p>",
+            "two.html": "<title>Two</title><div>dolor</div><div>sit</div>"})
+        docset = Docset.frompath(path)
+        index = ContentIndex(self.cache_dir)
+        self.assertTrue(index.update(docset))
+        self.assertTrue(index.is_current(docset))
+        results = index.search(u"lorem", [docset])
+        self.assertEqual([result.path for result in results], ["one.html"])
+        self.assertEqual(results[0].title, u"One")
+        results = index.search(u"dolor sit", [docset])
+        self.assertEqual([result.path for result in results], ["two.html"])
+
+
+if __name__ == "__main__":
+    unittest.main()
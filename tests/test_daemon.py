@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import threading
+import unittest
+import urllib2
+
+from fixtures import make_docset, TemporaryDirs
+from tarpon_app.daemon import QueryServer
+from tarpon_app.library import DocsetLibrary
+
+
+class QueryServerTest(TemporaryDirs, unittest.TestCase):
+
+    def setUp(self):
+        TemporaryDirs.setUp(self)
+        make_docset(self.data_dir, "Py", [
+            (u"dict", "Class", "dict.html"),
+            (u"dict.get", "Method", "dict.html#get"),
+            (u"list", "Class", "list.html")],
+            {"dict.html": "<p>dict</p>"})
+        self.library = DocsetLibrary(self.data_dir, self.cache_dir)
+        self.library.load_docsets()
+        self.library.index_docsets()
+        self.server = QueryServer(self.library, ("127.0.0.1", 0), threads=2)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        TemporaryDirs.tearDown(self)
+
+    def get(self, path):
+        try:
+            response = urllib2.urlopen("http://127.0.0.1:{0}{1}".format(
+                self.server.server_address[1], path))
+            return response.getcode(), response.read()
+        except urllib2.HTTPError as e:
+            return e.code, e.read()
+
+    def test_search(self):
+        status, body = self.get("/search?q=dict.get&limit=1")
+        self.assertEqual(status, 200)
+        results = json.loads(body)["results"]
+        self.assertEqual([(r["name"], r["type"]) for r in results],
+                         [(u"dict.get", u"Method")])
+        self.assertEqual(results[0]["url"], "/docs/Py/dict.html#get")
+
+    def test_limit_out_of_range(self):
+        for limit in ("-3", "0", str(QueryServer.max_limit + 1), "x"):
+            for endpoint in ("search", "content"):
+                status, _ = self.get("/{0}?q=dict&limit={1}".format(
+                    endpoint, limit))
+                self.assertEqual(status, 400, (endpoint, limit))
+
+    def test_cache_follows_index_changes(self):
+        status, body = self.get("/search?q=list")
+        self.assertEqual(len(json.loads(body)["results"]), 1)
+        self.library.search_index.remove("Py")
+        status, body = self.get("/search?q=list")
+        self.assertEqual(json.loads(body)["results"], [])
+
+    def test_page(self):
+        status, body = self.get("/docs/Py/dict.html")
+        self.assertEqual((status, body), (200, "<p>dict</p>"))
+        status, _ = self.get("/docs/Py/../../Info.plist")
+        self.assertEqual(status, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
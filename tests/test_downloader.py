@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import BaseHTTPServer
+import io
+import os
+import re
+import tarfile
+import tempfile
+import threading
+import unittest
+
+from fixtures import make_docset, TemporaryDirs
+from tarpon_app.downloader import DocsetDownloader
+
+
+def make_archive(root, name, extra=()):
+    """
+    Packs a docset into a ``.tgz`` archive.
+
+    :type extra: list
+    :param extra: ``(member name, data)`` of other files to add
+    :rtype: bytes
+    """
+    path = make_docset(root, name, [(u"dict", "Class", "dict.html")], {
+        "dict.html": "<p>dict</p>",
+        # Incompressible, so that the archive spans many reads
+        "blob.bin": os.urandom(256 * 1024)})
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w:gz") as tar:
+        tar.add(path, arcname=os.path.basename(path))
+        for member_name, member_data in extra:
+            info = tarfile.TarInfo(member_name)
+            info.size = len(member_data)
+            tar.addfile(info, io.BytesIO(member_data))
+    return data.getvalue()
+
+
+class ArchiveHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves ``server.archive``, honouring Range if ``server.ranges``."""
+
+    def do_GET(self):
+        archive = self.server.archive
+        requested = self.headers.getheader("Range")
+        self.server.requests.append(requested)
+        match = re.match(r"bytes=(\d+)-$", requested or "")
+        if match and self.server.ranges:
+            start = int(match.group(1))
+            if start >= len(archive):
+                self.send_response(416)
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {0}-{1}/{2}".format(
+                start, len(archive) - 1, len(archive)))
+        else:
+            start = 0
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(archive) - start))
+        self.end_headers()
+        self.wfile.write(archive[start:])
+        self.server.sent += len(archive) - start
+
+    def log_message(self, *args):
+        pass
+
+
+class DocsetDownloaderTest(TemporaryDirs, unittest.TestCase):
+
+    def setUp(self):
+        TemporaryDirs.setUp(self)
+        source = tempfile.mkdtemp(dir=self.cache_dir)
+        self.server = BaseHTTPServer.HTTPServer(("127.0.0.1", 0),
+                                                ArchiveHandler)
+        self.server.archive = make_archive(source, "Py")
+        self.server.ranges = True
+        self.server.requests = []
+        self.server.sent = 0
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = "http://127.0.0.1:{0}/Py.tgz".format(
+            self.server.server_address[1])
+        self.finished = threading.Event()
+        self.downloader = DocsetDownloader(
+            self.data_dir, self.cache_dir,
+            lambda download: self.finished.set())
+
+    def tearDown(self):
+        self.downloader.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        TemporaryDirs.tearDown(self)
+
+    def download(self):
+        download = self.downloader.download("Py", self.url)
+        self.assertTrue(self.finished.wait(30))
+        self.assertIsNone(download.error)
+        return download
+
+    def write_part(self, data):
+        with open(self.downloader.part_path("Py"), "wb") as part_file:
+            part_file.write(data)
+
+    def assertInstalled(self, download):
+        self.assertEqual(download.path,
+                         os.path.join(self.data_dir, "Py.docset"))
+        with open(os.path.join(download.path, "Contents", "Resources",
+                               "Documents", "dict.html")) as page:
+            self.assertEqual(page.read(), "<p>dict</p>")
+        self.assertFalse(os.path.exists(self.downloader.part_path("Py")))
+        self.assertEqual(sorted(os.listdir(self.data_dir)), ["Py.docset"])
+
+    def test_download_is_unpacked_while_streamed(self):
+        download = self.download()
+        self.assertInstalled(download)
+        self.assertEqual(self.server.requests, [None])
+        self.assertEqual(download.received, len(self.server.archive))
+        self.assertEqual(download.total, len(self.server.archive))
+
+    def test_partial_download_is_resumed(self):
+        archive = self.server.archive
+        offset = len(archive) // 2
+        self.write_part(archive[:offset])
+        download = self.download()
+        self.assertInstalled(download)
+        self.assertEqual(self.server.requests,
+                         ["bytes={0}-".format(offset)])
+        self.assertEqual(self.server.sent, len(archive) - offset)
+        self.assertEqual(download.total, len(archive))
+
+    def test_server_without_ranges_sends_everything(self):
+        self.server.ranges = False
+        self.write_part(self.server.archive[:1000])
+        self.assertInstalled(self.download())
+        self.assertEqual(self.server.sent, len(self.server.archive))
+
+    def test_stale_partial_download_starts_over(self):
+        self.write_part(self.server.archive + b"\0" * 100)
+        self.assertInstalled(self.download())
+        self.assertEqual(self.server.requests[1:], [None])
+
+    def test_members_outside_the_destination_are_skipped(self):
+        self.server.archive = make_archive(
+            tempfile.mkdtemp(dir=self.cache_dir), "Py",
+            [("../escaped.txt", b"x"), ("/tmp/absolute.txt", b"x")])
+        self.assertInstalled(self.download())
+        self.assertFalse(os.path.exists(os.path.join(
+            os.path.dirname(self.data_dir), "escaped.txt")))
+        self.assertFalse(os.path.exists("/tmp/absolute.txt"))
+
+    def test_failed_download_keeps_no_docset(self):
+        self.server.archive = b"not an archive" * 1000
+        download = self.downloader.download("Py", self.url)
+        self.assertTrue(self.finished.wait(30))
+        self.assertIsNotNone(download.error)
+        self.assertIsNone(download.path)
+        self.assertEqual(os.listdir(self.data_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
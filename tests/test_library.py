@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import plistlib
+import shutil
+import unittest
+
+from fixtures import make_docset, TemporaryDirs
+from tarpon_app.docsets import InvalidDocsetException
+from tarpon_app.library import DocsetLibrary
+
+
+ITEMS = [(u"dict", "Class", "dict.html")]
+
+
+class SyncDocsetTest(TemporaryDirs, unittest.TestCase):
+
+    def setUp(self):
+        TemporaryDirs.setUp(self)
+        self.library = DocsetLibrary(self.data_dir, self.cache_dir)
+
+    def test_added_changed_and_removed(self):
+        path = make_docset(self.data_dir, "Py", ITEMS)
+        docset, removed = self.library.sync_docset(path)
+        self.assertEqual((docset.name, removed), ("Py", []))
+        self.assertEqual(self.library.sync_docset(path), (None, []))
+        shutil.rmtree(path)
+        docset, removed = self.library.sync_docset(path)
+        self.assertIsNone(docset)
+        self.assertEqual([old.name for old in removed], ["Py"])
+        self.assertNotIn("Py", self.library.docsets)
+
+    def test_incomplete_docset_is_not_read(self):
+        path = make_docset(self.data_dir, "Py", ITEMS)
+        os.remove(os.path.join(path, "Contents", "Resources",
+                               "docSet.dsidx"))
+        self.assertFalse(self.library.is_complete(path))
+        self.assertEqual(self.library.sync_docset(path), (None, []))
+        self.assertEqual(self.library.docsets, {})
+
+    def test_invalid_docset_raises(self):
+        path = make_docset(self.data_dir, "Py", ITEMS)
+        plistlib.writePlist({"isDashDocset": False, "CFBundleName": "Py"},
+                            os.path.join(path, "Contents", "Info.plist"))
+        self.assertRaises(InvalidDocsetException,
+                          self.library.sync_docset, path)
+        self.assertEqual(self.library.docsets, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
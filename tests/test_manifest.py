@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+import unittest
+
+from fixtures import make_docset, TemporaryDirs
+from tarpon_app.docsets import Docset
+from tarpon_app.manifest import DocsetManifest
+
+
+ITEMS = [(u"dict", "Class", "dict.html"),
+         (u"dict.get", "Method", "dict.html#get"),
+         (u"naïve", "Function", "naive.html")]
+
+
+def rows(items):
+    return [(item.name, item.data_type, item.path) for item in items]
+
+
+class DocsetManifestTest(TemporaryDirs, unittest.TestCase):
+
+    def setUp(self):
+        TemporaryDirs.setUp(self)
+        self.path = make_docset(self.data_dir, "Py", ITEMS)
+        manifest = DocsetManifest(self.cache_dir)
+        docset = Docset.frompath(self.path, manifest=manifest)
+        docset.items
+        manifest.update(docset)
+        manifest.save()
+        self.items = rows(docset.items)
+
+    def test_docset_is_restored_with_its_items(self):
+        manifest = DocsetManifest(self.cache_dir)
+        entry = manifest.lookup(self.path)
+        self.assertEqual((entry["name"], entry["identifier"]), ("Py", "py"))
+        docset = Docset.frompath(self.path, manifest=manifest)
+        self.assertTrue(docset.items_cached)
+        self.assertEqual(rows(docset.items), self.items)
+        self.assertEqual(docset.type_counts,
+                         {"Class": 1, "Method": 1, "Function": 1})
+
+    def test_changed_docset_is_forgotten(self):
+        db = sqlite3.connect(os.path.join(self.path, "Contents", "Resources",
+                                          "docSet.dsidx"))
+        db.execute("INSERT INTO searchIndex(name, type, path) "
+                   "VALUES ('list', 'Class', 'list.html')")
+        db.commit()
+        db.close()
+        manifest = DocsetManifest(self.cache_dir)
+        self.assertIsNone(manifest.lookup(self.path))
+        self.assertFalse(os.path.exists(manifest.items_path(self.path)))
+        docset = Docset.frompath(self.path, manifest=manifest)
+        self.assertFalse(docset.items_cached)
+        self.assertEqual(len(docset.items), len(ITEMS) + 1)
+
+    def test_other_versions_are_ignored(self):
+        with open(os.path.join(self.cache_dir, "manifest.json"), "w") as f:
+            f.write('{"version": 0, "docsets": {"x": {}}}')
+        self.assertIsNone(DocsetManifest(self.cache_dir).lookup("x"))
+
+
+if __name__ == "__main__":
+    unittest.main()
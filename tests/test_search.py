@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import sqlite3
+import threading
+import unittest
+
+from fixtures import make_docset, TemporaryDirs
+from tarpon_app.docsets import Docset
+from tarpon_app.fts import FTSIndex
+from tarpon_app.search import SearchIndex, SearchIndexer
+
+
+ITEMS = [(u"dict", "Class", "dict.html"),
+         (u"dict.get", "Method", "dict.html#get"),
+         (u"dict.items", "Method", "dict.html#items"),
+         (u"list", "Class", "list.html")]
+
+
+class FuzzySearchTest(TemporaryDirs, unittest.TestCase):
+
+    def test_misspelt_query_finds_names_among_ties(self):
+        # Every "dict.a###" shares as many trigrams with the query as
+        # "dict.get", and sorts before it
+        items = [(u"dict", "Class", "dict.html")]
+        items += [(u"dict.a{0:03d}".format(i), "Method", "dict.html")
+                  for i in range(300)]
+        items.append((u"dict.get", "Method", "dict.html#get"))
+        docset = Docset.frompath(make_docset(self.data_dir, "Py", items))
+        index = SearchIndex(self.cache_dir)
+        index.add(docset)
+        results = index.search(u"dictge", limit=5)
+        self.assertEqual(results[0].item.name, u"dict.get")
+        self.assertEqual(results[0].position, len(items) - 1)
+
+
+class FTSIndexTest(TemporaryDirs, unittest.TestCase):
+
+    def setUp(self):
+        TemporaryDirs.setUp(self)
+        self.docset = Docset.frompath(make_docset(
+            self.data_dir, "Py", ITEMS + [(u"na\u00efve", "Function",
+                                           "naive.html")]))
+        self.index = FTSIndex(self.cache_dir)
+        try:
+            self.index.add(self.docset)
+        except sqlite3.OperationalError as e:
+            self.skipTest("FTS5 unavailable: {0}".format(e))
+
+    def test_tiers(self):
+        results = self.index.search(u"dict", limit=3)
+        self.assertEqual([(result.item.name, result.score)
+                          for result in results],
+                         [(u"dict", 100), (u"dict.get", 95),
+                          (u"dict.items", 95)])
+
+    def test_queries_are_normalized_like_names(self):
+        for query in (u"na\u00efve", u"nai\u0308ve", u"NA\u00cfV"):
+            results = self.index.search(query)
+            self.assertEqual([result.item.path for result in results],
+                             ["naive.html"], query)
+            self.assertEqual(results[0].item.name, u"nai\u0308ve")
+
+    def test_removed_docsets_are_not_searched(self):
+        generation = self.index.generation
+        self.assertEqual(len(self.index.search(u"list")), 1)
+        self.index.remove("Py")
+        self.assertGreater(self.index.generation, generation)
+        self.assertEqual(self.index.search(u"list"), [])
+
+
+class SearchIndexerTest(TemporaryDirs, unittest.TestCase):
+
+    def test_docsets_become_searchable(self):
+        docset = Docset.frompath(make_docset(self.data_dir, "Py", ITEMS))
+        index = SearchIndex(self.cache_dir)
+        indexed = threading.Event()
+        indexer = SearchIndexer(index, lambda docset: indexed.set())
+        indexer.start()
+        try:
+            indexer.request(docset)
+            self.assertTrue(indexed.wait(10))
+        finally:
+            indexer.stop()
+        results = index.search(u"list")
+        self.assertEqual([result.item.name for result in results], [u"list"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import unittest
+
+from fixtures import make_docset, TemporaryDirs
+from tarpon_app.docsets import Docset
+from tarpon_app.snapshot import DocsetSnapshot
+
+
+ITEMS = [(u"dict", "Class", "dict.html"),
+         (u"dict.get", "Method", "dict.html#get"),
+         (u"list", "Class", "list.html")]
+
+
+def rows(items):
+    return [(item.name, item.data_type, item.path) for item in items]
+
+
+class DocsetSnapshotTest(TemporaryDirs, unittest.TestCase):
+
+    def setUp(self):
+        TemporaryDirs.setUp(self)
+        self.docsets = []
+        for name in ("Py", "Js"):
+            docset = Docset.frompath(make_docset(self.data_dir, name, ITEMS))
+            docset.items
+            self.docsets.append(docset)
+
+    def test_docsets_are_restored_with_their_items(self):
+        self.assertTrue(DocsetSnapshot(self.cache_dir).save(self.docsets))
+        snapshot = DocsetSnapshot(self.cache_dir)
+        self.assertTrue(snapshot.is_current(self.docsets))
+        self.assertFalse(snapshot.save(self.docsets))
+        docset = snapshot.restore(self.docsets[0].path)
+        self.assertEqual(docset.name, "Py")
+        self.assertTrue(docset.loaded)
+        self.assertEqual(rows(docset.items), ITEMS)
+        self.assertEqual(
+            dict((data_type, list(positions)) for data_type, positions
+                 in docset.type_positions.iteritems()),
+            {"Class": [0, 2], "Method": [1]})
+
+    def test_changed_docsets_are_not_restored(self):
+        DocsetSnapshot(self.cache_dir).save(self.docsets)
+        path = self.docsets[0].path
+        with open(os.path.join(path, "Contents", "Resources",
+                               "docSet.dsidx"), "ab") as db_file:
+            db_file.write(b"\0")
+        snapshot = DocsetSnapshot(self.cache_dir)
+        self.assertIsNone(snapshot.restore(path))
+        self.assertFalse(snapshot.is_current(self.docsets))
+
+    def test_saving_keeps_docsets_still_on_disk(self):
+        snapshot = DocsetSnapshot(self.cache_dir)
+        self.assertTrue(snapshot.save(self.docsets[:1]))
+        restored = snapshot.restore(self.docsets[0].path)
+        self.assertTrue(snapshot.save(self.docsets[1:]))
+        self.assertFalse(snapshot.save(self.docsets[:1]))
+        # Tables mapped from the replaced file stay readable
+        self.assertEqual(rows(restored.items), ITEMS)
+        snapshot = DocsetSnapshot(self.cache_dir)
+        self.assertTrue(snapshot.is_current(self.docsets))
+
+    def test_missing_or_corrupt_snapshot(self):
+        snapshot = DocsetSnapshot(self.cache_dir)
+        self.assertIsNone(snapshot.restore(self.docsets[0].path))
+        with open(snapshot.path, "wb") as snapshot_file:
+            snapshot_file.write(b"TSNP garbage")
+        snapshot = DocsetSnapshot(self.cache_dir)
+        self.assertIsNone(snapshot.restore(self.docsets[0].path))
+
+
+if __name__ == "__main__":
+    unittest.main()